@@ -0,0 +1,45 @@
+-- Update Schema V10: marcas de versión para sincronización incremental (delta) de activities
+
+-- 1. Columnas de versión
+ALTER TABLE activities ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+ALTER TABLE activities ADD COLUMN IF NOT EXISTS row_version BIGINT NOT NULL DEFAULT 1;
+
+-- Índice para la sonda (max updated_at) y la lectura delta (updated_at >= marca)
+CREATE INDEX IF NOT EXISTS idx_activities_updated_at ON activities (updated_at);
+
+-- 2. Trigger: el servidor mantiene las marcas (se ignoran los valores enviados por el cliente)
+CREATE OR REPLACE FUNCTION trg_touch_row_version()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        NEW.updated_at := clock_timestamp();
+        NEW.row_version := 1;
+        RETURN NEW;
+    END IF;
+
+    -- Un upsert sin cambios reales no mueve la marca
+    NEW.updated_at := OLD.updated_at;
+    NEW.row_version := OLD.row_version;
+    IF NEW IS NOT DISTINCT FROM OLD THEN
+        RETURN NEW;
+    END IF;
+
+    -- updated_at se mueve con cualquier cambio (la sincronización delta debe verlo).
+    -- row_version solo con cambios de datos del usuario: las columnas que mantienen
+    -- otros triggers (is_blocked v12, has_file_uploaded v7) no generan conflictos
+    -- en las escrituras condicionales.
+    NEW.updated_at := clock_timestamp();
+    IF to_jsonb(NEW) - 'is_blocked' - 'has_file_uploaded' - 'updated_at' - 'row_version'
+       IS DISTINCT FROM to_jsonb(OLD) - 'is_blocked' - 'has_file_uploaded' - 'updated_at' - 'row_version' THEN
+        NEW.row_version := OLD.row_version + 1;
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS activities_touch_row_version ON activities;
+CREATE TRIGGER activities_touch_row_version
+BEFORE INSERT OR UPDATE ON activities
+FOR EACH ROW EXECUTE FUNCTION trg_touch_row_version();
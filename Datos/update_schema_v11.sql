@@ -0,0 +1,69 @@
+-- Update Schema V11: transición de estado atómica en el servidor
+-- Una sola llamada valida dependencias y evidencia y actualiza el estado.
+-- Requiere v7 (has_file_uploaded), v8 (activity_dependencies) y v10 (row_version).
+
+CREATE OR REPLACE FUNCTION transition_activity_status(p_activity_id BIGINT, p_new_status TEXT)
+RETURNS JSON
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_act activities%ROWTYPE;
+    v_flow TEXT[] := ARRAY['PENDING', 'IN_PROGRESS', 'DONE'];
+    v_blocking TEXT;
+    v_row JSON;
+BEGIN
+    -- 1. Bloquear la fila: dos transiciones de la misma actividad se serializan
+    SELECT * INTO v_act FROM activities WHERE id = p_activity_id FOR UPDATE;
+    IF NOT FOUND THEN
+        RETURN json_build_object('ok', false, 'code', 'not_found', 'message', 'Actividad no encontrada');
+    END IF;
+
+    IF NOT p_new_status = ANY (v_flow) THEN
+        RETURN json_build_object('ok', false, 'code', 'invalid_status', 'message', 'Estado no permitido');
+    END IF;
+
+    IF v_act.status = p_new_status THEN
+        RETURN json_build_object('ok', true, 'code', 'unchanged', 'message', 'Sin cambios.', 'row', row_to_json(v_act));
+    END IF;
+
+    -- 2. Dependencias (solo al avanzar; retroceder siempre está permitido).
+    -- FOR SHARE sobre los padres: nadie puede reabrirlos hasta que termine esta transacción.
+    IF array_position(v_flow, p_new_status) > COALESCE(array_position(v_flow, v_act.status), 1) THEN
+        SELECT string_agg(p.activity_code, ', ' ORDER BY p.activity_code) INTO v_blocking
+        FROM (
+            SELECT p.activity_code, p.status
+            FROM activity_dependencies d
+            JOIN activities p ON p.activity_code = d.depends_on_code
+            WHERE d.activity_code = v_act.activity_code
+            FOR SHARE OF p
+        ) p
+        WHERE p.status <> 'DONE';
+
+        IF v_blocking IS NOT NULL THEN
+            RETURN json_build_object('ok', false, 'code', 'blocked', 'message', 'Bloqueado por ' || v_blocking,
+                                     'blocked_by', string_to_array(v_blocking, ', '));
+        END IF;
+    END IF;
+
+    -- 3. Evidencia (has_file_uploaded lo mantiene el trigger de evidence_files, v7)
+    IF p_new_status = 'DONE'
+       AND NULLIF(trim(COALESCE(v_act.evidence_requirement, '')), '') IS NOT NULL
+       AND trim(v_act.evidence_requirement) <> '-'
+       AND NOT COALESCE(v_act.has_file_uploaded, false) THEN
+        RETURN json_build_object('ok', false, 'code', 'evidence_required',
+                                 'message', 'Requisito: Debes subir evidencia ''' || v_act.evidence_requirement || ''' antes de completar.');
+    END IF;
+
+    -- 4. Escritura condicional: solo si la fila sigue en la versión validada
+    UPDATE activities a
+    SET status = p_new_status
+    WHERE a.id = p_activity_id AND a.row_version = v_act.row_version
+    RETURNING row_to_json(a) INTO v_row;
+
+    IF v_row IS NULL THEN
+        RETURN json_build_object('ok', false, 'code', 'conflict', 'message', 'La actividad cambió mientras se actualizaba. Reintenta.');
+    END IF;
+
+    RETURN json_build_object('ok', true, 'code', 'ok', 'message', 'Estado actualizado.', 'row', v_row);
+END;
+$$;
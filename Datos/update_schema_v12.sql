@@ -0,0 +1,113 @@
+-- Update Schema V12: estado "bloqueado" almacenado e indexado
+-- is_blocked = la actividad tiene al menos un padre (activity_dependencies) que no está DONE.
+-- Se recalcula solo para los dependientes directos cuando cambia el estado de un padre
+-- o cuando cambian las aristas, dentro de la misma transacción que la escritura.
+-- Requiere v8 (activity_dependencies) y v10 (updated_at para la sincronización delta).
+
+-- 1. Columna + índice para filtrar sin evaluar dependencias
+ALTER TABLE activities ADD COLUMN IF NOT EXISTS is_blocked BOOLEAN NOT NULL DEFAULT false;
+CREATE INDEX IF NOT EXISTS idx_activities_is_blocked ON activities (is_blocked) WHERE is_blocked;
+
+-- 2. Recalcular un conjunto de actividades (solo escribe las que cambian).
+-- Con un arreglo vacío no ejecuta el UPDATE: un UPDATE de 0 filas igual
+-- dispara los triggers por sentencia.
+CREATE OR REPLACE FUNCTION refresh_activity_blocked(p_codes TEXT[])
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF COALESCE(cardinality(p_codes), 0) = 0 THEN
+        RETURN;
+    END IF;
+
+    UPDATE activities a
+    SET is_blocked = b.blocked
+    FROM (
+        SELECT c.code, EXISTS (
+            SELECT 1
+            FROM activity_dependencies d
+            JOIN activities p ON p.activity_code = d.depends_on_code
+            WHERE d.activity_code = c.code AND p.status <> 'DONE'
+        ) AS blocked
+        FROM unnest(p_codes) AS c(code)
+    ) b
+    WHERE a.activity_code = b.code
+      AND a.is_blocked IS DISTINCT FROM b.blocked;
+END;
+$$;
+
+-- 3. Cambio de estado de un padre -> recalcular sus hijos directos.
+-- Trigger por sentencia: un update().in_() masivo recalcula una sola vez.
+-- Nunca reentra: el UPDATE de is_blocked que hace refresh_activity_blocked
+-- corre dentro de un trigger (profundidad > 1) y además no cambia ningún status,
+-- así que el conjunto de hijos a recalcular sale vacío.
+CREATE OR REPLACE FUNCTION trg_activities_status_blocked()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_codes TEXT[];
+BEGIN
+    IF pg_trigger_depth() > 1 THEN
+        RETURN NULL;
+    END IF;
+
+    v_codes := ARRAY(
+        SELECT DISTINCT d.activity_code
+        FROM new_rows n
+        JOIN old_rows o ON o.id = n.id
+        JOIN activity_dependencies d ON d.depends_on_code = n.activity_code
+        WHERE o.status IS DISTINCT FROM n.status
+    );
+    IF cardinality(v_codes) = 0 THEN
+        RETURN NULL;
+    END IF;
+
+    PERFORM refresh_activity_blocked(v_codes);
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS activities_status_blocked ON activities;
+CREATE TRIGGER activities_status_blocked
+AFTER UPDATE ON activities
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION trg_activities_status_blocked();
+
+-- 4. Cambio de aristas -> recalcular las actividades hijas afectadas
+CREATE OR REPLACE FUNCTION trg_dependencies_blocked()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_codes TEXT[] := ARRAY(SELECT DISTINCT activity_code FROM changed);
+BEGIN
+    IF cardinality(v_codes) = 0 THEN
+        RETURN NULL;
+    END IF;
+
+    PERFORM refresh_activity_blocked(v_codes);
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS dependencies_blocked_ins ON activity_dependencies;
+CREATE TRIGGER dependencies_blocked_ins
+AFTER INSERT ON activity_dependencies
+REFERENCING NEW TABLE AS changed
+FOR EACH STATEMENT EXECUTE FUNCTION trg_dependencies_blocked();
+
+DROP TRIGGER IF EXISTS dependencies_blocked_upd ON activity_dependencies;
+CREATE TRIGGER dependencies_blocked_upd
+AFTER UPDATE ON activity_dependencies
+REFERENCING NEW TABLE AS changed
+FOR EACH STATEMENT EXECUTE FUNCTION trg_dependencies_blocked();
+
+DROP TRIGGER IF EXISTS dependencies_blocked_del ON activity_dependencies;
+CREATE TRIGGER dependencies_blocked_del
+AFTER DELETE ON activity_dependencies
+REFERENCING OLD TABLE AS changed
+FOR EACH STATEMENT EXECUTE FUNCTION trg_dependencies_blocked();
+
+-- 5. Backfill
+SELECT refresh_activity_blocked(ARRAY(SELECT activity_code FROM activities));
@@ -0,0 +1,4 @@
+-- Update Schema V13: columnas del formato de importación "Cronograma Maestro"
+-- El importador escribe is_gate_blocker cuando el archivo la trae (phase_id se deriva de las semanas).
+
+ALTER TABLE activities ADD COLUMN IF NOT EXISTS is_gate_blocker BOOLEAN NOT NULL DEFAULT false;
@@ -0,0 +1,30 @@
+-- Update Schema V14: transiciones de estado masivas en el servidor
+-- Aplica un lote de cambios de estado en una sola llamada y una sola transacción.
+-- Cada fila pasa por transition_activity_status (v11): bloqueo de fila, dependencias,
+-- evidencia y escritura condicional por row_version. Las filas rechazadas no detienen el lote.
+-- Requiere v11.
+
+CREATE OR REPLACE FUNCTION transition_activity_status_batch(p_ids BIGINT[], p_statuses TEXT[])
+RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_results JSONB := '[]'::jsonb;
+    v_result JSONB;
+BEGIN
+    IF COALESCE(cardinality(p_ids), 0) <> COALESCE(cardinality(p_statuses), 0) THEN
+        RAISE EXCEPTION 'p_ids y p_statuses deben tener el mismo largo';
+    END IF;
+
+    FOR i IN 1 .. COALESCE(cardinality(p_ids), 0) LOOP
+        v_result := transition_activity_status(p_ids[i], p_statuses[i])::jsonb;
+        -- id y código siempre presentes (la respuesta de un rechazo no trae la fila)
+        v_result := v_result || jsonb_build_object(
+            'id', p_ids[i],
+            'activity_code', (SELECT activity_code FROM activities WHERE id = p_ids[i]));
+        v_results := v_results || jsonb_build_array(v_result);
+    END LOOP;
+
+    RETURN v_results;
+END;
+$$;
@@ -0,0 +1,65 @@
+-- Update Schema V7: has_file_uploaded mantenido de forma incremental
+-- Después de aplicarlo, configurar GWP_FILE_FLAG_TRIGGER=true (secrets de Streamlit o
+-- variable de entorno): la app deja de recalcular el flag tras cada subida/borrado
+-- y confía en este trigger. Sin la migración debe quedar en false (valor por defecto).
+
+-- 1. Recalcula el flag de UNA actividad (solo escribe si cambia)
+CREATE OR REPLACE FUNCTION refresh_activity_file_flag(p_activity_code TEXT)
+RETURNS VOID
+LANGUAGE sql
+AS $$
+    UPDATE activities a
+    SET has_file_uploaded = f.has_file
+    FROM (
+        SELECT EXISTS (SELECT 1 FROM evidence_files e WHERE e.activity_code = p_activity_code) AS has_file
+    ) f
+    WHERE a.activity_code = p_activity_code
+      AND a.has_file_uploaded IS DISTINCT FROM f.has_file;
+$$;
+
+-- 2. Trigger: cada alta/baja de evidencia recalcula solo el activity_code afectado
+CREATE OR REPLACE FUNCTION trg_evidence_files_flag()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM refresh_activity_file_flag(NEW.activity_code);
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM refresh_activity_file_flag(OLD.activity_code);
+    ELSIF OLD.activity_code IS DISTINCT FROM NEW.activity_code THEN
+        PERFORM refresh_activity_file_flag(OLD.activity_code);
+        PERFORM refresh_activity_file_flag(NEW.activity_code);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS evidence_files_flag ON evidence_files;
+CREATE TRIGGER evidence_files_flag
+AFTER INSERT OR DELETE OR UPDATE OF activity_code ON evidence_files
+FOR EACH ROW EXECUTE FUNCTION trg_evidence_files_flag();
+
+-- 3. Reconciliación completa (reparar desvíos). Devuelve filas corregidas.
+CREATE OR REPLACE FUNCTION reconcile_has_file_uploaded()
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    fixed INTEGER;
+BEGIN
+    UPDATE activities a
+    SET has_file_uploaded = x.has_file
+    FROM (
+        SELECT a2.id, EXISTS (SELECT 1 FROM evidence_files e WHERE e.activity_code = a2.activity_code) AS has_file
+        FROM activities a2
+    ) x
+    WHERE a.id = x.id
+      AND a.has_file_uploaded IS DISTINCT FROM x.has_file;
+    GET DIAGNOSTICS fixed = ROW_COUNT;
+    RETURN fixed;
+END;
+$$;
+
+-- Backfill inicial
+SELECT reconcile_has_file_uploaded();
@@ -0,0 +1,32 @@
+-- Update Schema V8: Dependencias múltiples (DAG) entre actividades
+
+-- 1. Tabla muchos-a-muchos: activity_code depende de depends_on_code
+CREATE TABLE IF NOT EXISTS activity_dependencies (
+    activity_code TEXT NOT NULL REFERENCES activities(activity_code) ON UPDATE CASCADE ON DELETE CASCADE,
+    depends_on_code TEXT NOT NULL REFERENCES activities(activity_code) ON UPDATE CASCADE ON DELETE CASCADE,
+    PRIMARY KEY (activity_code, depends_on_code),
+    CHECK (activity_code <> depends_on_code)
+);
+
+-- Búsqueda inversa (hijos de una actividad)
+CREATE INDEX IF NOT EXISTS idx_dependencies_parent ON activity_dependencies(depends_on_code);
+
+ALTER TABLE activity_dependencies ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS "Enable all dependencies" ON activity_dependencies;
+CREATE POLICY "Enable all dependencies" ON activity_dependencies FOR ALL USING (true) WITH CHECK (true);
+
+-- 2. Nulos canónicos: '-', '?', 'nan', '0', '' ... pasan a NULL
+UPDATE activities
+SET dependency_code = NULL
+WHERE lower(trim(coalesce(dependency_code, ''))) IN ('', '-', '–', '—', '?', 'nan', 'none', 'null', '0');
+
+-- 3. Backfill de aristas desde dependency_code ('A, B' -> 2 aristas).
+-- Códigos inexistentes (referencias externas) no se guardan como arista.
+INSERT INTO activity_dependencies (activity_code, depends_on_code)
+SELECT DISTINCT a.activity_code, trim(p.code)
+FROM activities a
+CROSS JOIN LATERAL regexp_split_to_table(a.dependency_code, '[,;]') AS p(code)
+WHERE a.dependency_code IS NOT NULL
+  AND trim(p.code) <> a.activity_code
+  AND EXISTS (SELECT 1 FROM activities b WHERE b.activity_code = trim(p.code))
+ON CONFLICT DO NOTHING;
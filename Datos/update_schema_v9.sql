@@ -0,0 +1,87 @@
+-- Update Schema V9: Agregados del Dashboard en el servidor
+-- El dashboard recibe un JSON de tamaño constante en vez de las tablas completas.
+-- Requiere v8 (activity_dependencies) y project_meta.start_date (v5).
+
+CREATE OR REPLACE FUNCTION dashboard_summary(p_today DATE DEFAULT CURRENT_DATE)
+RETURNS JSON
+LANGUAGE sql
+STABLE
+AS $$
+WITH meta AS (
+    SELECT COALESCE((SELECT value FROM project_meta WHERE key = 'start_date')::date, p_today) AS project_start
+),
+acts AS (
+    -- Semana 1 = fecha de inicio; semanas vacías o 0 cuentan como semana 1
+    SELECT a.activity_code, a.task_name, a.status, a.primary_role, a.co_responsibles,
+           a.product_code, a.evidence_requirement, a.week_start, a.week_end,
+           m.project_start + (COALESCE(NULLIF(a.week_end, 0), 1) * 7 - 1) AS end_date,
+           EXISTS (
+               SELECT 1
+               FROM activity_dependencies d
+               JOIN activities p ON p.activity_code = d.depends_on_code
+               WHERE d.activity_code = a.activity_code AND p.status <> 'DONE'
+           ) AS dep_blocked
+    FROM activities a CROSS JOIN meta m
+)
+SELECT json_build_object(
+    'totals', (
+        SELECT json_build_object(
+            'total', count(*),
+            'done', count(*) FILTER (WHERE status = 'DONE'),
+            'in_progress', count(*) FILTER (WHERE status = 'IN_PROGRESS'),
+            'blocked', count(*) FILTER (WHERE status = 'BLOCKED' OR (status = 'PENDING' AND dep_blocked)),
+            'pending', count(*) FILTER (WHERE status = 'PENDING' AND NOT dep_blocked),
+            'delayed', count(*) FILTER (WHERE status <> 'DONE' AND end_date < p_today)
+        )
+        FROM acts
+    ),
+    'status_by_role', (
+        SELECT COALESCE(json_agg(x), '[]'::json)
+        FROM (SELECT status, primary_role, count(*) AS n FROM acts GROUP BY status, primary_role) x
+    ),
+    'product_progress', (
+        SELECT COALESCE(json_agg(x), '[]'::json)
+        FROM (
+            SELECT split_part(product_code, ' | ', 1) AS product_code,
+                   count(*) AS total,
+                   count(*) FILTER (WHERE status = 'DONE') AS done
+            FROM acts
+            GROUP BY 1
+        ) x
+    ),
+    'evidence', (
+        SELECT json_build_object(
+            'required', count(*),
+            'covered', count(*) FILTER (WHERE EXISTS (SELECT 1 FROM evidence_files e WHERE e.activity_code = acts.activity_code)),
+            'last_upload', (SELECT max(uploaded_at) FROM evidence_files)
+        )
+        FROM acts
+        WHERE upper(evidence_requirement) = 'SI'
+    ),
+    'bottlenecks', (
+        -- Actividades no finalizadas que bloquean a más actividades no finalizadas
+        SELECT COALESCE(json_agg(x ORDER BY x.deps DESC, x.activity_code), '[]'::json)
+        FROM (
+            SELECT p.activity_code, p.task_name, p.status, p.primary_role, p.co_responsibles,
+                   p.week_start, p.week_end, count(*) AS deps
+            FROM activity_dependencies d
+            JOIN acts c ON c.activity_code = d.activity_code AND c.status <> 'DONE'
+            JOIN acts p ON p.activity_code = d.depends_on_code AND p.status <> 'DONE'
+            GROUP BY p.activity_code, p.task_name, p.status, p.primary_role, p.co_responsibles, p.week_start, p.week_end
+            ORDER BY deps DESC, p.activity_code
+            LIMIT 5
+        ) x
+    ),
+    'upcoming', (
+        SELECT COALESCE(json_agg(x ORDER BY x.end_date, x.activity_code), '[]'::json)
+        FROM (
+            SELECT activity_code, task_name, status, primary_role, co_responsibles, week_start, week_end, end_date
+            FROM acts
+            WHERE status <> 'DONE' AND end_date BETWEEN p_today AND p_today + 7
+            ORDER BY end_date, activity_code
+            LIMIT 5
+        ) x
+    )
+);
+$$;
+
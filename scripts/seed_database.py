@@ -1,28 +1,19 @@
 import os
+import sys
 import pandas as pd
 from supabase import create_client
 from dotenv import load_dotenv
 
+# Shared derivation rules (roles, dependencies, type) live in src/logic.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from logic import derive_activity_fields, unknown_responsibles, users_role_mapping, DEFAULT_ROLE, NULL_TEXT_TOKENS
+
 # Load .env for local script execution
 load_dotenv()
 
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 
-# Mapping rules
-ROLE_MAPPING = {
-    "Astrid": "COORD",
-    "Patricio": "FINANZAS",
-    "Constanza": "LEGAL",
-    "Todos": "COORD",
-    "GOV": "GOBIERNO"
-}
-
-def map_role(name):
-    if not isinstance(name, str): return "COORD"
-    clean_name = name.strip()
-    return ROLE_MAPPING.get(clean_name, clean_name) # Fallback to original if not mapped
-
 def seed_database():
     if not SUPABASE_URL or not SUPABASE_KEY:
         print("❌ Error: SUPABASE_URL and SUPABASE_KEY are missing.")
@@ -54,7 +45,7 @@ def seed_database():
         df = pd.read_csv(csv_path, encoding='cp1252')
 
     activities_list = []
-    print("Processing rows and mapping roles...")
+    print("Processing rows...")
 
     for _, row in df.iterrows():
         # Robust column retrieval (Handling potential CSV header variations)
@@ -64,21 +55,14 @@ def seed_database():
         if not name and 'Actividad ' in row: name = row['Actividad '] # Common trailing space issue
         
         dep = row.get('Depende de') or row.get('dependency_code') or row.get('dependencies_text')
-        # Clean dependency
-        if pd.isna(dep) or str(dep).strip() in ['-', '?', 'nan']:
-            dep = None
-        else:
-            dep = str(dep).strip()
 
         evidence = row.get('Evidencia') or row.get('evidence_requirement') or row.get('evidence_expected')
-        if pd.isna(evidence) or str(evidence).strip() in ['-', '?', 'nan', '']:
+        if pd.isna(evidence) or str(evidence).strip().lower() in NULL_TEXT_TOKENS:
             evidence = None
         else:
             evidence = str(evidence).strip()
 
         raw_role = row.get('Resp. primario') or row.get('primary_role') or row.get('responsible_role')
-        role = map_role(raw_role)
-
         co_resp = row.get('Co-responsables') or row.get('co_responsibles')
         
         # Weeks
@@ -91,16 +75,25 @@ def seed_database():
             "task_name": str(name).strip(),
             "week_start": int(w_start) if pd.notna(w_start) else None,
             "week_end": int(w_end) if pd.notna(w_end) else None,
-            "type_tag": str(row.get('Tipo') or row.get('type_tag')).strip(),
+            "type_tag": row.get('Tipo') or row.get('type_tag'), # Derived below only when empty
             "dependency_code": dep,
             "evidence_requirement": evidence,
-            "primary_role": role,
+            "primary_role": raw_role, # Responsible name or role code, mapped below
             "co_responsibles": str(co_resp) if pd.notna(co_resp) else None,
             "status": "PENDING",
             "has_file_uploaded": False
             # is_gate_blocker could be inferred or added if in CSV. Assuming default false or column handling if exists.
         })
 
+    # Derived columns (role, canonical dependencies, type) with the same rules as the app
+    users = supabase.table("users").select("full_name, role").execute().data
+    name_to_role = users_role_mapping(pd.DataFrame(users))
+    activities_df = pd.DataFrame(activities_list)
+    unknown = activities_df.loc[unknown_responsibles(activities_df['primary_role'], name_to_role), 'primary_role'].unique()
+    if len(unknown):
+        print(f"⚠️ Unknown responsibles, assigned to {DEFAULT_ROLE}: {', '.join(map(str, unknown))}")
+    activities_list = derive_activity_fields(activities_df, name_to_role, keep_type_tag=True).to_dict('records')
+
     print(f"Upserting {len(activities_list)} records to 'activities' table...")
     
     # Supabase Upsert (Batching if necessary, but 100 is usually fine)
@@ -1,10 +1,12 @@
 import streamlit as st
 import pandas as pd
 import altair as alt
+import zlib
 from datetime import datetime, timedelta, date
-from db import init_connection, get_table_df, upsert_data, get_project_meta, update_project_meta, update_activity_status_flow, seed_master_defaults, seed_activities_from_csv, upload_evidence, get_evidence_by_activity, get_evidence_url, get_all_evidence, delete_evidence, sync_activities_file_status
-from logic import check_dependencies_blocking, check_is_blocked, check_can_complete, update_activity_status, get_dashboard_metrics, move_mechanism_stage, generate_graphviz_dot, PHASES_CONFIG
-from components import render_kanban_card, render_mechanism_card, render_gantt_chart
+from db import init_connection, get_table_df, get_table_page, prefetch_tables, upsert_data, get_dashboard_summary, get_dependency_edges, get_project_meta, update_project_meta, update_activities_status_batch, save_activity_changes, seed_master_defaults, seed_activities_from_csv, upload_evidence, get_evidence_by_activity, get_evidence_index, get_evidence_url, get_evidence_urls, get_all_evidence, EVIDENCE_LIST_COLUMNS, delete_evidence, sync_activities_file_status
+from logic import check_dependencies_blocking, edges_from_dependency_column, build_dependency_index, compute_blocked_mask, get_blocking_parents, parse_dependency_codes, validate_dependency_graph, is_valid_dependency_report, format_dependency_report, check_can_complete, validate_status_transitions, STATUS_FLOW, derive_activity_fields, users_role_mapping, update_activity_status, get_dashboard_metrics, compute_dashboard_summary, move_mechanism_stage, generate_graphviz_dot, PHASES_CONFIG
+from components import render_kanban_card, render_kanban_board, render_mechanism_card, render_gantt_chart
+from project_calendar import add_schedule_dates, build_schedule_index, select_ending_before, select_active_between
 import streamlit.components.v1 as components
 
 st.set_page_config(page_title="GWP Platform", layout="wide", page_icon="🌐")
@@ -63,67 +65,45 @@ with st.sidebar:
 
     st.info(f"Rol: {st.session_state['role']}")
 
-# --- TABS ---
-# --- TABS ---
-if st.session_state['role'] == 'ADMIN':
-    tabs = st.tabs(["📊 Dashboard", "🔀 Mapa de Procesos", "📋 Actividades", "📂 Archivos", "📅 Planificación (CMS)", "⚙️ Configuración"])
-elif st.session_state['role'] == 'GOBIERNO':
-    tabs = st.tabs(["📊 Dashboard", "🔀 Mapa de Procesos", "📋 Actividades", "📂 Archivos"])
-else:
-    tabs = st.tabs(["📊 Dashboard", "🔀 Mapa de Procesos", "📋 Actividades", "📋 Mis Tareas", "📂 Archivos"])
-
-
 # --- VIEW: DASHBOARD ---
-with tabs[0]:
+def render_dashboard_page():
     # Header Info
     proj_end = PROJECT_START + timedelta(days=PROJECT_DURATION*30)
     st.header(f"📊 {PROJECT_NAME}")
     st.caption(f"📅 Del: {PROJECT_START.strftime('%d/%m/%Y')} | Al: {proj_end.strftime('%d/%m/%Y')} (Estimado)")
     
-    # metrics
-    d_df = get_table_df("activities")
+    # metrics (aggregated server-side; constant-size payload)
+    today = datetime.now().date()
+    dash = prefetch_tables({
+        "summary": lambda: get_dashboard_summary(today),
+        "users": "users",
+        "products": "contract_products",
+    })
+    summary = dash["summary"]
+    if summary is None:
+        # Fallback (schema < v9): aggregate locally from the full tables
+        fb = prefetch_tables({
+            "activities": "activities",
+            "evidence": ("evidence_files", {"columns": ["activity_code", "uploaded_at"]}),
+            "edges": lambda: get_dependency_edges(raise_errors=True),
+        })
+        summary = compute_dashboard_summary(fb["activities"], fb["evidence"], fb["edges"], PROJECT_START, today)
+    totals = summary['totals']
     
-    if d_df.empty:
+    if totals['total'] == 0:
         st.info("Sin datos para mostrar.")
     else:
         # Calcs
-        total = len(d_df)
-        done = len(d_df[d_df['status'] == 'DONE'])
-        in_prog = len(d_df[d_df['status'] == 'IN_PROGRESS'])
+        total = totals['total']
+        done = totals['done']
+        in_prog = totals['in_progress']
         
-        # Calculate real Blocked (DB Blocked + Visual Blocked)
-        blocked_count = 0
-        real_pending_count = 0
-        
-        for _, r in d_df.iterrows():
-            s = r['status']
-            if s == 'BLOCKED':
-                blocked_count += 1
-            elif s == 'PENDING':
-                if check_is_blocked(r, d_df):
-                    blocked_count += 1
-                else:
-                    real_pending_count += 1
+        # Real Blocked (DB Blocked + Visual Blocked)
+        blocked_count = totals['blocked']
+        real_pending_count = totals['pending']
             
         progress = int((done / total) * 100) if total > 0 else 0
-        
-        # Date Calc (Start & End)
-        today = datetime.now().date()
-        def get_dates_dash(row):
-            try:
-                ws = int(row.get('week_start') or 1)
-                we = int(row.get('week_end') or 1)
-                real_s = PROJECT_START + timedelta(weeks=ws-1)
-                real_e = PROJECT_START + timedelta(weeks=we) - timedelta(days=1)
-                return pd.Series([real_s, real_e])
-            except:
-                return pd.Series([PROJECT_START, PROJECT_START])
-
-        d_df[['dash_start', 'dash_end']] = d_df.apply(get_dates_dash, axis=1)
-        d_df['dash_start'] = pd.to_datetime(d_df['dash_start']).dt.date
-        d_df['dash_end'] = pd.to_datetime(d_df['dash_end']).dt.date
-        
-        delayed = len(d_df[(d_df['dash_end'] < today) & (d_df['status'] != 'DONE')])
+        delayed = totals['delayed']
 
         # Row 1: Metrics
         m1, m2, m3, m4 = st.columns(4)
@@ -139,34 +119,20 @@ with tabs[0]:
         
         gap = progress - time_pct # +Ahead, -Behind
         
-        # Documentation Compliance (Global Coverage)
-        files_ref = get_all_evidence()
-        acts_with_files = set(f['activity_code'] for f in files_ref) if files_ref else set()
-        
-        # Filter: Evidence Required (use evidence_requirement = 'SI')
-        if 'evidence_requirement' in d_df.columns:
-            req_mask = d_df['evidence_requirement'].astype(str).str.upper() == 'SI'
-            req_df = d_df[req_mask]
-            total_req = len(req_df)
-        else:
-            total_req = 0
-            req_df = pd.DataFrame()
-        
+        # Documentation Compliance (Global Coverage, evidence_requirement = 'SI')
+        total_req = summary['evidence']['required']
         if total_req > 0:
-            # Count actual matches
-            have_files_count = req_df['activity_code'].isin(acts_with_files).sum()
+            have_files_count = summary['evidence']['covered']
             ev_rate = int((have_files_count / total_req) * 100)
             ev_help = f"{have_files_count} de {total_req} entregables"
         else:
-            ev_rate = 0 if 'evidence_requirement' in d_df.columns else 100
-            ev_help = "Sin requisitos marcados" if 'evidence_requirement' in d_df.columns else "Columna no encontrada"
+            ev_rate = 0
+            ev_help = "Sin requisitos marcados"
             
         # Recent Activity
         last_up = "-"
-        if files_ref:
-            # Sort to be sure
-            f_srtd = sorted(files_ref, key=lambda x: x['uploaded_at'], reverse=True)
-            l_d = datetime.fromisoformat(f_srtd[0]['uploaded_at']).date()
+        if summary['evidence']['last_upload']:
+            l_d = datetime.fromisoformat(str(summary['evidence']['last_upload'])).date()
             last_up = "Hoy" if l_d == today else l_d.strftime('%d/%m')
 
         # Row 1.5: Health Indicators
@@ -183,14 +149,14 @@ with tabs[0]:
         c_chart1, c_chart2 = st.columns(2)
         
         # Prepare Data Shared
-        users_dash = get_table_df("users")
+        users_dash = dash["users"]
         role_map_dash = dict(zip(users_dash['role'], users_dash['full_name'])) if not users_dash.empty else {}
         
         with c_chart1:
             st.subheader("Distribución y Responsables")
             
-            # Prepare Data for Stacked Chart
-            chart_df = d_df.copy()
+            # Prepare Data for Stacked Chart (pre-counted by status/role)
+            chart_df = pd.DataFrame(summary['status_by_role'])
             chart_df['Responsable'] = chart_df['primary_role'].map(role_map_dash).fillna(chart_df['primary_role'])
             status_labels = {
                 'PENDING': 'Pendiente', 'IN_PROGRESS': 'En Progreso', 
@@ -200,9 +166,9 @@ with tabs[0]:
             
             c_stacked = alt.Chart(chart_df).mark_bar().encode(
                 x=alt.X('Estado', sort=['Pendiente', 'En Progreso', 'Bloqueado', 'Listo'], title="Estado"),
-                y=alt.Y('count()', title="Actividades"),
+                y=alt.Y('sum(n)', title="Actividades"),
                 color=alt.Color('Responsable', scale=alt.Scale(scheme='set2'), title="Responsable"),
-                tooltip=['Estado', 'Responsable', 'count()']
+                tooltip=['Estado', 'Responsable', alt.Tooltip('sum(n)', title="Actividades")]
             )
             st.altair_chart(c_stacked, use_container_width=True)
             
@@ -210,26 +176,16 @@ with tabs[0]:
             st.subheader("Avance por Producto (%)")
             
             # 1. Get Products
-            prods_ref = get_table_df("contract_products")
+            prods_ref = dash["products"]
             prod_map = {}
             if not prods_ref.empty:
                 for _, r in prods_ref.iterrows():
                     prod_map[r['code']] = f"{r['code']} {r['name']}" # Use code+name for clarity
             
-            # 2. Helper
-            def get_prod_label(code):
-                if not isinstance(code, str): return "General"
-                c = code.split(' | ')[0]
-                return prod_map.get(c, c)
-            
-            d_df['prod_label'] = d_df['product_code'].apply(get_prod_label)
-            
-            # 3. Calculate %
-            d_df['is_done'] = d_df['status'] == 'DONE'
-            prog_df = d_df.groupby('prod_label').agg(
-                Total=('id', 'count'),
-                Done=('is_done', 'sum')
-            ).reset_index()
+            # 2. Label + % (counts come pre-grouped by product)
+            prog_df = pd.DataFrame(summary['product_progress']).rename(columns={'total': 'Total', 'done': 'Done'})
+            prog_df['prod_label'] = prog_df['product_code'].apply(lambda c: prod_map.get(c, c) if isinstance(c, str) and c else "General")
+            prog_df = prog_df.groupby('prod_label', as_index=False)[['Total', 'Done']].sum()
             
             prog_df['Porcentaje'] = (prog_df['Done'] / prog_df['Total'] * 100).round(1)
             
@@ -246,72 +202,51 @@ with tabs[0]:
         # Row 3: Actionable Cards
         st.subheader("🚀 Foco de Atención")
         
-        # Ensure map is available
-        d_users_ref = get_table_df("users")
-        role_map_ref = dict(zip(d_users_ref['role'], d_users_ref['full_name'])) if not d_users_ref.empty else {}
+        role_map_ref = role_map_dash
+        
+        def co_names_str(co_raw):
+            # Clean split
+            co_list = [c.strip() for c in str(co_raw).split(',') if c.strip() and c.strip() not in ['nan', 'None']]
+            co_names = [role_map_ref.get(r, r) for r in co_list]
+            return ", ".join(co_names) if co_names else "-"
 
         c_a1, c_a2 = st.columns(2)
         
         with c_a1:
             st.info("🔥 Top Cuellos de Botella (No Finalizados)")
-            # Logic: Parents that block the most pending/in-progress items
-            pending_df = d_df[~d_df['status'].isin(['DONE'])] 
-            blockers = pending_df['dependency_code'].dropna()
+            # Logic: Unfinished parents that block the most pending/in-progress items
+            bottlenecks = add_schedule_dates(pd.DataFrame(summary['bottlenecks']), PROJECT_START, 'dash_start', 'dash_end')
             
-            if blockers.empty:
+            if bottlenecks.empty:
                 st.caption("No hay bloqueos activos.")
             else:
-                top = blockers.value_counts().head(5)
-                has_content = False
-                for code, count in top.items():
-                    # Check parent status
-                    parent = d_df[d_df['activity_code'] == code]
-                    if not parent.empty and parent.iloc[0]['status'] != 'DONE':
-                        p_row = parent.iloc[0]
-                        
-                        # Prep Info
-                        d_range = f"{p_row['dash_start'].strftime('%d/%m')} - {p_row['dash_end'].strftime('%d/%m')}"
-                        primary = role_map_ref.get(p_row['primary_role'], p_row['primary_role'])
-                        
-                        co_raw = str(p_row.get('co_responsibles', ''))
-                        # Clean split
-                        co_list = [c.strip() for c in co_raw.split(',') if c.strip() and c.strip() not in ['nan', 'None']]
-                        co_names = [role_map_ref.get(r, r) for r in co_list]
-                        co_str = ", ".join(co_names) if co_names else "-"
-
-                        with st.container(border=True):
-                            st.markdown(f"**{code}** ({count} deps) | `{p_row['status']}`")
-                            st.markdown(f"📅 {d_range}")
-                            st.caption(f"👤 **{primary}** | 🤝 {co_str}")
-                            st.caption(f"_{p_row['task_name']}_")
-                        has_content = True
-                
-                if not has_content: st.caption("Los bloqueos actuales dependen de tareas ya finalizadas (Estable).")
+                for _, p_row in bottlenecks.iterrows():
+                    # Prep Info
+                    d_range = f"{p_row['dash_start'].strftime('%d/%m')} - {p_row['dash_end'].strftime('%d/%m')}"
+                    primary = role_map_ref.get(p_row['primary_role'], p_row['primary_role'])
+                    co_str = co_names_str(p_row.get('co_responsibles', ''))
+
+                    with st.container(border=True):
+                        st.markdown(f"**{p_row['activity_code']}** ({p_row['deps']} deps) | `{p_row['status']}`")
+                        st.markdown(f"📅 {d_range}")
+                        st.caption(f"👤 **{primary}** | 🤝 {co_str}")
+                        st.caption(f"_{p_row['task_name']}_")
 
         with c_a2:
             st.info("⏳ Próximos Vencimientos (7 Días)")
-            next_week = today + timedelta(days=7)
-            # Filter: Not Done AND Due in [Today, NextWeek]
-            upcoming = d_df[
-                (d_df['status'] != 'DONE') & 
-                (d_df['dash_end'] >= today) & 
-                (d_df['dash_end'] <= next_week)
-            ].sort_values('dash_end').head(5)
+            # Not Done AND Due in [Today, NextWeek], sorted by due date
+            upcoming = add_schedule_dates(pd.DataFrame(summary['upcoming']), PROJECT_START, 'dash_start', 'dash_end')
             
             if upcoming.empty:
                 st.caption("¡Todo al día! Nada vence esta semana.")
             else:
                 for _, r in upcoming.iterrows():
-                    delta = (r['dash_end'] - today).days
+                    delta = (r['dash_end'].date() - today).days
                     tag = "HOY" if delta == 0 else ("MAÑANA" if delta == 1 else f"en {delta} días")
                     
                     d_range = f"{r['dash_start'].strftime('%d/%m')} - {r['dash_end'].strftime('%d/%m')}"
                     primary = role_map_ref.get(r['primary_role'], r['primary_role'])
-                    
-                    co_raw = str(r.get('co_responsibles', ''))
-                    co_list = [c.strip() for c in co_raw.split(',') if c.strip() and c.strip() not in ['nan', 'None']]
-                    co_names = [role_map_ref.get(x, x) for x in co_list]
-                    co_str = ", ".join(co_names) if co_names else "-"
+                    co_str = co_names_str(r.get('co_responsibles', ''))
                     
                     with st.container(border=True):
                         st.markdown(f"**{r['activity_code']}** ({tag}) | `{r['status']}`")
@@ -321,9 +256,14 @@ with tabs[0]:
 
 # --- VIEW: LIVE MAP ---
 # --- VIEW: LIVE MAP ---
-with tabs[1]:
+def render_map_page():
     # Generate DF
-    map_df = get_table_df("activities")
+    map_data = prefetch_tables({"activities": "activities", "edges": lambda: get_dependency_edges(raise_errors=True)})
+    map_df = map_data["activities"]
+    map_edges = map_data["edges"]
+    if map_edges is None:
+        # Edge read failed (already reported): derive them from the activities
+        map_edges = edges_from_dependency_column(map_df)
     
     if not map_df.empty:
         # Helper to render
@@ -333,7 +273,7 @@ with tabs[1]:
                 return
 
             try:
-                dot = generate_graphviz_dot(current_df, group_by_phases=group_by_phases, rankdir=rankdir)
+                dot = generate_graphviz_dot(current_df, group_by_phases=group_by_phases, rankdir=rankdir, edges=map_edges)
                 if dot:
                     # RENDER STRATEGY: Embed SVG in scrollable HTML container
                     # This allows scrolling large diagrams instead of shrinking them
@@ -542,23 +482,14 @@ with tabs[1]:
         # 2. Filter Critical Path (Only Connected)
         if only_connected and not full_view_df.empty:
             # Strict Referential Integrity Filter
-            def normalize_dep(val):
-                s = str(val).strip()
-                if pd.isna(val) or s in ['-', '?', 'nan', 'None', '', '0']: return None
-                return s
-            
-            analysis_df = full_view_df.copy()
-            analysis_df['clean_dep'] = analysis_df['dependency_code'].apply(normalize_dep)
-            
-            # Valid codes are only those CURRENTLY in the view (after phase filter)
-            valid_codes = set(analysis_df['activity_code'].astype(str).unique())
-            analysis_df['valid_dep'] = analysis_df['clean_dep'].apply(lambda x: x if x in valid_codes else None)
+            # Valid edges are only those with BOTH ends CURRENTLY in the view (after phase filter)
+            valid_codes = full_view_df['activity_code']
+            view_edges = map_edges[map_edges['activity_code'].isin(valid_codes) & map_edges['depends_on_code'].isin(valid_codes)]
             
-            is_valid_child = analysis_df['valid_dep'].notna()
-            valid_parents = set(analysis_df['valid_dep'].dropna().unique())
-            is_valid_parent = analysis_df['activity_code'].astype(str).isin(valid_parents)
+            is_valid_child = valid_codes.isin(view_edges['activity_code'])
+            is_valid_parent = valid_codes.isin(view_edges['depends_on_code'])
             
-            full_view_df = analysis_df[is_valid_child | is_valid_parent].copy()
+            full_view_df = full_view_df[is_valid_child | is_valid_parent].copy()
 
         # 3. Apply Sorting (ALWAYS BY WEEK/DATE + INTERNAL ID)
         if not full_view_df.empty:
@@ -573,11 +504,15 @@ with tabs[1]:
 
 # --- VIEW: FILE MANAGER ---
 # Common for all
-file_tab_idx = 3 if st.session_state['role'] in ['ADMIN', 'GOBIERNO'] else 4
-with tabs[file_tab_idx]:
+def render_files_page():
     st.header("📂 Gestor Documental Centralizado")
     
-    files = get_all_evidence()
+    files_data = prefetch_tables({
+        "files": lambda: get_all_evidence(EVIDENCE_LIST_COLUMNS, raise_errors=True),
+        "activities": ("activities", {"columns": ["activity_code", "product_code"]}),
+        "products": ("contract_products", {"columns": ["code", "name"]}),
+    })
+    files = files_data["files"]
     if not files:
         st.info("No hay archivos subidos aún.")
     else:
@@ -589,8 +524,8 @@ with tabs[file_tab_idx]:
         # Custom display: Group by PRODUCT
         
         # 1. Fetch Context Data
-        acts_ref = get_table_df("activities")
-        prods_ref = get_table_df("contract_products")
+        acts_ref = files_data["activities"]
+        prods_ref = files_data["products"]
         
         # 2. Build Mappings
         # Prod Code -> Prod Name
@@ -627,10 +562,17 @@ with tabs[file_tab_idx]:
             grouped_files[group_name].append(f)
             
         # 4. Render Groups (Sorted)
+        # Download links are signed on demand only (per file or per group, batched)
+        dl_requested = st.session_state.setdefault('dl_requested', set())
+        
         for g_name in sorted(grouped_files.keys()):
             p_files = grouped_files[g_name]
             
             with st.expander(f"📦 {g_name} ({len(p_files)})", expanded=True):
+                if st.button("🔗 Preparar descargas", key=f"dl_group_{g_name}", help="Genera los enlaces de todo el grupo"):
+                    dl_requested.update(f['storage_path'] for f in p_files)
+                group_urls = get_evidence_urls([f['storage_path'] for f in p_files if f['storage_path'] in dl_requested])
+                
                 for f in p_files:
                      c1, c2, c3, c4 = st.columns([0.5, 4, 3, 2])
                      c1.write("📄")
@@ -642,7 +584,10 @@ with tabs[file_tab_idx]:
                      
                      with c4:
                          c_d, c_del = st.columns([1, 1])
-                         url = get_evidence_url(f['storage_path'])
+                         url = group_urls.get(f['storage_path'])
+                         if not url and c_d.button("⬇️", key=f"dl_f_{f['id']}", help="Generar enlace de descarga", type="tertiary"):
+                             dl_requested.add(f['storage_path'])
+                             url = get_evidence_url(f['storage_path'])
                          if url: 
                              c_d.markdown(f"[⬇️]({url})")
                          
@@ -655,106 +600,126 @@ with tabs[file_tab_idx]:
                      st.divider()
 
 # --- VIEW: CONFIGURATION (ADMIN) ---
-if st.session_state['role'] == 'ADMIN':
-    with tabs[5]:
-        st.header("⚙️ Gestión de Datos Maestros")
+def render_config_page():
+    st.header("⚙️ Gestión de Datos Maestros")
+    
+    c1, c2 = st.columns(2)
+    
+    with c1:
+        st.subheader("1. Productos Contractuales")
+        prods_df = get_table_df("contract_products")
+        edited_prods = st.data_editor(prods_df, key="ed_prods", num_rows="dynamic")
+        if st.button("💾 Guardar Productos"):
+            if not edited_prods.empty:
+                success, msg = upsert_data("contract_products", edited_prods.to_dict('records'))
+                if success: st.success("Productos actualizados")
+                else: st.error(msg)
+                
+    with c2:
+        st.subheader("2. Usuarios y Roles")
+        users_df_edit = get_table_df("users")
+        edited_users = st.data_editor(
+            users_df_edit, 
+            key="ed_users", 
+            num_rows="dynamic",
+            column_config={
+                "role": st.column_config.SelectboxColumn("Rol", options=["COORD", "FINANZAS", "LEGAL", "GOBIERNO"])
+            }
+        )
+        if st.button("💾 Guardar Usuarios"):
+            if not edited_users.empty:
+                success, msg = upsert_data("users", edited_users.to_dict('records'))
+                if success: st.success("Usuarios actualizados")
+                else: st.error(msg)
         
-        c1, c2 = st.columns(2)
+        st.divider()
+        if st.button("🔄 Reconciliar Estado de Evidencias", help="Recalcula 'has_file_uploaded' de todas las actividades (reparación)"):
+            if sync_activities_file_status(): st.success("Evidencias reconciliadas")
+            else: st.error("Error al reconciliar evidencias")
         
-        with c1:
-            st.subheader("1. Productos Contractuales")
-            prods_df = get_table_df("contract_products")
-            edited_prods = st.data_editor(prods_df, key="ed_prods", num_rows="dynamic")
-            if st.button("💾 Guardar Productos"):
-                if not edited_prods.empty:
-                    success, msg = upsert_data("contract_products", edited_prods.to_dict('records'))
-                    if success: st.success("Productos actualizados")
-                    else: st.error(msg)
-                    
-        with c2:
-            st.subheader("2. Usuarios y Roles")
-            users_df_edit = get_table_df("users")
-            edited_users = st.data_editor(
-                users_df_edit, 
-                key="ed_users", 
-                num_rows="dynamic",
-                column_config={
-                    "role": st.column_config.SelectboxColumn("Rol", options=["COORD", "FINANZAS", "LEGAL", "GOBIERNO"])
-                }
-            )
-            if st.button("💾 Guardar Usuarios"):
-                if not edited_users.empty:
-                    success, msg = upsert_data("users", edited_users.to_dict('records'))
-                    if success: st.success("Usuarios actualizados")
-                    else: st.error(msg)
+        if st.button("⚠️ Restaurar Valores por Defecto (Seed)"):
+            s, m = seed_master_defaults()
+            if s: st.success(m); st.rerun()
+            else: st.error(m)
             
-            st.divider()
-            if st.button("⚠️ Restaurar Valores por Defecto (Seed)"):
-                s, m = seed_master_defaults()
-                if s: st.success(m); st.rerun()
-                else: st.error(m)
-                
-            st.divider()
-            st.markdown("##### 📥 Importar Actividades desde CSV")
-            uploaded_csv = st.file_uploader("Seleccionar archivo CSV", type=['csv'], key="csv_uploader")
-            
-            if uploaded_csv is not None:
-                st.info(f"Archivo seleccionado: **{uploaded_csv.name}**")
-                if st.button("🚀 Procesar e Importar CSV"):
-                    try:
-                        # Save temp file and process
-                        import tempfile
-                        import os
-                        with tempfile.NamedTemporaryFile(delete=False, suffix='.csv') as tmp:
-                            tmp.write(uploaded_csv.getvalue())
-                            tmp_path = tmp.name
-                        
-                        s, m = seed_activities_from_csv(tmp_path)
-                        
-                        # Cleanup
-                        os.unlink(tmp_path)
-                        
-                        if s: 
-                            st.success(m)
-                            st.rerun()
-                        else: 
-                            st.error(m)
-                    except Exception as e:
-                        st.error(f"Error: {e}")
-
         st.divider()
-        st.divider()
-        st.subheader("3. Meta-Data Proyecto")
+        st.markdown("##### 📥 Importar Actividades desde CSV / Excel")
+        st.caption("Formatos aceptados: matriz (ID, Producto, Actividad, ...) o cronograma (activity_code, task_name, ...). La codificación se detecta sola.")
+        uploaded_csv = st.file_uploader("Seleccionar archivo", type=['csv', 'xlsx'], key="csv_uploader")
         
-        # Calculate End Date for display
-        proj_end_calc = PROJECT_START + timedelta(days=PROJECT_DURATION*30) # Approx
+        if uploaded_csv is not None:
+            st.info(f"Archivo seleccionado: **{uploaded_csv.name}**")
+            c_prev, c_imp = st.columns(2)
+            do_preview = c_prev.button("🔍 Vista Previa (sin guardar)")
+            do_import = c_imp.button("🚀 Procesar e Importar CSV")
+            if do_preview or do_import:
+                try:
+                    # Save temp file and process
+                    import tempfile
+                    import os
+                    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(uploaded_csv.name)[1].lower()) as tmp:
+                        tmp.write(uploaded_csv.getvalue())
+                        tmp_path = tmp.name
+                    
+                    row_errors = []
+                    s, m = seed_activities_from_csv(tmp_path, dry_run=do_preview, report=row_errors)
+                    
+                    # Cleanup
+                    os.unlink(tmp_path)
+                    
+                    # Per-row validation report (rows skipped by the import)
+                    if row_errors:
+                        err_df = pd.DataFrame(row_errors)
+                        st.warning(f"{len(err_df)} filas con errores no se importan.")
+                        st.dataframe(err_df.head(200), hide_index=True, use_container_width=True)
+                        st.download_button("⬇️ Descargar reporte de errores", err_df.to_csv(index=False).encode('utf-8'),
+                                           file_name="reporte_errores_importacion.csv", mime="text/csv")
+                    
+                    if s and do_preview:
+                        st.info(m)
+                    elif s: 
+                        st.success(m)
+                        if not row_errors: st.rerun() # Keep the error report visible
+                    else: 
+                        st.error(m)
+                except Exception as e:
+                    st.error(f"Error: {e}")
+
+    st.divider()
+    st.divider()
+    st.subheader("3. Meta-Data Proyecto")
+    
+    # Calculate End Date for display
+    proj_end_calc = PROJECT_START + timedelta(days=PROJECT_DURATION*30) # Approx
+    
+    with st.form("meta_form"):
+        n_name = st.text_input("Nombre Proyecto", PROJECT_NAME)
+        n_logo = st.text_input("Logo URL", LOGO)
         
-        with st.form("meta_form"):
-            n_name = st.text_input("Nombre Proyecto", PROJECT_NAME)
-            n_logo = st.text_input("Logo URL", LOGO)
-            
-            c_d1, c_d2 = st.columns(2)
-            n_start = c_d1.date_input("Fecha Inicio Proyecto", PROJECT_START)
-            n_dur = c_d2.number_input("Duración (Meses)", min_value=1, value=PROJECT_DURATION)
-            
-            st.caption(f"📅 Fecha Fin Estimada: {proj_end_calc.strftime('%d/%m/%Y')}")
-            
-            if st.form_submit_button("Actualizar Meta"):
-                update_project_meta("project_name", n_name)
-                update_project_meta("logo_url", n_logo)
-                update_project_meta("start_date", n_start.strftime('%Y-%m-%d'))
-                update_project_meta("duration_months", str(n_dur))
-                st.rerun()
+        c_d1, c_d2 = st.columns(2)
+        n_start = c_d1.date_input("Fecha Inicio Proyecto", PROJECT_START)
+        n_dur = c_d2.number_input("Duración (Meses)", min_value=1, value=PROJECT_DURATION)
+        
+        st.caption(f"📅 Fecha Fin Estimada: {proj_end_calc.strftime('%d/%m/%Y')}")
+        
+        if st.form_submit_button("Actualizar Meta"):
+            update_project_meta("project_name", n_name)
+            update_project_meta("logo_url", n_logo)
+            update_project_meta("start_date", n_start.strftime('%Y-%m-%d'))
+            update_project_meta("duration_months", str(n_dur))
+            st.rerun()
 
 # --- VIEW: PLANNING CMS (ADMIN) ---
-if st.session_state['role'] == 'ADMIN':
-    with tabs[4]:
-        st.header("📅 Editor Maestro de Cronograma")
-        st.info("CMS Integrado: Las opciones de Productos y Usuarios vienen de la DB.")
-        
-        # --- HELP: Type Codes ---
-        with st.expander("❓ Guía de Códigos de TIPO (Auto-Calculados)", expanded=False):
-            st.markdown("""
+CMS_PAGE_SIZE = 100 # Activities per editor page
+DEP_SEARCH_LIMIT = 20 # Results of the dependency code search
+
+def render_cms_page():
+    st.header("📅 Editor Maestro de Cronograma")
+    st.info("CMS Integrado: Las opciones de Productos y Usuarios vienen de la DB.")
+    
+    # --- HELP: Type Codes ---
+    with st.expander("❓ Guía de Códigos de TIPO (Auto-Calculados)", expanded=False):
+        st.markdown("""
 **Los códigos de TIPO se calculan automáticamente al guardar, basándose en:**
 - **Co-Responsables**: Si el campo tiene valores → `INT` (Integrada), sino → `IND` (Individual)
 - **Dependencias**: Si tiene dependencia válida → se agrega `+DEP`
@@ -768,143 +733,187 @@ if st.session_state['role'] == 'ADMIN':
 
 💡 *El campo TIPO se sobrescribe al guardar. Si necesitas un valor especial, edita manualmente después de guardar.*
 """)
-        
-        # Fresh Fetch - Sync Files First
-        sync_activities_file_status()
-        acts_df = get_table_df("activities")
-        prods_df = get_table_df("contract_products")
-        users_df = get_table_df("users")
-        
-        # --- PREPARE DROPDOWN OPTIONS (MAPPING) ---
-        # 1. Products: "Code | Name"
-        prod_map = {}
-        prod_options = []
-        if not prods_df.empty:
-            for _, r in prods_df.iterrows():
-                label = f"{r['code']} | {r['name']}"
-                prod_map[r['code']] = label
-                prod_options.append(label)
-        
-        # 2. Users: Build Name ↔ Role mappings
-        user_names = []
-        name_to_role = {}
-        role_to_name = {}
-        if not users_df.empty:
-            for _, u in users_df.iterrows():
-                user_names.append(u['full_name'])
-                name_to_role[u['full_name']] = u['role']
-                role_to_name[u['role']] = u['full_name']
-        
-        # --- APPLY MAPPING TO DATAFRAME FOR DISPLAY ---
-        display_df = acts_df.copy()
-        
-        if not display_df.empty and 'product_code' in display_df.columns:
-            display_df['product_code'] = display_df['product_code'].map(prod_map).fillna(display_df['product_code'])
-        
-        # Fill primary_responsible from role if empty (backcompat)
-        if not display_df.empty and 'primary_role' in display_df.columns:
-            if 'primary_responsible' not in display_df.columns:
-                display_df['primary_responsible'] = display_df['primary_role'].map(role_to_name).fillna(display_df['primary_role'])
+    
+    # Reference tables are small; activities are read one filtered page at a time
+    cms_data = prefetch_tables({"products": "contract_products", "users": "users"})
+    prods_df = cms_data["products"]
+    users_df = cms_data["users"]
+
+    # --- SERVER-SIDE FILTERS + PAGING ---
+    f1, f2, f3, f4 = st.columns([3, 3, 2, 2])
+    sel_prods = f1.multiselect("Producto", prods_df['code'].tolist() if not prods_df.empty else [], placeholder="Todos")
+    phase_id = f2.selectbox("Fase", [None] + list(PHASES_CONFIG), format_func=lambda p: "Todas" if p is None else PHASES_CONFIG[p]["name"])
+    sel_role = f3.selectbox("Rol", [None] + (users_df['role'].tolist() if not users_df.empty else []), format_func=lambda r: "Todos" if r is None else r)
+    code_q = f4.text_input("Código contiene", placeholder="ej: 2.1")
+
+    cms_filters = []
+    if sel_prods:
+        cms_filters.append(("product_code", "in", sel_prods))
+    if phase_id is not None:
+        cms_filters.append(("week_start", "gte", PHASES_CONFIG[phase_id]["start"]))
+        cms_filters.append(("week_start", "lte", PHASES_CONFIG[phase_id]["end"]))
+    if sel_role:
+        cms_filters.append(("primary_role", "eq", sel_role))
+    if code_q.strip():
+        cms_filters.append(("activity_code", "ilike", f"%{code_q.strip()}%"))
+
+    filter_sig = repr(cms_filters)
+    if st.session_state.get("cms_filter_sig") != filter_sig:
+        st.session_state["cms_filter_sig"] = filter_sig
+        st.session_state["cms_page"] = 1 # New filter -> first page
+    page_no = st.session_state.get("cms_page", 1)
+    acts_df, total_rows = get_table_page("activities", "*", cms_filters, ["activity_code"], page_no - 1, CMS_PAGE_SIZE)
+    n_pages = max(1, -(-total_rows // CMS_PAGE_SIZE))
+    if page_no > n_pages: # Rows were deleted from the last page
+        st.session_state["cms_page"] = n_pages
+        st.rerun()
+
+    p1, p2 = st.columns([2, 8])
+    p1.number_input("Página", min_value=1, max_value=n_pages, key="cms_page")
+    p2.caption(f"{total_rows} actividades · página {page_no} de {n_pages} ({CMS_PAGE_SIZE} por página). "
+               "Guarda antes de cambiar de página o filtro: los cambios sin guardar se descartan.")
+    # One editor state per page/filter, so pending edits never land on other rows
+    editor_key = f"cms_editor_{zlib.crc32(f'{filter_sig}|{page_no}'.encode())}"
+    
+    # --- PREPARE DROPDOWN OPTIONS (MAPPING) ---
+    # 1. Products: "Code | Name"
+    prod_map = {}
+    prod_options = []
+    if not prods_df.empty:
+        for _, r in prods_df.iterrows():
+            label = f"{r['code']} | {r['name']}"
+            prod_map[r['code']] = label
+            prod_options.append(label)
+    
+    # 2. Users: Build Name ↔ Role mappings (name -> role shared with the importer and the seed script)
+    user_names = []
+    name_to_role = users_role_mapping(users_df)
+    role_to_name = {}
+    if not users_df.empty:
+        for _, u in users_df.iterrows():
+            user_names.append(u['full_name'])
+            role_to_name[u['role']] = u['full_name']
+    
+    # --- APPLY MAPPING TO DATAFRAME FOR DISPLAY ---
+    display_df = acts_df.copy()
+    
+    if not display_df.empty and 'product_code' in display_df.columns:
+        display_df['product_code'] = display_df['product_code'].map(prod_map).fillna(display_df['product_code'])
+    
+    # Fill primary_responsible from role if empty (backcompat)
+    if not display_df.empty and 'primary_role' in display_df.columns:
+        if 'primary_responsible' not in display_df.columns:
+            display_df['primary_responsible'] = display_df['primary_role'].map(role_to_name).fillna(display_df['primary_role'])
+        else:
+            # Fill nulls
+            display_df['primary_responsible'] = display_df['primary_responsible'].fillna(
+                display_df['primary_role'].map(role_to_name)
+            )
+    
+
+    # Editor
+    edited_display_df = st.data_editor(
+        display_df,
+        key=editor_key,
+        num_rows="dynamic",
+        use_container_width=True,
+        column_config={
+            "id": st.column_config.NumberColumn("ID", disabled=True, width="small"),
+            "activity_code": st.column_config.TextColumn("Código", required=True, width="small"),
+            "product_code": st.column_config.SelectboxColumn("Producto", options=prod_options, required=True, width="medium"),
+            "primary_responsible": st.column_config.SelectboxColumn("👤 Responsable", options=user_names, required=True, width="medium"),
+            "primary_role": st.column_config.TextColumn("Rol (Auto)", disabled=True, width="small"),
+            "co_responsibles": st.column_config.TextColumn("🤝 Co-Responsables", help="Nombres separados por coma", width="medium"),
+            "dependency_code": st.column_config.TextColumn("Dependencias", help="Códigos separados por coma (ej: T-0.1, T-0.3)"),
+            "type_tag": st.column_config.TextColumn("Tipo (Auto)", disabled=True, width="small"),
+            "status": st.column_config.SelectboxColumn("Estado", options=["PENDING", "IN_PROGRESS", "BLOCKED", "DONE"]),
+            "evidence_requirement": st.column_config.SelectboxColumn("Evidencia Req.", options=["SI", "NO"]),
+            "has_file_uploaded": st.column_config.CheckboxColumn("📂?", disabled=True),
+            "updated_at": None,
+            "row_version": None
+        },
+        hide_index=True
+    )
+    
+    st.caption("💡 Al guardar: El **Rol** se auto-llena desde el Responsable, y el **Tipo** se calcula desde Dependencias y Co-Responsables.")
+
+    # Dependency picker: searched on demand instead of shipping every code to the browser
+    with st.expander("🔎 Buscar códigos para Dependencias"):
+        dep_q = st.text_input("Código o parte del nombre", key="cms_dep_search")
+        if dep_q.strip():
+            term = f"%{dep_q.strip()}%"
+            by_code, _ = get_table_page("activities", ["activity_code", "task_name"], [("activity_code", "ilike", term)], ["activity_code"], 0, DEP_SEARCH_LIMIT)
+            by_name, _ = get_table_page("activities", ["activity_code", "task_name"], [("task_name", "ilike", term)], ["activity_code"], 0, DEP_SEARCH_LIMIT)
+            found = pd.concat([by_code, by_name]).drop_duplicates(subset=['activity_code']).head(DEP_SEARCH_LIMIT)
+            if found.empty:
+                st.info("Sin coincidencias.")
             else:
-                # Fill nulls
-                display_df['primary_responsible'] = display_df['primary_responsible'].fillna(
-                    display_df['primary_role'].map(role_to_name)
-                )
-        
-        dep_codes = acts_df['activity_code'].tolist() if not acts_df.empty else []
+                st.dataframe(found, hide_index=True, use_container_width=True,
+                             column_config={"activity_code": "Código", "task_name": "Actividad"})
+    
+    if st.button("💾 Guardar Cronograma"):
+        # --- DIFF: only the rows touched in the editor are written ---
+        editor_state = st.session_state.get(editor_key, {})
+        edited_labels = display_df.index[list(editor_state.get("edited_rows", {}))]
+        deleted_df = display_df.iloc[editor_state.get("deleted_rows", [])]
+        edited_rows = edited_display_df[edited_display_df.index.isin(edited_labels)]
+        added_rows = edited_display_df[~edited_display_df.index.isin(display_df.index)]
 
-        # Editor
-        edited_display_df = st.data_editor(
-            display_df,
-            key="cms_editor",
-            num_rows="dynamic",
-            use_container_width=True,
-            column_config={
-                "id": st.column_config.NumberColumn("ID", disabled=True, width="small"),
-                "activity_code": st.column_config.TextColumn("Código", required=True, width="small"),
-                "product_code": st.column_config.SelectboxColumn("Producto", options=prod_options, required=True, width="medium"),
-                "primary_responsible": st.column_config.SelectboxColumn("👤 Responsable", options=user_names, required=True, width="medium"),
-                "primary_role": st.column_config.TextColumn("Rol (Auto)", disabled=True, width="small"),
-                "co_responsibles": st.column_config.TextColumn("🤝 Co-Responsables", help="Nombres separados por coma", width="medium"),
-                "dependency_code": st.column_config.SelectboxColumn("Dependencia", options=dep_codes),
-                "type_tag": st.column_config.TextColumn("Tipo (Auto)", disabled=True, width="small"),
-                "status": st.column_config.SelectboxColumn("Estado", options=["PENDING", "IN_PROGRESS", "BLOCKED", "DONE"]),
-                "evidence_requirement": st.column_config.SelectboxColumn("Evidencia Req.", options=["SI", "NO"]),
-                "has_file_uploaded": st.column_config.CheckboxColumn("📂?", disabled=True)
-            },
-            hide_index=True
-        )
-        
-        st.caption("💡 Al guardar: El **Rol** se auto-llena desde el Responsable, y el **Tipo** se calcula desde Dependencias y Co-Responsables.")
-        
-        if st.button("💾 Guardar Cronograma"):
+        if edited_rows.empty and added_rows.empty and deleted_df.empty:
+            st.info("Sin cambios que guardar.")
+        else:
             try:
-                # --- REVERSE MAPPING (DISPLAY -> DB) ---
-                # We need to turn "1.1 | Coord" back into "1.1"
-                save_df = edited_display_df.copy()
-                
-                # Helper to strip " | Name"
-                def unpack_product(val):
-                    if isinstance(val, str) and " | " in val:
-                        return val.split(" | ")[0]
-                    return val
+                save_df = pd.concat([edited_rows, added_rows])
                 
-                save_df['product_code'] = save_df['product_code'].apply(unpack_product)
+                # --- CANONICAL DEPENDENCIES + DAG VALIDATION (whole plan: other pages + this edited page) ---
+                plan = get_table_df("activities", ["id", "activity_code"])
+                page_ids = display_df['id'] if 'id' in display_df.columns else []
+                others = plan[~plan['id'].isin(page_ids)] if not plan.empty else plan
+                page_codes = edited_display_df['activity_code'].astype(str)
+                page_deps = edited_display_df['dependency_code'].apply(parse_dependency_codes)
+                plan_edges = get_dependency_edges()
+                other_edges = plan_edges[plan_edges['activity_code'].isin(others['activity_code'])] if not plan_edges.empty else plan_edges
+                all_edges = list(zip(other_edges['activity_code'], other_edges['depends_on_code'])) if not other_edges.empty else []
+                all_edges += [(c, p) for c, ps in zip(page_codes, page_deps) for p in ps]
+                all_codes = set(page_codes) | set(others['activity_code'].astype(str) if not others.empty else [])
+                dep_report = validate_dependency_graph(all_codes, all_edges)
+                dep_errors, dep_warnings = format_dependency_report(dep_report)
+                if not is_valid_dependency_report(dep_report):
+                    raise ValueError("No se guardó. " + " | ".join(dep_errors))
                 
-                # --- AUTO-FILL ROLE FROM RESPONSIBLE NAME ---
-                def get_role_from_name(name):
-                    if pd.isna(name) or str(name).strip() in ['', 'nan', 'None']:
-                        return None
-                    return name_to_role.get(str(name).strip(), None)
-                
-                save_df['primary_role'] = save_df['primary_responsible'].apply(get_role_from_name)
-                
-                # --- AUTO-CALCULATE TYPE TAG ---
-                def compute_type_tag(row):
-                    has_dep = False
-                    dep_val = str(row.get('dependency_code', '')).strip()
-                    if dep_val and dep_val not in ['nan', 'None', '-', '', '0']:
-                        has_dep = True
-                    
-                    has_co = False
-                    co_val = str(row.get('co_responsibles', '')).strip()
-                    if co_val and co_val not in ['nan', 'None', '-', '']:
-                        has_co = True
-                    
-                    # Logic:
-                    # INT if has co-responsibles, else IND
-                    # +DEP if has dependency
-                    # IND-P if IND and no dependency
-                    
-                    if has_co:
-                        base = "INT"
-                    else:
-                        base = "IND"
-                    
-                    if has_dep:
-                        return f"{base}+DEP"
-                    else:
-                        if base == "IND":
-                            return "IND-P"
-                        else:
-                            return base # INT without dep
-                
-                save_df['type_tag'] = save_df.apply(compute_type_tag, axis=1)
+                # --- DERIVED COLUMNS (whole frame) ---
+                # Product label -> code, Role from the Responsible, canonical Dependencies, Type
+                save_df = derive_activity_fields(save_df, name_to_role)
                 
                 # Prepare payload
-                # We only want to save columns that exist in DB + ID
+                # We only want to save columns that exist in DB
                 # (Streamlit adds _index sometimes)
-                valid_cols = ['id', 'activity_code', 'product_code', 'task_name', 'week_start', 'week_end', 'type_tag', 'dependency_code', 'primary_role', 'primary_responsible', 'co_responsibles', 'status', 'evidence_requirement']
-                # Filter cols
-                final_records = []
-                for _, row in save_df.iterrows():
-                    rec = {k: row[k] for k in valid_cols if k in row}
-                    final_records.append(rec)
-
-                success, msg = upsert_data("activities", final_records)
+                valid_cols = ['activity_code', 'product_code', 'task_name', 'week_start', 'week_end', 'type_tag', 'dependency_code', 'primary_role', 'primary_responsible', 'co_responsibles', 'status', 'evidence_requirement']
+                cols = [c for c in valid_cols if c in save_df.columns]
+                for c in ['week_start', 'week_end']:
+                    if c in cols:
+                        save_df[c] = pd.to_numeric(save_df[c], errors='coerce').astype('Int64')
+                payload = save_df[cols].astype(object).where(save_df[cols].notna(), None)
+                records = payload.to_dict('records')
+                
+                # Edited rows carry the version they were read at (stale writes are rejected)
+                versions = save_df['row_version'] if 'row_version' in save_df.columns else pd.Series(None, index=save_df.index)
+                updates, inserts = [], []
+                for rec, act_id, version in zip(records, save_df['id'], versions):
+                    if pd.notna(act_id):
+                        updates.append({**rec, "id": int(act_id), "row_version": int(version) if pd.notna(version) else None})
+                    else:
+                        inserts.append(rec)
+                del_versions = deleted_df['row_version'] if 'row_version' in deleted_df.columns else pd.Series(None, index=deleted_df.index)
+                deletes = [(int(i), int(v) if pd.notna(v) else None) for i, v in zip(deleted_df['id'], del_versions)]
+
+                success, msg = save_activity_changes(updates, inserts, deletes, dep_report['valid_edges'])
                 if success:
-                    st.success("✅ Cronograma Sincronizado")
+                    for w in dep_warnings: st.toast(f"⚠️ {w}")
+                    st.success(f"✅ Cronograma Sincronizado ({msg})")
                     st.balloons()
+                    # Fresh editor over the saved data
+                    del st.session_state[editor_key]
                     st.rerun()
                 else:
                     st.error(f"Error: {msg}")
@@ -913,14 +922,64 @@ if st.session_state['role'] == 'ADMIN':
 
 # --- VIEW: FACTORY (KANBAN) ---
 # Logic: Show tasks in columns based on Status. Buttons to move.
-# --- VIEW: ACTIVITIES BOARD ---
-target_tab = tabs[2] 
+BOARD_PAGE_SIZE = 25 # Cards per Kanban column before "Cargar más"
+STATUS_LABELS = {"PENDING": "😴 Pendiente", "IN_PROGRESS": "🔨 En Progreso", "DONE": "✅ Listo"}
 
-with target_tab:
+def render_bulk_status_form(scope_df, all_df, dep_index, key):
+    """
+    Multi-select status change for many activities at once.
+    The whole set is validated against one snapshot (all_df + dep_index) and
+    written in one batch that the database re-checks (rows changed since the
+    snapshot are reported, not written).
+    Returns True when something was written (caller reruns).
+    """
+    # Results of the last batch (shown on the rerun after it)
+    for note in st.session_state.pop(f"bulk_notes_{key}", []):
+        st.toast(note)
+    if scope_df.empty:
+        return False
+
+    labels = dict(zip(scope_df['id'], scope_df['activity_code'] + " - " + scope_df['task_name'].fillna("")))
+    with st.expander("⚡ Cambio de estado masivo"):
+        with st.form(f"bulk_form_{key}", border=False):
+            c1, c2 = st.columns([4, 1])
+            sel_ids = c1.multiselect("Actividades", list(labels), format_func=lambda i: labels.get(i, str(i)),
+                                     placeholder="Seleccionar actividades")
+            target = c2.selectbox("Nuevo estado", STATUS_FLOW, format_func=lambda s: STATUS_LABELS.get(s, s))
+            submitted = st.form_submit_button("Aplicar", type="primary")
+
+    if not submitted or not sel_ids:
+        return False
+
+    # 1. Validate the whole set (blocking + evidence) against the same snapshot
+    accepted, rejected = validate_status_transitions([{"id": i, "to": target} for i in sel_ids], all_df, dep_index)
+    notes = [f"⛔ {code}: {reason}" for code, reason in rejected]
+    # 2. One batch write, re-checked by the database
+    if accepted:
+        ok, msg = update_activities_status_batch(accepted, dict(zip(all_df['id'], all_df['status'])))
+        notes.append(f"✅ {msg}" if ok else f"⚠️ {msg}")
+    elif not rejected:
+        notes.append("Sin cambios: las actividades ya estaban en ese estado")
+    st.session_state[f"bulk_notes_{key}"] = notes
+    return True
+
+# --- VIEW: ACTIVITIES BOARD ---
+# The page is a fragment: board transitions rerun only the board. The written
+# rows are patched into the cached frame (db.record_write), so the rerun
+# costs the write and no table refetch.
+@st.fragment
+def render_board_page():
     st.subheader("📋 Tablero de Actividades")
     
-    df_acts = get_table_df("activities")
-    users_df = get_table_df("users")
+    board_data = prefetch_tables({
+        "activities": "activities",
+        "users": "users",
+        "edges": lambda: get_dependency_edges(raise_errors=True),
+        "products": ("contract_products", {"columns": ["code", "name"]}),
+    })
+    df_acts = board_data["activities"]
+    users_df = board_data["users"]
+    prods_df = board_data["products"]
     
     # Map Role -> Name
     role_map = {}
@@ -935,51 +994,35 @@ with target_tab:
         df_acts['responsible_name'] = ""
 
     # --- PREPARE DATE LOGIC ---
-    def add_real_dates(df):
-        if df.empty: return df
-        # Lambda to safe convert
-        def get_dates(row):
-            try:
-                ws = int(row.get('week_start') or 1)
-                we = int(row.get('week_end') or 1)
-                p_start = PROJECT_START
-                
-                # Logic: Week 1 Start = Project Start
-                # Real Start = p_start + (ws-1) weeks
-                # Real End = p_start + (we) weeks - 1 day (standard project week end)
-                
-                real_s = p_start + timedelta(weeks=ws-1)
-                real_e = p_start + timedelta(weeks=we) - timedelta(days=1) # Friday? or Sunday? Let's say full week.
-                
-                # Return strings for display and objs, but let's stick to objs for Altair
-                return pd.Series([real_s, real_e])
-            except:
-                return pd.Series([PROJECT_START, PROJECT_START])
-
-        df[['real_start_date', 'real_end_date']] = df.apply(get_dates, axis=1)
-        return df
-
-    df_acts = add_real_dates(df_acts)
-
-    df_acts = add_real_dates(df_acts)
+    df_acts = add_schedule_dates(df_acts, PROJECT_START)
+    
+    # Dependency lookups for the whole plan (blocking is always judged against ALL activities)
+    dep_index = build_dependency_index(df_acts, board_data["edges"])
 
     # --- DIALOG: Evidence Manager ---
+    # Dialogs rerun on their own; after an upload/delete only the dialog refreshes
     @st.dialog("📂 Gestión de Evidencias")
     def evidence_dialog(row, is_mine, role):
         st.markdown(f"**Actividad:** {row['activity_code']}")
         st.caption(row['task_name'])
         st.divider()
         
-        # 1. List Files
-        evidences = get_evidence_by_activity(row['activity_code'])
+        # 1. List Files (current list for this activity, served from the read cache)
+        evidences = get_evidence_by_activity(row['activity_code'], EVIDENCE_LIST_COLUMNS)
         if evidences:
             st.markdown("###### 📄 Archivos Adjuntos:")
+            # Only files whose download was requested get a signed URL (one batch call)
+            dl_requested = st.session_state.setdefault('dl_requested', set())
+            ev_urls = get_evidence_urls([ev['storage_path'] for ev in evidences if ev['storage_path'] in dl_requested])
             for ev in evidences:
                 c1, c2, c3 = st.columns([6, 1, 1])
                 with c1:
                     st.write(f"• {ev['filename']}")
                 with c2:
-                    d_url = get_evidence_url(ev['storage_path'])
+                    d_url = ev_urls.get(ev['storage_path'])
+                    if not d_url and st.button("⬇️", key=f"dlg_dl_{ev['id']}", help="Generar enlace de descarga", type="tertiary"):
+                        dl_requested.add(ev['storage_path'])
+                        d_url = get_evidence_url(ev['storage_path'])
                     if d_url:
                         st.markdown(f"[⬇️]({d_url})")
                 with c3:
@@ -992,7 +1035,7 @@ with target_tab:
                                 success, msg = delete_evidence(ev['storage_path'])
                                 if success:
                                     st.success("Eliminado")
-                                    st.rerun()
+                                    st.rerun(scope="fragment")
                                 else:
                                     st.error(msg)
             st.divider()
@@ -1017,118 +1060,106 @@ with target_tab:
                         prog.progress(100, text="¡Completado!")
                         time.sleep(0.5)
                         st.success("Archivo subido con éxito.")
-                        st.rerun()
+                        st.rerun(scope="fragment")
                     else:
                         st.error(msg_up)
 
     # --- HELPER: Render Board ---
+    # The whole board is ONE component (components.render_kanban_board): cards
+    # travel as a compact JSON list, drag and drop happens in the browser, and
+    # the moves come back as a single batch validated here.
+    # Columns are windowed: counts come from the whole bucket, but only the first
+    # cards of each column (by week) are built; "Cargar más" widens the window.
     def render_board(dataframe, key_suffix="main"):
         if dataframe.empty:
             st.info("No hay actividades en esta sección.")
             return
 
-        cols = st.columns(4)
         statuses = ["BLOCKED", "PENDING", "IN_PROGRESS", "DONE"]
         labels = ["🔒 Bloqueado", "😴 Pendiente", "🔨 En Progreso", "✅ Listo"]
         
         # Visual Bucketing (Move Blocked Pending -> Blocked Column)
-        buckets = {s: [] for s in statuses}
-        for _, row in dataframe.iterrows():
-            s = row['status']
-            if s == 'PENDING' and check_is_blocked(row, df_acts):
-                s = 'BLOCKED'
-            if s in buckets: buckets[s].append(row)
-
-        for i, status in enumerate(statuses):
-            with cols[i]:
-                st.markdown(f"### {labels[i]}")
-                subset = pd.DataFrame(buckets[status]) if buckets[status] else pd.DataFrame()
-                
-                for _, row in subset.iterrows():
-                    is_blocked = check_is_blocked(row, df_acts) # Uses the GLOBAL df_acts 
-                    
-                    is_mine = row['primary_role'] == st.session_state['role']
-                    
-                    # Colors/Style indicators
-                    border_color = "red" if is_blocked else "#ddd"
-                    
-                    # Resolve Name
-                    role_code = row['primary_role']
-                    user_name = role_map.get(role_code, role_code)
-                    
-                    # Dates
-                    try:
-                        d_s = row['real_start_date'].strftime('%d %b')
-                        d_e = row['real_end_date'].strftime('%d %b')
-                        date_info = f"{d_s} - {d_e}"
-                    except:
-                        date_info = f"Sem {row.get('week_start')} - {row.get('week_end')}"
+        blocked_mask = compute_blocked_mask(dataframe, dep_index) # Uses the GLOBAL df_acts index
+        bucket_status = dataframe['status'].where(~((dataframe['status'] == 'PENDING') & blocked_mask), 'BLOCKED')
+        counts = bucket_status.value_counts()
 
-                    type_info = f"{row.get('type_tag')}"
-                    
-                    dep = row.get('dependency_code')
-                    
-                    co = row.get('co_responsibles')
-                    co_info = f"👥 {co}" if co and str(co) != 'nan' else ""
-                    
-                    # Evidence Check
-                    evidences = get_evidence_by_activity(row['activity_code'])
-                    has_evidence = len(evidences) > 0
-                    
-                    # --- NATIVE CONTAINER CARD ---
-                    with st.container(border=True):
-                        # Row 1: Header + Evidence
-                        c_head, c_act = st.columns([6, 1])
-                        with c_head:
-                            st.markdown(f"**{row['activity_code']}** {row['task_name']}")
-                        with c_act:
-                            btn_icon = "📎" if has_evidence else "➕"
-                            if st.button(btn_icon, key=f"btn_ev_{key_suffix}_{row['id']}", help="Gestionar Evidencias", type="tertiary"):
-                                evidence_dialog(row, is_mine, st.session_state['role'])
-
-                        # Row 2: Meta + Navigation
-                        c_meta, c_nav = st.columns([5, 2])
-                        
-                        with c_meta:
-                            meta_line = f"🏷️ {type_info} | 🗓️ {date_info} | 👤 {user_name}"
-                            st.caption(meta_line)
-                            if is_blocked:
-                                st.markdown(f":red[🔒 Bloqueado por {dep}]", help=f"Depende de {dep}")
-                            if co_info: st.caption(co_info)
-                            
-                        with c_nav:
-                            # Navigation Buttons aligned to right
-                            c_b_prev, c_b_next = st.columns(2)
-                            
-                            # Prev
-                            if status not in ['PENDING', 'BLOCKED']:
-                                prev_stat = 'PENDING'
-                                if status == 'DONE': prev_stat = 'IN_PROGRESS'
-                                if c_b_prev.button("◀", key=f"prev_{key_suffix}_{row['id']}", help="Regresar"):
-                                    update_activity_status_flow(row['id'], prev_stat)
-                                    st.rerun()
-
-                            # Next
-                            if status != 'DONE':
-                                next_stat = 'IN_PROGRESS'
-                                if status == 'IN_PROGRESS': next_stat = 'DONE'
-                                
-                                can_move = True
-                                help_txt = "Avanzar"
-                                
-                                if is_blocked:
-                                    can_move = False
-                                    help_txt = "Bloqueado por dependencia"
-                                
-                                if next_stat == 'DONE':
-                                    can_comp, msg = check_can_complete(row)
-                                    if not can_comp:
-                                        can_move = False
-                                        help_txt = msg
-                                
-                                if c_b_next.button("▶", key=f"next_{key_suffix}_{row['id']}", disabled=not can_move, help=help_txt):
-                                    update_activity_status_flow(row['id'], next_stat)
-                                    st.rerun()
+        # Window per column: first N cards by schedule (N grows with "Cargar más")
+        limits = st.session_state.setdefault(f"kanban_limits_{key_suffix}", {})
+        ordered = dataframe.assign(_bucket=bucket_status).sort_values(['real_start_date', 'real_end_date', 'activity_code'], na_position='last')
+        rank = ordered.groupby('_bucket').cumcount()
+        window = ordered['_bucket'].map(lambda s: limits.get(s, BOARD_PAGE_SIZE))
+        visible = ordered[rank < window]
+
+        # Evidence of the visible cards only (one bulk in_() query instead of one per card)
+        evidence_index = get_evidence_index(visible['activity_code'], EVIDENCE_LIST_COLUMNS)
+
+        cards = []
+        for idx, row in visible.iterrows():
+            is_blocked = bool(blocked_mask.loc[idx])
+            
+            # Resolve Name
+            role_code = row['primary_role']
+            user_name = role_map.get(role_code, role_code)
+            
+            # Dates
+            try:
+                d_s = row['real_start_date'].strftime('%d %b')
+                d_e = row['real_end_date'].strftime('%d %b')
+                date_info = f"{d_s} - {d_e}"
+            except:
+                date_info = f"Sem {row.get('week_start')} - {row.get('week_end')}"
+
+            co = row.get('co_responsibles')
+            can_comp, comp_msg = check_can_complete(row)
+            cards.append({
+                "id": int(row['id']),
+                "code": row['activity_code'],
+                "title": row['task_name'],
+                "status": bucket_status.loc[idx],
+                "blocked": is_blocked,
+                "blocked_by": ", ".join(get_blocking_parents(dep_index, row['activity_code'])) if is_blocked else "",
+                "meta": f"🏷️ {row.get('type_tag')} | 🗓️ {date_info} | 👤 {user_name}",
+                "co": f"👥 {co}" if co and str(co) != 'nan' else "",
+                "evidence": len(evidence_index.get(row['activity_code'], [])) > 0,
+                "can_complete": can_comp,
+                "complete_msg": comp_msg,
+            })
+
+        # Results of the last batch (shown after the rerun that refreshed the cards)
+        for note in st.session_state.pop(f"kanban_notes_{key_suffix}", []):
+            st.toast(note)
+
+        seen_key = f"kanban_seen_{key_suffix}"
+        # Bulk changes over the whole section (not only the visible window)
+        if render_bulk_status_form(dataframe, df_acts, dep_index, f"board_{key_suffix}"):
+            st.rerun(scope="fragment")
+
+        columns = [(s, l, int(counts.get(s, 0))) for s, l in zip(statuses, labels)]
+        event = render_kanban_board(cards, columns, key=f"kanban_{key_suffix}",
+                                    revision=st.session_state.get(seen_key))
+        
+        # Component values repeat on every rerun: handle each event once
+        if not event or event.get("nonce") == st.session_state.get(seen_key):
+            return
+        st.session_state[seen_key] = event.get("nonce")
+
+        if event.get("more"):
+            limits[event["more"]] = limits.get(event["more"], BOARD_PAGE_SIZE) + BOARD_PAGE_SIZE
+            st.rerun(scope="fragment")
+        elif event.get("open") is not None:
+            match = df_acts[df_acts['id'] == event["open"]]
+            if not match.empty:
+                row = match.iloc[0]
+                evidence_dialog(row, row['primary_role'] == st.session_state['role'], st.session_state['role'])
+        elif event.get("moves"):
+            # Same rules as the buttons, enforced server-side against ALL activities
+            accepted, rejected = validate_status_transitions(event["moves"], df_acts, dep_index)
+            notes = [f"⛔ {code}: {reason}" for code, reason in rejected]
+            if accepted:
+                ok, msg = update_activities_status_batch(accepted, dict(zip(df_acts['id'], df_acts['status'])))
+                notes.append(f"✅ {msg}" if ok else f"⚠️ {msg}")
+            st.session_state[f"kanban_notes_{key_suffix}"] = notes
+            st.rerun(scope="fragment")
 
     # --- SPLIT LOGIC ---
     # --- VIEW SELECTOR ---
@@ -1139,12 +1170,28 @@ with target_tab:
     if view_mode == "Cronograma":
         show_today_line = c_opt.checkbox("📍 Mostrar línea de hoy", value=True)
 
+    # --- FILTERS: Product / Role (applied before any card is built) ---
+    prod_codes = df_acts['product_code'].map(lambda c: c.split(" | ")[0] if isinstance(c, str) else c) if 'product_code' in df_acts.columns else pd.Series(dtype=object)
+    prod_names = dict(zip(prods_df['code'], prods_df['name'])) if not prods_df.empty else {}
+    f_prod, f_role = st.columns(2)
+    sel_prods = f_prod.multiselect("Producto", sorted(prod_codes.dropna().unique()), placeholder="Todos los productos",
+                                   format_func=lambda c: f"{c} {prod_names.get(c, '')}".strip())
+    sel_roles = f_role.multiselect("Rol responsable", sorted(df_acts['primary_role'].dropna().unique()) if 'primary_role' in df_acts.columns else [],
+                                   placeholder="Todos los roles", format_func=lambda r: role_map.get(r, r))
+
+    def apply_filters(df):
+        if sel_prods:
+            df = df[prod_codes.loc[df.index].isin(sel_prods)]
+        if sel_roles:
+            df = df[df['primary_role'].isin(sel_roles)]
+        return df
+
     # --- SPLIT LOGIC ---
     current_role = st.session_state['role']
     
-    # Helper to render chosen view
     # Helper to render chosen view
     def render_content(df, key_suffix="main"):
+        df = apply_filters(df)
         if view_mode == "Kanban":
             render_board(df, key_suffix)
         else:
@@ -1192,121 +1239,133 @@ with target_tab:
             render_content(df_all, "user_all")
 
 # --- VIEW: MY TASKS (USER ONLY) ---
-if st.session_state['role'] not in ['ADMIN', 'GOBIERNO']:
-    with tabs[3]:
-        st.header("📋 Tablero de Prioridades Personales")
+def render_my_tasks_page():
+    st.header("📋 Tablero de Prioridades Personales")
+    
+    my_data = prefetch_tables({"activities": "activities", "users": "users"})
+    df_all_tasks = my_data["activities"]
+    users_df = my_data["users"]
+    
+    if df_all_tasks.empty:
+        st.info("No se encontraron actividades.")
+    else:
+        # --- DATE LOGIC ---
+        add_schedule_dates(df_all_tasks, PROJECT_START)
         
-        df_all_tasks = get_table_df("activities")
-        users_df = get_table_df("users")
+        # --- FILTER: MY TASKS ---
+        curr_role = st.session_state['role']
+        role_map = {r['role']: r['full_name'] for _, r in users_df.iterrows()} if not users_df.empty else {}
+        curr_name = role_map.get(curr_role, "")
         
-        if df_all_tasks.empty:
-            st.info("No se encontraron actividades.")
+        def is_mine(row):
+            # SPECIAL RULE: GOBIERNO sees everything EXCEPT Admin tasks
+            if curr_role == 'GOBIERNO':
+                return row['primary_role'] != 'ADMIN'
+
+            # Standard Rule
+            if row['primary_role'] == curr_role: return True
+            co = str(row.get('co_responsibles', ''))
+            if curr_role in co: return True
+            if curr_name and curr_name in co: return True
+            return False
+        
+        df_mine = df_all_tasks[df_all_tasks.apply(is_mine, axis=1)].copy()
+        
+        if df_mine.empty:
+            st.success("🎉 ¡Estás libre! No tienes actividades asignadas.")
         else:
-            # --- DATE LOGIC (Local Helper) ---
-            def calculate_dates(row):
-                try:
-                    ws = int(row.get('week_start') or 1)
-                    we = int(row.get('week_end') or 1)
-                    p_start = PROJECT_START
-                    real_s = p_start + timedelta(weeks=ws-1)
-                    real_e = p_start + timedelta(weeks=we) - timedelta(days=1)
-                    return pd.Series([real_s, real_e])
-                except:
-                    return pd.Series([PROJECT_START, PROJECT_START])
+            # --- CONTROLS ---
+            today = datetime.now().date()
             
-            df_all_tasks[['real_start_date', 'real_end_date']] = df_all_tasks.apply(calculate_dates, axis=1)
-            # Ensure DateTime type for .dt accessor
-            df_all_tasks['real_start_date'] = pd.to_datetime(df_all_tasks['real_start_date'])
-            df_all_tasks['real_end_date'] = pd.to_datetime(df_all_tasks['real_end_date'])
+            # Default Week Range
+            def_start = today - timedelta(days=today.weekday())
+            def_end = def_start + timedelta(days=6)
+
+            c_f1, c_f2 = st.columns([3, 4])
+            with c_f1:
+                date_range = st.date_input("📅 Filtrar por Fechas (Desde - Hasta)", value=(def_start, def_end))
+                
+                if isinstance(date_range, tuple) or isinstance(date_range, list):
+                    if len(date_range) == 2:
+                        start_week, end_week = date_range
+                    elif len(date_range) == 1:
+                        start_week = date_range[0]
+                        end_week = start_week
+                    else:
+                        start_week, end_week = def_start, def_end
+                else:
+                    start_week, end_week = def_start, def_end
             
-            # --- FILTER: MY TASKS ---
-            curr_role = st.session_state['role']
-            role_map = {r['role']: r['full_name'] for _, r in users_df.iterrows()} if not users_df.empty else {}
-            curr_name = role_map.get(curr_role, "")
+            st.caption(f"Mostrando: {start_week.strftime('%d/%m')} - {end_week.strftime('%d/%m')}")
+            st.divider()
             
-            def is_mine(row):
-                # SPECIAL RULE: GOBIERNO sees everything EXCEPT Admin tasks
-                if curr_role == 'GOBIERNO':
-                    return row['primary_role'] != 'ADMIN'
-
-                # Standard Rule
-                if row['primary_role'] == curr_role: return True
-                co = str(row.get('co_responsibles', ''))
-                if curr_role in co: return True
-                if curr_name and curr_name in co: return True
-                return False
+            # Interval index over my tasks: date windows become range lookups
+            mine_sched = build_schedule_index(df_mine)
             
-            df_mine = df_all_tasks[df_all_tasks.apply(is_mine, axis=1)].copy()
+            # --- BULK STATUS CHANGE (validated against the whole plan) ---
+            all_edges = get_dependency_edges(df_all_tasks)
+            if render_bulk_status_form(df_mine, df_all_tasks, build_dependency_index(df_all_tasks, all_edges), "my_tasks"):
+                st.rerun()
+
+            # --- SEGMENT 1: RETRASADAS (Delayed) ---
+            df_delayed = select_ending_before(df_mine, mine_sched, today)
+            df_delayed = df_delayed[df_delayed['status'] != 'DONE']
+            
+            if not df_delayed.empty:
+                st.error(f"🚨 TIENES {len(df_delayed)} ACTIVIDADES RETRASADAS")
+                for _, row in df_delayed.iterrows():
+                    with st.container(border=True):
+                        c1, c2 = st.columns([5, 1])
+                        c1.markdown(f"**{row['activity_code']}** {row['task_name']}")
+                        c1.caption(f"Debió terminar: {row['real_end_date'].strftime('%d %b')}")
+            
+            # --- SEGMENT 2: URGENTE / BLOQUEANTE (Blocking Others) ---
+            pending_all = df_all_tasks[df_all_tasks['status'] != 'DONE']
+            pending_edges = all_edges
+            pending_edges = pending_edges[pending_edges['activity_code'].isin(pending_all['activity_code'])]
+            blocking_codes = pending_edges['depends_on_code'].unique()
+            pending_children = build_dependency_index(pending_all, pending_edges)["children"]
+            
+            blocking_mask = (df_mine['activity_code'].isin(blocking_codes)) & (df_mine['status'] != 'DONE')
+            df_urgent = df_mine[blocking_mask]
+            
+            if not df_urgent.empty:
+                st.warning(f"🔥 {len(df_urgent)} ACTIVIDADES ESTÁN BLOQUEANDO AL EQUIPO")
+                for _, row in df_urgent.iterrows():
+                     with st.container(border=True):
+                        st.markdown(f"**{row['activity_code']}** {row['task_name']}")
+                        kids_str = ", ".join(pending_children.get(row['activity_code'], []))
+                        st.caption(f"Estás bloqueando a: {kids_str}")
+
+            # --- SEGMENT 3: THIS WEEK ---
+            df_week = select_active_between(df_mine, mine_sched, start_week, end_week)
+            
+            st.subheader("📆 Tu Planificación Semanal")
             
-            if df_mine.empty:
-                st.success("🎉 ¡Estás libre! No tienes actividades asignadas.")
+            if df_week.empty:
+                st.info("Nada planificado para esta semana específica.")
             else:
-                # --- CONTROLS ---
-                today = datetime.now().date()
-                
-                # Default Week Range
-                def_start = today - timedelta(days=today.weekday())
-                def_end = def_start + timedelta(days=6)
+                for _, row in df_week.iterrows():
+                    status_icon = "✅" if row['status'] == 'DONE' else "🔄"
+                    with st.container(border=True):
+                        st.markdown(f"**{status_icon} {row['activity_code']}** - {row['task_name']}")
+                        st.caption(f"{row['real_start_date'].strftime('%d %b')} -> {row['real_end_date'].strftime('%d %b')} | Estado: {row['status']}")
 
-                c_f1, c_f2 = st.columns([3, 4])
-                with c_f1:
-                    date_range = st.date_input("📅 Filtrar por Fechas (Desde - Hasta)", value=(def_start, def_end))
-                    
-                    if isinstance(date_range, tuple) or isinstance(date_range, list):
-                        if len(date_range) == 2:
-                            start_week, end_week = date_range
-                        elif len(date_range) == 1:
-                            start_week = date_range[0]
-                            end_week = start_week
-                        else:
-                            start_week, end_week = def_start, def_end
-                    else:
-                        start_week, end_week = def_start, def_end
-                
-                st.caption(f"Mostrando: {start_week.strftime('%d/%m')} - {end_week.strftime('%d/%m')}")
-                st.divider()
-                
-                # --- SEGMENT 1: RETRASADAS (Delayed) ---
-                df_mine['date_only_end'] = df_mine['real_end_date'].dt.date
-                delayed_mask = (df_mine['date_only_end'] < today) & (df_mine['status'] != 'DONE')
-                df_delayed = df_mine[delayed_mask]
-                
-                if not df_delayed.empty:
-                    st.error(f"🚨 TIENES {len(df_delayed)} ACTIVIDADES RETRASADAS")
-                    for _, row in df_delayed.iterrows():
-                        with st.container(border=True):
-                            c1, c2 = st.columns([5, 1])
-                            c1.markdown(f"**{row['activity_code']}** {row['task_name']}")
-                            c1.caption(f"Debió terminar: {row['real_end_date'].strftime('%d %b')}")
-                
-                # --- SEGMENT 2: URGENTE / BLOQUEANTE (Blocking Others) ---
-                pending_all = df_all_tasks[df_all_tasks['status'] != 'DONE']
-                blocking_codes = pending_all['dependency_code'].dropna().unique()
-                
-                blocking_mask = (df_mine['activity_code'].isin(blocking_codes)) & (df_mine['status'] != 'DONE')
-                df_urgent = df_mine[blocking_mask]
-                
-                if not df_urgent.empty:
-                    st.warning(f"🔥 {len(df_urgent)} ACTIVIDADES ESTÁN BLOQUEANDO AL EQUIPO")
-                    for _, row in df_urgent.iterrows():
-                         with st.container(border=True):
-                            st.markdown(f"**{row['activity_code']}** {row['task_name']}")
-                            blocked_kids = pending_all[pending_all['dependency_code'] == row['activity_code']]
-                            kids_str = ", ".join(blocked_kids['activity_code'].tolist())
-                            st.caption(f"Estás bloqueando a: {kids_str}")
-
-                # --- SEGMENT 3: THIS WEEK ---
-                df_mine['date_only_start'] = df_mine['real_start_date'].dt.date
-                week_mask = (df_mine['date_only_start'] <= end_week) & (df_mine['date_only_end'] >= start_week)
-                df_week = df_mine[week_mask]
-                
-                st.subheader("📆 Tu Planificación Semanal")
-                
-                if df_week.empty:
-                    st.info("Nada planificado para esta semana específica.")
-                else:
-                    for _, row in df_week.iterrows():
-                        status_icon = "✅" if row['status'] == 'DONE' else "🔄"
-                        with st.container(border=True):
-                            st.markdown(f"**{status_icon} {row['activity_code']}** - {row['task_name']}")
-                            st.caption(f"{row['real_start_date'].strftime('%d %b')} -> {row['real_end_date'].strftime('%d %b')} | Estado: {row['status']}")
+
+# --- NAVIGATION ---
+# Each view is its own page: only the selected one runs (fetches and renders)
+# on a rerun, and every page keeps a stable URL for deep links (e.g. /actividades).
+role = st.session_state['role']
+pages = [
+    st.Page(render_dashboard_page, title="Dashboard", icon="📊", url_path="dashboard", default=True),
+    st.Page(render_map_page, title="Mapa de Procesos", icon="🔀", url_path="mapa"),
+    st.Page(render_board_page, title="Actividades", icon="📋", url_path="actividades"),
+]
+if role not in ['ADMIN', 'GOBIERNO']:
+    pages.append(st.Page(render_my_tasks_page, title="Mis Tareas", icon="📋", url_path="mis-tareas"))
+pages.append(st.Page(render_files_page, title="Archivos", icon="📂", url_path="archivos"))
+if role == 'ADMIN':
+    pages.append(st.Page(render_cms_page, title="Planificación (CMS)", icon="📅", url_path="cms"))
+    pages.append(st.Page(render_config_page, title="Configuración", icon="⚙️", url_path="configuracion"))
+
+st.navigation(pages, position="top").run()
@@ -1,8 +1,29 @@
+import os
 import streamlit as st
+import streamlit.components.v1 as st_components
 import altair as alt
 import pandas as pd
 from logic import check_is_blocked
 
+# Static custom component (no build step), see kanban_board/index.html
+_kanban_board = st_components.declare_component(
+    "kanban_board", path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "kanban_board")
+)
+
+def render_kanban_board(cards, columns, key, revision=None, max_height=720):
+    """
+    Renders the whole board as ONE component from a compact card list.
+    cards: [{id, code, title, status, blocked, blocked_by, meta, co, evidence, can_complete, complete_msg}]
+    columns: [(status, label, total), ...] where total counts the whole bucket; when
+    it exceeds the cards sent for that column, the browser offers "Cargar más".
+    revision: changes after each handled event, so the browser drops its local moves.
+    Returns the last browser event ({nonce, moves: [{id, to}]}, {nonce, open: id} or
+    {nonce, more: status}) or None.
+    Events repeat on later reruns, so callers must de-duplicate by nonce.
+    """
+    return _kanban_board(cards=cards, columns=[list(c) for c in columns], revision=revision,
+                         max_height=max_height, key=key, default=None)
+
 def render_gantt_chart(df, show_today=False):
     """
     Renders the Gantt chart using Altair.
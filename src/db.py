@@ -2,7 +2,17 @@ import streamlit as st
 from supabase import create_client, Client
 import os
 import pandas as pd
-import csv
+import json
+import random
+import threading
+import time
+import httpx
+from supabase.lib.client_options import SyncClientOptions
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+
+import replica
 
 
 @st.cache_resource
@@ -34,20 +44,543 @@ def init_connection():
     if not url or not key:
         return None
         
-    return create_client(url, key)
+    # One pooled, thread-safe transport shared by every session (see TRANSPORT)
+    return create_client(url, key, options=SyncClientOptions(httpx_client=_build_http_client()))
+
+def _get_setting(name, default):
+    """
+    Reads a tuning setting from Streamlit secrets or environment variables.
+    Casts to the type of the default value.
+    """
+    value = None
+    try:
+        if name in st.secrets:
+            value = st.secrets[name]
+    except Exception:
+        pass
+    if value is None:
+        value = os.environ.get(name)
+    if value is None:
+        return default
+    try:
+        if isinstance(default, bool):
+            return str(value).strip().lower() in ("1", "true", "yes", "si")
+        return type(default)(value)
+    except (TypeError, ValueError):
+        return default
+
+# --- TRANSPORT ---
+# Keep-alive connection pool with explicit timeouts, plus a retry policy with
+# jittered exponential backoff for transient failures (timeouts, dropped
+# connections, 429/5xx). Only idempotent calls are retried: reads, upserts by
+# key, deterministic updates and deletes. Failures after the last attempt are
+# raised as DataAccessError, never turned into empty results silently.
+HTTP_CONNECT_TIMEOUT = _get_setting("GWP_HTTP_CONNECT_TIMEOUT", 5.0)
+HTTP_READ_TIMEOUT = _get_setting("GWP_HTTP_READ_TIMEOUT", 20.0)
+HTTP_MAX_CONNECTIONS = _get_setting("GWP_HTTP_MAX_CONNECTIONS", 20)
+HTTP_MAX_KEEPALIVE = _get_setting("GWP_HTTP_MAX_KEEPALIVE", 10)
+RETRY_ATTEMPTS = _get_setting("GWP_RETRY_ATTEMPTS", 3)
+RETRY_BASE_SECONDS = _get_setting("GWP_RETRY_BASE_SECONDS", 0.25)
+RETRY_MAX_SECONDS = 4.0
+
+# PostgREST/Postgres codes worth retrying (rate limit, gateway, statement timeout, serialization, deadlock)
+TRANSIENT_ERROR_CODES = {"429", "500", "502", "503", "504", "520", "57014", "40001", "40P01"}
+MISSING_RPC_CODES = {"PGRST202", "42883"} # Function not deployed (older schema)
+MISSING_TABLE_CODES = {"PGRST205", "42P01"} # Table not created (older schema)
+DUPLICATE_KEY_CODES = {"23505"} # Unique violation (row already exists)
+
+class DataAccessError(RuntimeError):
+    """A Supabase call failed after its retries."""
+
+def _build_http_client():
+    return httpx.Client(
+        timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE),
+    )
+
+def _is_transient(exc):
+    if isinstance(exc, (httpx.TimeoutException, httpx.TransportError)):
+        return True
+    return str(getattr(exc, "code", "") or "") in TRANSIENT_ERROR_CODES
+
+def _error_code(exc):
+    cause = exc.__cause__ if isinstance(exc, DataAccessError) and exc.__cause__ else exc
+    return str(getattr(cause, "code", "") or "")
+
+def is_missing_rpc(exc):
+    """True when an RPC failed because the database function does not exist."""
+    return _error_code(exc) in MISSING_RPC_CODES
+
+def is_missing_table(exc):
+    """True when a read failed because the table does not exist."""
+    return _error_code(exc) in MISSING_TABLE_CODES
+
+def with_retry(call, idempotent=True):
+    """
+    Runs call() (e.g. query.execute) with the retry policy.
+    Non-idempotent calls get a single attempt.
+    """
+    attempts = max(1, RETRY_ATTEMPTS) if idempotent else 1
+    for attempt in range(attempts):
+        try:
+            return call()
+        except Exception as e:
+            if attempt + 1 >= attempts or not _is_transient(e):
+                raise DataAccessError(str(e)) from e
+            # Full jitter: spreads retries of concurrent sessions
+            time.sleep(random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt)))
+
+def _report_error(context, exc):
+    """Surfaces a failed read in the page (and the server log) instead of hiding it."""
+    print(f"{context}: {exc}")
+    try:
+        st.error(f"⚠️ {context}. Reintenta en unos segundos. ({exc})")
+    except Exception:
+        pass
+
+# --- READ CACHE ---
+# Process-wide cache of table reads, shared by every session/rerun.
+# Key: (table_name, projection, filters, order, data_version). Writes bump the version of the
+# table, so the next read refetches once and every widget reuses that fetch.
+# Tables in DELTA_TABLES (see DELTA SYNC) keep their stale frame as a base and
+# only pull the rows modified since its watermark.
+
+CACHE_TTL_SECONDS = _get_setting("GWP_CACHE_TTL_SECONDS", 300.0)
+CACHE_MAX_ENTRIES = _get_setting("GWP_CACHE_MAX_ENTRIES", 32)
+CACHE_MAX_BYTES = _get_setting("GWP_CACHE_MAX_MB", 64) * 1024 * 1024
+
+IN_FILTER_CHUNK = 200 # Max values per in_() filter (keeps request URLs short)
+PAGE_SIZE = _get_setting("GWP_PAGE_SIZE", 1000) # Rows per ranged request
+
+# Stable ordering for paged reads (offset paging needs a deterministic order)
+TABLE_ORDER_KEYS = {
+    "activities": ["id"],
+    "users": ["id"],
+    "contract_products": ["code"],
+    "project_meta": ["key"],
+    "evidence_files": ["id"],
+    "activity_dependencies": ["activity_code", "depends_on_code"],
+    "mechanisms": ["id"],
+}
+
+_cache_lock = threading.RLock()
+_table_cache = OrderedDict() # key -> {"df": DataFrame, "fetched_at": float, "bytes": int}
+_table_versions = {} # table_name -> int
+_cache_epoch = 0 # bumped on full clears, so unseen tables also get a new version
+
+# --- DELTA SYNC ---
+# Tables with a server-maintained watermark column (update_schema_v10.sql).
+# Stale entries are revalidated with a probe (max watermark + exact count):
+# unchanged -> reuse the frame, changed -> fetch rows with watermark >= last
+# one (minus an overlap for late commits) and merge them by id. A count that
+# does not match after the merge (deletes) falls back to a full refetch.
+DELTA_SYNC = _get_setting("GWP_DELTA_SYNC", True)
+DELTA_TABLES = {"activities": "updated_at"}
+DELTA_PROBE_SECONDS = _get_setting("GWP_DELTA_PROBE_SECONDS", 30.0) # Max age before a probe
+DELTA_OVERLAP_SECONDS = _get_setting("GWP_DELTA_OVERLAP_SECONDS", 5.0)
+
+_stale_bases = {} # (table_name, projection, order) -> cache entry awaiting revalidation
+_delta_unsupported = set() # tables still without the watermark column
+
+# --- READ REPLICA ---
+# Optional local SQLite mirror (replica.py) of the small, hot tables.
+# Reads of mirrored tables are answered locally; a background thread keeps
+# the mirror current (probe/delta for DELTA_TABLES, full diff for the rest).
+# Writes go to Supabase: rows returned by the write are merged right away
+# (record_write), any other write marks the table dirty so the next read
+# refreshes it before answering.
+REPLICA_ENABLED = _get_setting("GWP_REPLICA", False)
+REPLICA_PATH = _get_setting("GWP_REPLICA_PATH", ":memory:")
+REPLICA_REFRESH_SECONDS = _get_setting("GWP_REPLICA_REFRESH_SECONDS", 30.0)
+
+_replica_lock = threading.RLock()
+_replica_dirty = set(replica.REPLICA_KEYS) # Tables that must refresh before the next local read
+_replica_state = {} # table -> {"watermark": str|None, "digest": int|None}
+_replica_writes = {} # table -> writes seen; a refresh fetched before a write is not applied
+_replica_thread = None
+
+def _projection_key(columns):
+    """Normalizes a column projection ("*", "a, b", ["a", "b"]) into a hashable key."""
+    if not columns or columns == "*":
+        return "*"
+    if isinstance(columns, str):
+        columns = columns.split(",")
+    return ",".join(c.strip() for c in columns)
+
+def _filters_key(filters):
+    """
+    Normalizes filters into a hashable tuple of (column, operator, value).
+    Accepts a dict {column: value} (lists/sets become 'in', scalars 'eq')
+    or an iterable of (column, operator, value) with PostgREST operators
+    (eq, neq, gt, gte, lt, lte, like, ilike, in).
+    """
+    if not filters:
+        return ()
+    if isinstance(filters, dict):
+        filters = [(c, "in" if isinstance(v, (list, tuple, set)) else "eq", v) for c, v in filters.items()]
+    norm = []
+    for col, op, val in filters:
+        if isinstance(val, (list, tuple, set)):
+            val = tuple(sorted(val, key=str)) if isinstance(val, set) else tuple(val)
+        norm.append((col, op, val))
+    return tuple(norm)
+
+def _apply_filters(query, filters):
+    for col, op, val in filters:
+        if op == "in":
+            query = query.in_(col, list(val))
+        else:
+            query = getattr(query, op)(col, val)
+    return query
+
+def _effective_order(table_name, order):
+    order = list(order or [])
+    return order + [c for c in TABLE_ORDER_KEYS.get(table_name, []) if c not in order]
+
+def _fetch_rows(client, table_name, projection="*", filters=(), order=None, page_size=None):
+    """
+    Reads every matching row in bounded ranged requests and returns one list.
+    The first page asks for the exact count, so a server max-rows lower than
+    page_size cannot silently truncate the result.
+    order: column names, '-' prefix for descending; the table's key is appended.
+    """
+    page_size = page_size or PAGE_SIZE
+    order = _effective_order(table_name, order)
+
+    pages = []
+    fetched = 0
+    total = None
+    while True:
+        if total is None:
+            query = client.table(table_name).select(projection, count="exact")
+        else:
+            query = client.table(table_name).select(projection)
+        query = _apply_filters(query, filters)
+        for col in order:
+            query = query.order(col.lstrip("-"), desc=col.startswith("-"))
+        res = with_retry(query.range(fetched, fetched + page_size - 1).execute)
+        if total is None:
+            total = res.count if res.count is not None else -1
+        pages.append(res.data)
+        fetched += len(res.data)
+        # Stop on an empty page, when the count is reached, or (no count) on a short page
+        if not res.data or (total >= 0 and fetched >= total) or (total < 0 and len(res.data) < page_size):
+            break
+    return list(chain.from_iterable(pages))
+
+def _stale_key(key):
+    return (key[0], key[1], key[3])
+
+def _cache_get(key):
+    with _cache_lock:
+        entry = _table_cache.get(key)
+        if entry is None:
+            return None
+        delta = entry.get("watermark") is not None
+        if time.monotonic() - entry["fetched_at"] > (DELTA_PROBE_SECONDS if delta else CACHE_TTL_SECONDS):
+            del _table_cache[key]
+            if delta:
+                _stale_bases[_stale_key(key)] = entry
+            return None
+        _table_cache.move_to_end(key) # LRU touch
+        return entry["df"]
+
+def _cache_put(key, df, watermark=None):
+    size = int(df.memory_usage(deep=True).sum()) if not df.empty else 0
+    if size > CACHE_MAX_BYTES:
+        return # Too big to keep, serve uncached
+    with _cache_lock:
+        _table_cache[key] = {"df": df, "fetched_at": time.monotonic(), "bytes": size, "watermark": watermark}
+        _table_cache.move_to_end(key)
+        # Evict least recently used until both bounds hold
+        total = sum(e["bytes"] for e in _table_cache.values())
+        while _table_cache and (len(_table_cache) > CACHE_MAX_ENTRIES or total > CACHE_MAX_BYTES):
+            _, old = _table_cache.popitem(last=False)
+            total -= old["bytes"]
+
+def get_table_version(table_name):
+    """Current local data version of a table (bumped on every write through this module)."""
+    with _cache_lock:
+        return _cache_epoch + _table_versions.get(table_name, 0)
+
+def invalidate_table_cache(*table_names):
+    """
+    Write-through invalidation: bumps the data version of the given tables
+    and drops their cached frames. Without arguments clears the whole cache.
+    """
+    with _replica_lock:
+        for t in table_names or replica.REPLICA_KEYS:
+            _replica_dirty.add(t)
+            _replica_writes[t] = _replica_writes.get(t, 0) + 1
+    _bump_table_versions(*table_names)
+
+def record_write(table_name, rows=None):
+    """
+    Write hook for mutations that return the written rows: merges them into
+    the replica and into the cached frames of the table, so the next read
+    needs no refetch. Without rows it behaves like invalidate_table_cache.
+    """
+    with _replica_lock:
+        _replica_writes[table_name] = _replica_writes.get(table_name, 0) + 1
+        applied = (REPLICA_ENABLED and bool(rows) and table_name in replica.REPLICA_KEYS
+                   and table_name not in _replica_dirty and replica.upsert_rows(table_name, rows))
+        if not applied:
+            _replica_dirty.add(table_name)
+    _bump_table_versions(table_name, patch_rows=rows)
+
+def _merge_rows(table_name, df, changed, order=()):
+    """Replaces/appends rows of df by id and keeps the read order."""
+    df = pd.concat([df[~df["id"].isin(changed["id"])], changed], ignore_index=True)
+    sort_order = _effective_order(table_name, order)
+    if sort_order:
+        df = df.sort_values([c.lstrip("-") for c in sort_order],
+                            ascending=[not c.startswith("-") for c in sort_order], ignore_index=True)
+    return df
+
+def _bump_table_versions(*table_names, patch_rows=None):
+    """
+    Bumps versions and drops cached frames. With patch_rows (single table),
+    unfiltered frames that contain every written column are patched and kept
+    under the new version instead.
+    """
+    global _cache_epoch
+    changed = pd.DataFrame(patch_rows) if patch_rows else None
+    with _cache_lock:
+        if not table_names:
+            _cache_epoch += 1
+            _table_cache.clear()
+            _stale_bases.clear()
+            return
+        for t in table_names:
+            _table_versions[t] = _table_versions.get(t, 0) + 1
+            version = _cache_epoch + _table_versions[t]
+            for key in [k for k in _table_cache if k[0] == t]:
+                entry = _table_cache.pop(key)
+                df = entry["df"]
+                if (changed is not None and not key[2] and "id" in changed.columns
+                        and "id" in df.columns and set(df.columns) <= set(changed.columns)):
+                    patched = _merge_rows(t, df, changed[list(df.columns)], key[3])
+                    _table_cache[key[:-1] + (version,)] = {**entry, "df": patched}
+                elif entry.get("watermark") is not None:
+                    _stale_bases[_stale_key(key)] = entry # Revalidated by delta on next read
+
+def _supports_delta(table_name, projection, filters):
+    if not DELTA_SYNC or filters or table_name not in DELTA_TABLES or table_name in _delta_unsupported:
+        return False
+    return projection == "*" or {"id", DELTA_TABLES[table_name]} <= set(projection.split(","))
+
+def _frame_watermark(table_name, df):
+    """Max watermark of a freshly fetched frame (None if the column is missing)."""
+    col = DELTA_TABLES[table_name]
+    if col not in df.columns:
+        if not df.empty:
+            _delta_unsupported.add(table_name) # Schema not migrated yet
+        return None
+    return df[col].max() if not df.empty else ""
+
+def _probe_table(client, table_name):
+    """Cheap change probe: (max watermark, exact row count) in one request."""
+    col = DELTA_TABLES[table_name]
+    res = with_retry(client.table(table_name).select(col, count="exact").order(col, desc=True, nullsfirst=False).limit(1).execute)
+    return (res.data[0][col] if res.data else ""), res.count
+
+def _delta_refresh(client, table_name, projection, order, key):
+    """
+    Revalidates a stale base frame. Returns (df, watermark) or None when
+    there is no usable base or the merge cannot be trusted (full refetch).
+    """
+    with _cache_lock:
+        base = _stale_bases.pop((table_name, projection, order), None)
+    if base is None:
+        return None
+    try:
+        watermark, count = _probe_table(client, table_name)
+        df = base["df"]
+        if watermark == base["watermark"] and count == len(df):
+            return df, watermark # Nothing changed
+
+        col = DELTA_TABLES[table_name]
+        if base["watermark"]:
+            since = pd.Timestamp(base["watermark"]) - pd.Timedelta(seconds=DELTA_OVERLAP_SECONDS)
+            rows = _fetch_rows(client, table_name, projection, [(col, "gte", since.isoformat())], order)
+        else:
+            rows = _fetch_rows(client, table_name, projection, (), order)
+        if rows:
+            df = _merge_rows(table_name, df, pd.DataFrame(rows), order)
+        if len(df) != count:
+            return None # Rows were deleted, rebuild from scratch
+        return df, watermark
+    except Exception as e:
+        print(f"Delta sync error ({table_name}): {e}")
+        return None
+
+def _refresh_replica_table(client, table_name):
+    """
+    Brings one mirrored table up to date. Returns True if its content changed,
+    None if a write landed while fetching (the table stays dirty).
+    Network reads run outside _replica_lock; the lock only guards the swap.
+    """
+    with _replica_lock:
+        _replica_dirty.discard(table_name)
+        writes = _replica_writes.get(table_name, 0)
+        state = _replica_state.setdefault(table_name, {"watermark": None, "digest": None})
+        loaded = replica.is_loaded(table_name)
+        local_count = replica.row_count(table_name) if loaded else None
+    col = DELTA_TABLES.get(table_name)
+
+    def current():
+        # Called under the lock: the fetched rows may predate a write
+        if _replica_writes.get(table_name, 0) == writes:
+            return True
+        _replica_dirty.add(table_name)
+        return False
+
+    try:
+        # 1. Delta path: probe, then merge only the modified rows
+        if col and state["watermark"] is not None and loaded and table_name not in _delta_unsupported:
+            watermark, count = _probe_table(client, table_name)
+            if watermark == state["watermark"] and count == local_count:
+                return False
+            since = pd.Timestamp(state["watermark"]) - pd.Timedelta(seconds=DELTA_OVERLAP_SECONDS) if state["watermark"] else None
+            rows = _fetch_rows(client, table_name, "*", [(col, "gte", since.isoformat())] if since is not None else [])
+            with _replica_lock:
+                if not current():
+                    return None
+                if replica.upsert_rows(table_name, rows) and replica.row_count(table_name) == count:
+                    state.update(watermark=watermark, digest=None)
+                    return True
+
+        # 2. Full path: refetch, replace only if the content differs
+        rows = _fetch_rows(client, table_name)
+        digest = hash(json.dumps(rows, sort_keys=True, default=str))
+        watermark = None
+        if col and (not rows or col in rows[0]):
+            watermark = max((r[col] for r in rows), default="")
+        with _replica_lock:
+            if not current():
+                return None
+            if replica.is_loaded(table_name) and digest == state["digest"]:
+                return False
+            replica.replace_table(table_name, rows)
+            state.update(watermark=watermark, digest=digest)
+        return True
+    except Exception:
+        with _replica_lock:
+            _replica_dirty.add(table_name)
+        raise
+
+def refresh_replica(client=None):
+    """Background refresh of every loaded mirrored table."""
+    client = client or init_connection()
+    for t in replica.REPLICA_KEYS:
+        if not replica.is_loaded(t):
+            continue # Loaded on first read
+        if _refresh_replica_table(client, t):
+            _bump_table_versions(t)
+
+def _replica_read(client, table_name, projection, filters, order):
+    global _replica_thread
+    with _replica_lock:
+        if _replica_thread is None:
+            replica.open_replica(REPLICA_PATH)
+            _replica_thread = replica.start_refresher(lambda: refresh_replica(client), REPLICA_REFRESH_SECONDS)
+        stale = table_name in _replica_dirty or not replica.is_loaded(table_name)
+    if stale and _refresh_replica_table(client, table_name) is None:
+        raise RuntimeError("la tabla cambió durante la actualización de la réplica")
+    return replica.read_table(table_name, projection, filters, _effective_order(table_name, order))
 
 # --- GENERIC CRUD ---
 
-def get_table_df(table_name):
-    """Generic fetcher for any table -> DataFrame"""
+def get_table_df(table_name, columns="*", filters=None, order=None, use_cache=True, raise_errors=False):
+    """
+    Generic fetcher for any table -> DataFrame.
+    columns: projection ("*", "a, b" or a list). filters: see _filters_key.
+    Large tables are read in pages of PAGE_SIZE rows and assembled once.
+    Reads are served from the process cache (see READ CACHE) and, in mirror
+    mode, from the local replica (see READ REPLICA) unless use_cache=False.
+    A failed read raises DataAccessError if raise_errors, else it is reported
+    in the page and an empty frame is returned (never cached).
+    Returns a copy, so callers can freely add columns.
+    """
     client = init_connection()
     if not client: return pd.DataFrame()
+
+    projection = _projection_key(columns)
+    filters = _filters_key(filters)
+    order = tuple(order or ())
+    key = (table_name, projection, filters, order, get_table_version(table_name))
+    if use_cache:
+        cached = _cache_get(key)
+        if cached is not None:
+            return cached.copy()
+
+    if REPLICA_ENABLED and use_cache and table_name in replica.REPLICA_KEYS:
+        try:
+            df = _replica_read(client, table_name, projection, filters, order)
+            if key[-1] == get_table_version(table_name):
+                _cache_put(key, df)
+            return df.copy()
+        except Exception as e:
+            print(f"Replica read fallback ({table_name}): {e}")
+
+    delta = use_cache and _supports_delta(table_name, projection, filters)
+    refreshed = _delta_refresh(client, table_name, projection, order, key) if delta else None
+    if refreshed is not None:
+        df, watermark = refreshed
+    else:
+        try:
+            rows = _fetch_rows(client, table_name, projection, filters, order)
+            df = pd.DataFrame(rows)
+        except DataAccessError as e:
+            # Errors are not cached, next call retries
+            if raise_errors:
+                raise
+            _report_error(f"No se pudo leer '{table_name}'", e)
+            return pd.DataFrame()
+        watermark = _frame_watermark(table_name, df) if delta else None
+
+    # Skip caching if a write landed while we were fetching
+    if use_cache and key[-1] == get_table_version(table_name):
+        _cache_put(key, df, watermark)
+    elif watermark is not None:
+        with _cache_lock:
+            _stale_bases[_stale_key(key)] = {"df": df, "fetched_at": time.monotonic(), "bytes": 0, "watermark": watermark}
+    return df.copy()
+
+def get_table_page(table_name, columns="*", filters=None, order=None, page=0, page_size=None, raise_errors=False):
+    """
+    One page of a filtered, ordered read (server-side paging, one request).
+    Returns (DataFrame, total matching rows). Pages share the read cache with
+    get_table_df (the page is part of the key) and expire on any write.
+    """
+    client = init_connection()
+    if not client: return pd.DataFrame(), 0
+    page_size = page_size or PAGE_SIZE
+    projection = _projection_key(columns)
+    filters = _filters_key(filters)
+    order = tuple(_effective_order(table_name, order))
+    key = (table_name, projection, filters + (("__page__", page, page_size),), order, get_table_version(table_name))
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached.copy(), cached.attrs.get("total", len(cached))
+
     try:
-        res = client.table(table_name).select("*").execute()
-        return pd.DataFrame(res.data)
-    except Exception as e:
-        # print(f"Error fetching {table_name}: {e}")
-        return pd.DataFrame()
+        query = _apply_filters(client.table(table_name).select(projection, count="exact"), filters)
+        for col in order:
+            query = query.order(col.lstrip("-"), desc=col.startswith("-"))
+        start = page * page_size
+        res = with_retry(query.range(start, start + page_size - 1).execute)
+    except DataAccessError as e:
+        if raise_errors:
+            raise
+        _report_error(f"No se pudo leer '{table_name}'", e)
+        return pd.DataFrame(), 0
+
+    df = pd.DataFrame(res.data)
+    df.attrs["total"] = res.count if res.count is not None else len(df)
+    if key[-1] == get_table_version(table_name):
+        _cache_put(key, df)
+    return df.copy(), df.attrs["total"]
 
 def upsert_data(table_name, records):
     """Generic upsert for list of dicts"""
@@ -55,11 +588,140 @@ def upsert_data(table_name, records):
     if not client: return False, "No Connection"
     try:
         # Assuming table has PK propertly set for Upsert behavior
-        client.table(table_name).upsert(records).execute()
+        res = with_retry(client.table(table_name).upsert(records).execute)
+        record_write(table_name, res.data)
         return True, "Upsert Successful"
     except Exception as e:
+        invalidate_table_cache(table_name)
         return False, str(e)
 
+def _same_values(row, payload):
+    """True when the stored row already holds every value of the payload."""
+    def norm(v):
+        return int(v) if isinstance(v, float) and v.is_integer() else v
+    return all(norm(row.get(k)) == norm(v) for k, v in payload.items())
+
+def save_activity_changes(updates=(), inserts=(), deletes=(), edges=None):
+    """
+    Diff-only save of the Planning CMS with optimistic concurrency.
+    updates: records with 'id' (and 'row_version' as read, schema v10).
+    inserts: new records (no id). deletes: [(id, row_version)].
+    edges: validated (activity_code, depends_on_code) pairs; the parent lists
+    of the saved activities are replaced with them.
+    An update/delete only applies if row_version still matches; otherwise the
+    activity was changed by someone else and is reported, not overwritten.
+    Returns (success, message).
+    """
+    client = init_connection()
+    if not client: return False, "No Connection"
+    table = client.table("activities")
+    written, conflicts, removed = [], [], False
+    try:
+        # 1. Conditional updates (one request per changed row)
+        for rec in updates:
+            rec = dict(rec)
+            act_id, version = rec.pop("id"), rec.pop("row_version", None)
+            query = table.update(rec).eq("id", act_id)
+            if version is not None:
+                query = query.eq("row_version", int(version))
+            res = with_retry(query.execute)
+            if res.data:
+                written.extend(res.data)
+                continue
+            # No row matched: our own earlier attempt (retry) or a concurrent edit
+            current = with_retry(table.select("*").eq("id", act_id).execute).data
+            if current and _same_values(current[0], rec):
+                written.extend(current)
+            else:
+                conflicts.append(rec.get("activity_code") or str(act_id))
+
+        # 2. Inserts (a code that already exists is reported, not overwritten)
+        if inserts:
+            res = with_retry(table.upsert(list(inserts), on_conflict="activity_code", ignore_duplicates=True).execute)
+            written.extend(res.data)
+            created = {r.get("activity_code") for r in res.data}
+            missing = [r for r in inserts if r.get("activity_code") not in created]
+            # Skipped codes: our own row from a retried request, or someone else's
+            stored = {}
+            codes = [r["activity_code"] for r in missing]
+            for i in range(0, len(codes), IN_FILTER_CHUNK):
+                found = with_retry(table.select("*").in_("activity_code", codes[i:i + IN_FILTER_CHUNK]).execute).data
+                stored.update((r["activity_code"], r) for r in found)
+            for rec in missing:
+                current = stored.get(rec["activity_code"])
+                if current and _same_values(current, rec):
+                    written.append(current)
+                else:
+                    conflicts.append(rec["activity_code"])
+
+        # 3. Conditional deletes
+        for act_id, version in deletes:
+            query = table.delete().eq("id", act_id)
+            if version is not None:
+                query = query.eq("row_version", int(version))
+            res = with_retry(query.execute)
+            removed = True
+            if not res.data and with_retry(table.select("id, activity_code").eq("id", act_id).execute).data:
+                conflicts.append(str(act_id))
+    except Exception as e:
+        return False, str(e)
+    finally:
+        record_write("activities", written)
+        if removed:
+            invalidate_table_cache("activities")
+
+    if edges is not None and written:
+        dep_ok, dep_msg = replace_dependency_edges([r["activity_code"] for r in written], edges)
+        if not dep_ok:
+            return False, f"Dependencias no sincronizadas: {dep_msg}"
+
+    if conflicts:
+        return False, f"Modificadas por otro usuario (no se guardaron): {', '.join(conflicts)}. Recarga y vuelve a aplicar tus cambios."
+    return True, f"{len(written)} actividades guardadas"
+
+# --- PREFETCH ---
+# A view declares every read it needs up front; they run concurrently on a
+# shared pool, so its load time is the slowest read instead of the sum.
+PREFETCH_WORKERS = _get_setting("GWP_PREFETCH_WORKERS", 6)
+PREFETCH_ROUNDS = 2 # Refetch rounds for tables written while the bundle loads
+
+_prefetch_pool = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="gwp-prefetch")
+
+def prefetch_tables(specs):
+    """
+    Runs the reads of a view concurrently and returns {name: result}.
+    specs: {name: table_name | (table_name, get_table_df kwargs) | callable}.
+    Table entries are version-consistent: if a write lands on one of their
+    tables while the bundle loads, those entries are fetched again.
+    Callables must raise on failure (raise_errors=True), never report: workers
+    have no page. Failures are reported here (empty frame / None), as get_table_df does.
+    """
+    jobs, tables = {}, {}
+    for name, spec in specs.items():
+        if callable(spec):
+            jobs[name] = spec
+            continue
+        table, kwargs = (spec, {}) if isinstance(spec, str) else spec
+        tables[name] = table
+        jobs[name] = lambda table=table, kwargs=kwargs: get_table_df(table, raise_errors=True, **kwargs)
+
+    results = {}
+    pending = list(jobs)
+    for _ in range(PREFETCH_ROUNDS):
+        versions = {n: get_table_version(tables[n]) for n in pending if n in tables}
+        futures = {n: _prefetch_pool.submit(jobs[n]) for n in pending}
+        for n, fut in futures.items():
+            try:
+                results[n] = fut.result()
+            except Exception as e:
+                # Reported here, in the script thread (workers have no page to write to)
+                _report_error(f"No se pudo leer '{tables.get(n, n)}'", e)
+                results[n] = pd.DataFrame() if n in tables else None
+        pending = [n for n, v in versions.items() if get_table_version(tables[n]) != v]
+        if not pending:
+            break
+    return results
+
 # --- HELPER FUNCTIONS ---
 
 def get_activities_df():
@@ -75,14 +737,166 @@ def get_project_meta():
 def update_project_meta(key, value):
     return upsert_data("project_meta", [{"key": key, "value": value}])
 
+def get_dashboard_summary(today):
+    """
+    Constant-size dashboard aggregates from the dashboard_summary RPC (schema v9).
+    Returns the JSON dict, or None when the RPC is unavailable.
+    """
+    client = init_connection()
+    if not client: return None
+    try:
+        res = with_retry(client.rpc("dashboard_summary", {"p_today": today.isoformat()}).execute)
+        return res.data
+    except Exception as e:
+        print(f"Dashboard RPC unavailable: {e}")
+        return None
+
+# --- DEPENDENCY EDGES ---
+
+def get_dependency_edges(activities_df=None, raise_errors=False):
+    """
+    Many-to-many dependency edges as a DataFrame (activity_code, depends_on_code).
+    Reads activity_dependencies (schema v8); before that migration, derives the
+    edges from the canonical dependency_code column.
+    A failed read raises DataAccessError if raise_errors, else it is reported
+    and the edges are derived from the column.
+    """
+    try:
+        edges = get_table_df("activity_dependencies", ["activity_code", "depends_on_code"], raise_errors=True)
+    except DataAccessError as e:
+        if not is_missing_table(e):
+            if raise_errors:
+                raise
+            _report_error("No se pudo leer 'activity_dependencies'", e)
+        edges = pd.DataFrame()
+    if 'depends_on_code' in edges.columns:
+        return edges
+    from logic import edges_from_dependency_column
+    if activities_df is None or 'dependency_code' not in activities_df.columns:
+        activities_df = get_table_df("activities", ["activity_code", "dependency_code"], raise_errors=raise_errors)
+    return edges_from_dependency_column(activities_df)
+
+def replace_dependency_edges(activity_codes, edges):
+    """
+    Replaces the parent lists of the given activities in activity_dependencies.
+    edges: iterable of (activity_code, depends_on_code) already validated.
+    Returns (success, message).
+    """
+    client = init_connection()
+    if not client: return False, "No Connection"
+    codes = sorted(set(activity_codes))
+    if not codes: return True, "Sin cambios"
+    rows = [{"activity_code": c, "depends_on_code": p} for c, p in edges if c in set(codes)]
+    try:
+        for i in range(0, len(codes), IN_FILTER_CHUNK):
+            with_retry(client.table("activity_dependencies").delete().in_("activity_code", codes[i:i + IN_FILTER_CHUNK]).execute)
+        for i in range(0, len(rows), IMPORT_BATCH_SIZE):
+            # Upsert on the edge key so a retried batch cannot duplicate edges
+            with_retry(client.table("activity_dependencies").upsert(
+                rows[i:i + IMPORT_BATCH_SIZE], on_conflict="activity_code,depends_on_code").execute)
+        return True, "Dependencias actualizadas"
+    except Exception as e:
+        return False, str(e)
+    finally:
+        # Edge triggers recompute activities.is_blocked (schema v12); delta sync pulls those rows
+        invalidate_table_cache("activity_dependencies", "activities")
+
+def refresh_blocked_dependents(written):
+    """
+    After a status write, re-reads the direct dependents of the written
+    activities: their stored is_blocked (schema v12) was recomputed by the
+    database in the same transaction. Patches them into the read cache.
+    """
+    if not written or "is_blocked" not in written[0]:
+        return # Pre-v12 schema: blocking is derived from the edges on read
+    codes = {r.get("activity_code") for r in written}
+    edges = get_dependency_edges()
+    kids = sorted(set(edges.loc[edges["depends_on_code"].isin(codes), "activity_code"])) if not edges.empty else []
+    if not kids:
+        return
+    client = init_connection()
+    rows = []
+    try:
+        for i in range(0, len(kids), IN_FILTER_CHUNK):
+            res = with_retry(client.table("activities").select("*").in_("activity_code", kids[i:i + IN_FILTER_CHUNK]).execute)
+            rows.extend(res.data)
+        record_write("activities", rows)
+    except Exception as e:
+        print(f"Dependents refresh error: {e}")
+        invalidate_table_cache("activities")
+
 def update_activity_status_flow(activity_id, new_status):
     """Helper for Kanban flow"""
     client = init_connection()
     try:
-        client.table("activities").update({"status": new_status}).eq("id", activity_id).execute()
+        res = with_retry(client.table("activities").update({"status": new_status}).eq("id", activity_id).execute)
+        record_write("activities", res.data)
+        refresh_blocked_dependents(res.data)
         return True, "Updated"
+    except Exception as e:
+        invalidate_table_cache("activities")
+        return False, str(e)
+
+def update_activities_status_batch(status_by_id, expected_status=None):
+    """
+    Applies many board transitions at once ({activity_id: new_status},
+    validated against a snapshot). The transition_activity_status_batch RPC
+    (schema v14) re-checks every row under a lock, so a parent reopened since
+    the snapshot still blocks. Without it, one update().in_() per (current,
+    new) status pair, conditional on the current status the snapshot saw
+    (expected_status {activity_id: status}).
+    Rows not written are reported in the message.
+    Returns (success, message).
+    """
+    client = init_connection()
+    if not client: return False, "No Connection"
+    expected_status = expected_status or {}
+    ids = list(status_by_id)
+    written, rejected = [], []
+    try:
+        try:
+            for i in range(0, len(ids), IN_FILTER_CHUNK):
+                chunk = ids[i:i + IN_FILTER_CHUNK]
+                res = with_retry(client.rpc("transition_activity_status_batch", {
+                    "p_ids": [int(a) for a in chunk], "p_statuses": [status_by_id[a] for a in chunk]}).execute)
+                for r in res.data or []:
+                    if r.get("ok") and r.get("row"):
+                        written.append(r["row"])
+                    elif not r.get("ok"):
+                        rejected.append(f"{r.get('activity_code') or r.get('id')} ({r.get('message')})")
+        except Exception as e:
+            if not is_missing_rpc(e):
+                raise
+            # Pre-v14: conditional grouped updates (the rows must still be in the status the check saw)
+            groups = {}
+            for act_id, status in status_by_id.items():
+                groups.setdefault((expected_status.get(act_id), status), []).append(act_id)
+            for (current, status), group in groups.items():
+                for i in range(0, len(group), IN_FILTER_CHUNK):
+                    query = client.table("activities").update({"status": status}).in_("id", group[i:i + IN_FILTER_CHUNK])
+                    if current is not None:
+                        query = query.eq("status", current)
+                    written.extend(with_retry(query.execute).data)
+            done = {r.get("id") for r in written}
+            missing = [a for a in ids if a not in done]
+            codes = {}
+            for i in range(0, len(missing), IN_FILTER_CHUNK):
+                res = with_retry(client.table("activities").select("id, activity_code").in_("id", missing[i:i + IN_FILTER_CHUNK]).execute)
+                codes.update((r["id"], r["activity_code"]) for r in res.data)
+            rejected.extend(f"{codes.get(a, a)} (cambiada por otro usuario)" for a in missing)
     except Exception as e:
         return False, str(e)
+    finally:
+        # Patch what was written (partial batches included); rejected rows mean the snapshot was stale
+        record_write("activities", written)
+        refresh_blocked_dependents(written)
+        if rejected:
+            invalidate_table_cache("activities")
+
+    msg = f"{len(written)} actividades actualizadas"
+    if rejected:
+        return False, f"{msg}. No aplicadas: {', '.join(rejected)}"
+    return True, msg
 
 def seed_master_defaults():
     """Restores default Users and Products if missing"""
@@ -113,104 +927,154 @@ def seed_master_defaults():
         
         # Let's clean the user payload to rely on email upsert logic if implemented or just insert
         for u in users:
-             # Try insert, ignore if fails (email unique)
+             # Insert, skip users that already exist (email unique); any other failure aborts
              try:
                  # Removing ID to let Supabase gen it
                  u_clean = {k: v for k, v in u.items() if k != 'id'}
-                 client.table("users").insert(u_clean).execute()
-             except:
-                 pass
+                 with_retry(client.table("users").insert(u_clean).execute, idempotent=False)
+             except DataAccessError as e:
+                 if _error_code(e) not in DUPLICATE_KEY_CODES:
+                     raise
         
         # Products upsert
-        client.table("contract_products").upsert(products).execute()
+        with_retry(client.table("contract_products").upsert(products).execute)
         
         return True, "Datos Restaurados Correctamente"
     except Exception as e:
         return False, f"Error: {str(e)}"
+    finally:
+        invalidate_table_cache("users", "contract_products")
+
+IMPORT_BATCH_SIZE = _get_setting("GWP_IMPORT_BATCH_SIZE", 500)
+IMPORT_CHUNK_ROWS = _get_setting("GWP_IMPORT_CHUNK_ROWS", 2000) # Rows parsed and validated at a time
 
-def seed_activities_from_csv(file_path):
-    """Reads CSV and seeds activities table"""
+# Columns owned by the CSV (status is owned by the app and is only set on insert)
+IMPORT_COMPARE_COLS = ["product_code", "task_name", "week_start", "week_end", "type_tag", "dependency_code", "primary_role", "co_responsibles"]
+# Owned by the file only when it has them (otherwise the stored values are kept)
+IMPORT_OPTIONAL_COLS = ["evidence_requirement", "is_gate_blocker"]
+
+def _same_value(a, b):
+    """Loose equality between a CSV value and a DB value (None/NaN/'' are equal, ints vs strings)"""
+    def norm(v):
+        if v is None or (isinstance(v, float) and pd.isna(v)): return None
+        v = str(v).strip()
+        if v.endswith(".0") and v[:-2].lstrip("-").isdigit(): v = v[:-2]
+        return v or None
+    return norm(a) == norm(b)
+
+def _classify_activity(rec, current, cols):
+    """'inserted', 'updated' or 'unchanged' for one validated file row against the snapshot."""
+    old = current.get(rec["activity_code"])
+    if old is None:
+        return "inserted"
+    return "unchanged" if all(_same_value(rec.get(c), old.get(c)) for c in cols) else "updated"
+
+def seed_activities_from_csv(file_path, dry_run=False, batch_size=None, report=None):
+    """
+    Imports activities from a CSV (any encoding/header layout, see ingest.py) or Excel file.
+    Streams the file in chunks of IMPORT_CHUNK_ROWS rows, twice:
+    1. validate + classify every row against one prefetched snapshot and keep
+       only codes and parents (for the dependency graph);
+    2. bulk upsert the new/changed rows on activity_code in batches of batch_size.
+    Invalid rows are skipped and appended to 'report' (list of {fila,
+    activity_code, columna, error}); on repeated codes the last row wins.
+    dry_run=True computes and reports the diff without writing anything.
+    Rows present in the DB but not in the file are reported, never deleted.
+    The resulting dependency graph is validated first (cycles and
+    self-references reject the import; unknown codes are only reported).
+    """
+    from logic import parse_dependency_codes, validate_dependency_graph, is_valid_dependency_report, format_dependency_report, users_role_mapping
+    import ingest
     client = init_connection()
+    batch_size = batch_size or IMPORT_BATCH_SIZE
+    report = report if report is not None else []
+    wrote = False
     try:
-        # Role Reverse Map
-        name_to_role = {
-            "Astrid": "COORD",
-            "Patricio": "FINANZAS", 
-            "Constanza": "LEGAL",
-            "GOV": "GOBIERNO",
-            "Todos": "COORD" # Fallback
-        }
+        # One snapshot round trip for the whole diff
+        snapshot = get_table_df("activities", ["activity_code"] + IMPORT_COMPARE_COLS + IMPORT_OPTIONAL_COLS, use_cache=False, raise_errors=True)
+        current = {r['activity_code']: r for r in snapshot.to_dict('records')} if not snapshot.empty else {}
+        # Responsible names resolve like in the CMS (users table)
+        name_to_role = users_role_mapping(get_table_df("users", ["full_name", "role"], raise_errors=True))
 
-        activities = []
-        # Try cp1252 (common in Excel/Windows)
-        with open(file_path, 'r', encoding='cp1252') as f: 
-            reader = csv.DictReader(f)
-            # CSV Cols: ID,Producto,Actividad ,Sem. inicio,Sem. fin,Tipo,Depende de,Evidencia ,Resp. primario,Co-responsables
-            # Clean keys (strip spaces)
-            reader.fieldnames = [name.strip() for name in reader.fieldnames]
-            
-            for row in reader:
-                # Map
-                code = row.get("ID", "").strip()
-                if not code: continue
-                
-                # Clean integers
-                try: ws = int(row.get("Sem. inicio", 1))
-                except: ws = 1
-                try: we = int(row.get("Sem. fin", 1))
-                except: we = 1
-                
-                # Clean Role
-                raw_resp = row.get("Resp. primario", "Astrid").strip()
-                role = name_to_role.get(raw_resp, "COORD") # Default to COORD if unknown
-                
-                # Clean Dependency
-                dep = row.get("Depende de", "").strip()
-                if dep == "?" or dep == "": dep = None
-                
-                # Product
-                prod = row.get("Producto", "").strip()
-                
-                act = {
-                    "activity_code": code,
-                    "product_code": prod,
-                    "task_name": row.get("Actividad", "").strip(),
-                    "week_start": ws,
-                    "week_end": we,
-                    "type_tag": row.get("Tipo", "INT").strip(),
-                    "dependency_code": dep,
-                    "primary_role": role,
-                    "status": "PENDING", # Default
-                    "co_responsibles": row.get("Co-responsables", "")
-                }
-                activities.append(act)
-        
-        # Upsert
-        # We need a conflict key. activity_code should be unique usually.
-        # But 'activities' PK is 'id' (serial/uuid).
-        # We need to check if we can upsert by 'activity_code'.
-        # If schema doesn't have unique constraint on activity_code, upsert might insert duplicates.
-        # Strategy: First check if activity_code exists, update it. Else insert.
-        # Bulk upsert is better if unique constraint exists. 
-        # Assuming activity_code is NOT unique constraint in v4 schema (it was just text).
-        # Let's try to Delete All and Rewrite? No, unsafe.
-        # Let's Lookup by code.
-        
-        for a in activities:
-            # Check exist
-            res = client.table("activities").select("id").eq("activity_code", a["activity_code"]).execute()
-            if res.data:
-                # Update
-                uid = res.data[0]['id']
-                client.table("activities").update(a).eq("id", uid).execute()
-            else:
-                # Insert
-                client.table("activities").insert(a).execute()
+        # 1. Validation pass: per code only its last line, diff kind and parents are kept
+        last_line, kinds, parents = {}, {}, {}
+        valid_rows = 0
+        for chunk, errors in ingest.iter_activity_chunks(file_path, IMPORT_CHUNK_ROWS, name_to_role):
+            report.extend(errors)
+            valid_rows += len(chunk)
+            cols = [c for c in IMPORT_COMPARE_COLS + IMPORT_OPTIONAL_COLS if c in chunk.columns]
+            for rec in chunk.to_dict('records'):
+                code = rec["activity_code"]
+                last_line[code] = rec["_line"]
+                kinds[code] = _classify_activity(rec, current, cols)
+                parents[code] = parse_dependency_codes(rec.get("dependency_code"))
+        if not last_line:
+            return False, f"No hay filas válidas para importar ({len(report)} con errores)."
+
+        # DAG validation: file parents for file rows, stored parents for the rest
+        csv_codes = set(last_line)
+        all_codes = csv_codes | set(current)
+        edges = [(c, p) for c, ps in parents.items() for p in ps]
+        stored = get_dependency_edges(snapshot)
+        edges += [(c, p) for c, p in zip(stored['activity_code'], stored['depends_on_code']) if c not in csv_codes]
+        dag = validate_dependency_graph(all_codes, edges)
+        dep_errors, dep_warnings = format_dependency_report(dag)
+        if not is_valid_dependency_report(dag):
+            return False, "Importación rechazada: " + " | ".join(dep_errors)
+
+        counts = {k: sum(1 for v in kinds.values() if v == k) for k in ("inserted", "updated", "unchanged")}
+        removed = sorted(c for c in current if c not in csv_codes)
+        summary = (f"{counts['inserted']} nuevas, {counts['updated']} actualizadas, "
+                   f"{counts['unchanged']} sin cambios, {len(removed)} solo en BD")
+        if report:
+            summary += f", {len(report)} filas con errores (omitidas)"
+        if valid_rows > len(last_line):
+            summary += f", {valid_rows - len(last_line)} códigos repetidos (se usa la última fila)"
+        if dep_warnings:
+            summary += ". " + " | ".join(dep_warnings)
+        if dry_run:
+            removed_info = ""
+            if removed:
+                removed_info = f" (no presentes en el archivo: {', '.join(removed[:10])}{'...' if len(removed) > 10 else ''})"
+            return True, f"Vista previa: {summary}{removed_info}."
+
+        # 2. Write pass: new rows start as PENDING; existing rows keep their current status.
+        # activity_code is UNIQUE (schema v3), so it is the conflict key.
+        buffers = {"inserted": [], "updated": []}
+        def flush(kind, force=False):
+            nonlocal wrote
+            while buffers[kind] and (force or len(buffers[kind]) >= batch_size):
+                batch = buffers[kind][:batch_size]
+                buffers[kind] = buffers[kind][batch_size:]
+                wrote = True
+                with_retry(client.table("activities").upsert(batch, on_conflict="activity_code").execute)
+
+        for chunk, _ in ingest.iter_activity_chunks(file_path, IMPORT_CHUNK_ROWS, name_to_role):
+            for rec in chunk.to_dict('records'):
+                line, code = rec.pop("_line"), rec["activity_code"]
+                kind = kinds[code]
+                if line != last_line[code] or kind == "unchanged":
+                    continue
+                buffers[kind].append(dict(rec, status="PENDING") if kind == "inserted" else rec)
+            flush("inserted")
+            flush("updated")
+        flush("inserted", force=True)
+        flush("updated", force=True)
+
+        # Edges of the written rows (activities must exist first: FK)
+        changed_codes = [c for c, k in kinds.items() if k != "unchanged"]
+        ok, dep_msg = replace_dependency_edges(changed_codes, dag["valid_edges"])
+        if not ok:
+            summary += f". Aviso: dependencias no sincronizadas ({dep_msg})"
                 
-        return True, f"Se importaron {len(activities)} actividades."
+        return True, f"Se importaron {len(last_line)} actividades ({summary})."
         
     except Exception as e:
         return False, str(e)
+    finally:
+        # Partial imports also changed data
+        if wrote:
+            invalidate_table_cache("activities")
 
 # --- STORAGE FUNCTIONS ---
 
@@ -231,16 +1095,14 @@ def upload_evidence(file_obj, activity_code, user_role):
         
         # Upload using 'upsert' option if supported by lib validation, else try normal
         # Check supabase-py storage lib docs or just try default upload
-        res = client.storage.from_("evidence").upload(
+        res = with_retry(lambda: client.storage.from_("evidence").upload(
             path=storage_path,
             file=file_bytes,
             file_options={"content-type": content_type, "upsert": "true"}
-        )
+        ))
         
         # 2. Insert/Update DB Record
         # We delete old metadata to simple "upsert" logic without unique constraint issues
-        client.table("evidence_files").delete().eq("storage_path", storage_path).execute()
-        
         metadata = {
             "activity_code": activity_code,
             "filename": filename,
@@ -250,43 +1112,131 @@ def upload_evidence(file_obj, activity_code, user_role):
             "uploaded_by": user_role
         }
         
-        client.table("evidence_files").insert(metadata).execute()
+        def replace_metadata():
+            # Delete + insert keyed by storage_path: safe to retry as a unit
+            client.table("evidence_files").delete().eq("storage_path", storage_path).execute()
+            client.table("evidence_files").insert(metadata).execute()
+        with_retry(replace_metadata)
+        _forget_signed_urls([storage_path])
         
-        # Sync flag
-        sync_activities_file_status()
+        # Sync flag (this activity only)
+        sync_activity_file_status(activity_code)
         
         return True, "Archivo subido correctamente."
         
     except Exception as e:
         print(f"🔴 DEBUG UPLOAD ERROR: {str(e)}") # Log to console
         return False, f"Error Upload: {str(e)}"
+    finally:
+        invalidate_table_cache("evidence_files", "activities")
+
+# --- SIGNED URL CACHE ---
+# Signed URLs are reused until shortly before they expire.
+SIGNED_URL_TTL_SECONDS = _get_setting("GWP_SIGNED_URL_TTL_SECONDS", 3600)
+SIGNED_URL_MARGIN_SECONDS = _get_setting("GWP_SIGNED_URL_MARGIN_SECONDS", 300)
+
+_signed_url_cache = {} # storage_path -> (url, expires_at epoch seconds)
+
+def _forget_signed_urls(storage_paths):
+    with _cache_lock:
+        for p in storage_paths:
+            _signed_url_cache.pop(p, None)
+
+def get_evidence_urls(storage_paths):
+    """
+    Batch version of get_evidence_url: returns {storage_path: signed_url}.
+    Cached URLs still valid beyond the safety margin are reused; the rest are
+    signed with a single multi-path create_signed_urls call.
+    Paths that could not be signed are missing from the result.
+    """
+    urls = {}
+    now = time.time()
+    missing = []
+    with _cache_lock:
+        for p in dict.fromkeys(storage_paths): # de-dup, keep order
+            cached = _signed_url_cache.get(p)
+            if cached and cached[1] - SIGNED_URL_MARGIN_SECONDS > now:
+                urls[p] = cached[0]
+            else:
+                missing.append(p)
+    if not missing:
+        return urls
 
-def get_evidence_url(storage_path):
-    """Generates a signed URL (valid 1 hour) for download"""
     client = init_connection()
+    if not client: return urls
     try:
-        # Create Signed URL
-        res = client.storage.from_("evidence").create_signed_url(storage_path, 3600)
-        return res['signedURL']
+        res = with_retry(lambda: client.storage.from_("evidence").create_signed_urls(missing, SIGNED_URL_TTL_SECONDS))
+        expires_at = now + SIGNED_URL_TTL_SECONDS
+        with _cache_lock:
+            # Drop expired entries so the cache stays bounded by live files
+            for p in [p for p, (_, exp) in _signed_url_cache.items() if exp <= now]:
+                del _signed_url_cache[p]
+            for item in res:
+                url = item.get('signedURL') or item.get('signedUrl')
+                if item.get('error') or not url:
+                    continue
+                _signed_url_cache[item['path']] = (url, expires_at)
+                urls[item['path']] = url
     except Exception as e:
-        return None
+        print(f"Signed URL error: {e}")
+    return urls
+
+def get_evidence_url(storage_path):
+    """Returns a signed URL (valid 1 hour by default) for download, reusing cached ones"""
+    return get_evidence_urls([storage_path]).get(storage_path)
+
+def _evidence_rows(projection, filters):
+    """Evidence records newest first, through the read cache (and replica)."""
+    df = get_table_df("evidence_files", projection, filters, ["-uploaded_at"], raise_errors=True)
+    return df.astype(object).where(df.notna(), None).to_dict("records")
 
-def get_evidence_by_activity(activity_code):
+# Columns the evidence lists actually render
+EVIDENCE_LIST_COLUMNS = "id, activity_code, filename, storage_path, uploaded_by, uploaded_at"
+
+def get_evidence_by_activity(activity_code, columns="*"):
     """Returns list of files for an activity"""
-    client = init_connection()
     try:
-        res = client.table("evidence_files").select("*").eq("activity_code", activity_code).execute()
-        return res.data
-    except:
+        return _evidence_rows(_projection_key(columns), [("activity_code", "eq", activity_code)])
+    except Exception as e:
+        _report_error("No se pudo leer la evidencia", e)
         return []
 
-def get_all_evidence():
-    """Returns list of all files for File Manager"""
-    client = init_connection()
+def get_evidence_index(activity_codes=None, columns="*", raise_errors=False):
+    """
+    Bulk evidence lookup: returns {activity_code: [file records]} for the given
+    codes (all codes if None) with one in_() query per chunk of codes.
+    Codes without files are simply missing from the dict.
+    A failed read raises DataAccessError if raise_errors, else it is reported.
+    """
+    index = {}
     try:
-        res = client.table("evidence_files").select("*").order("uploaded_at", desc=True).execute()
-        return res.data
-    except:
+        if activity_codes is None:
+            chunks = [None]
+        else:
+            codes = sorted(set(str(c) for c in activity_codes if c is not None and not pd.isna(c)))
+            if not codes: return index
+            chunks = [codes[i:i + IN_FILTER_CHUNK] for i in range(0, len(codes), IN_FILTER_CHUNK)]
+
+        projection = _projection_key(columns)
+        for chunk in chunks:
+            filters = [("activity_code", "in", chunk)] if chunk is not None else []
+            for r in _evidence_rows(projection, filters):
+                index.setdefault(r['activity_code'], []).append(r)
+        return index
+    except Exception as e:
+        if raise_errors:
+            raise
+        _report_error("No se pudo leer la evidencia", e)
+        return index
+
+def get_all_evidence(columns="*", filters=None, raise_errors=False):
+    """Returns list of all files for File Manager (newest first, every page)"""
+    try:
+        return _evidence_rows(_projection_key(columns), _filters_key(filters))
+    except Exception as e:
+        if raise_errors:
+            raise
+        _report_error("No se pudo leer la evidencia", e)
         return []
 
 def delete_evidence(storage_path):
@@ -295,37 +1245,63 @@ def delete_evidence(storage_path):
     try:
         # 1. Delete from Storage
         # Remove expects a list of paths
-        res = client.storage.from_("evidence").remove([storage_path])
+        res = with_retry(lambda: client.storage.from_("evidence").remove([storage_path]))
         
         # 2. Delete from DB
-        client.table("evidence_files").delete().eq("storage_path", storage_path).execute()
+        with_retry(client.table("evidence_files").delete().eq("storage_path", storage_path).execute)
+        _forget_signed_urls([storage_path])
         
-        # Sync flag
-        sync_activities_file_status()
+        # Sync flag (this activity only; path is {activity_code}/{filename})
+        sync_activity_file_status(storage_path.split("/")[0])
         
         return True, "Archivo eliminado."
     except Exception as e:
         return False, str(e)
+    finally:
+        invalidate_table_cache("evidence_files", "activities")
+
+# Set GWP_FILE_FLAG_TRIGGER=true (secrets or env) once Datos/update_schema_v7.sql is
+# applied: its evidence_files trigger keeps has_file_uploaded current, so the
+# per-upload sync below is skipped. Left false on an unmigrated database, the app
+# keeps syncing the flag itself (one extra read + write per upload/delete).
+FILE_FLAG_TRIGGER = _get_setting("GWP_FILE_FLAG_TRIGGER", False)
+
+def sync_activity_file_status(activity_code):
+    """
+    Incremental sync of 'has_file_uploaded' for ONE activity after an upload/delete.
+    No-op when the evidence_files trigger (schema v7) maintains the flag.
+    """
+    if FILE_FLAG_TRIGGER:
+        return True
+    client = init_connection()
+    try:
+        res = with_retry(client.table("evidence_files").select("id").eq("activity_code", activity_code).limit(1).execute)
+        has_file = len(res.data) > 0
+        with_retry(client.table("activities").update({"has_file_uploaded": has_file}).eq("activity_code", activity_code).execute)
+        return True
+    except Exception as e:
+        print(f"Sync Error ({activity_code}): {e}")
+        return False
 
 def sync_activities_file_status():
     """
-    Synchronizes the 'has_file_uploaded' flag in activities table
+    Full reconcile of the 'has_file_uploaded' flag in activities table
     based on actual presence of files in evidence_files.
+    Only needed to repair drift (uploads are synced per activity).
     """
     client = init_connection()
     try:
         # 1. Get all codes that have files
-        res_files = client.table("evidence_files").select("activity_code").execute()
-        codes_with_files = set(r['activity_code'] for r in res_files.data)
+        codes_with_files = set(r['activity_code'] for r in _fetch_rows(client, "evidence_files", "activity_code"))
         
         # 2. Get current status of all activities
-        res_acts = client.table("activities").select("id", "activity_code", "has_file_uploaded").execute()
+        acts = _fetch_rows(client, "activities", "id,activity_code,has_file_uploaded")
         
         # 3. Calculate updates
         updates_true = []
         updates_false = []
         
-        for act in res_acts.data:
+        for act in acts:
             code = act['activity_code']
             current_status = act.get('has_file_uploaded', False)
             should_have_file = code in codes_with_files
@@ -337,10 +1313,13 @@ def sync_activities_file_status():
                 
         # 4. Execute Batched Updates
         if updates_true:
-            client.table("activities").update({"has_file_uploaded": True}).in_("id", updates_true).execute()
+            with_retry(client.table("activities").update({"has_file_uploaded": True}).in_("id", updates_true).execute)
         
         if updates_false:
-            client.table("activities").update({"has_file_uploaded": False}).in_("id", updates_false).execute()
+            with_retry(client.table("activities").update({"has_file_uploaded": False}).in_("id", updates_false).execute)
+        
+        if updates_true or updates_false:
+            invalidate_table_cache("activities")
             
         return True
     except Exception as e:
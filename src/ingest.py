@@ -0,0 +1,184 @@
+import codecs
+import os
+
+import pandas as pd
+
+from logic import derive_activity_fields, unknown_responsibles, NULL_TEXT_TOKENS
+
+# Streaming ingestion of activity files (CSV or Excel).
+# The file is read in chunks of rows; each chunk is mapped to the activities
+# schema, validated with column operations and derived (logic.derive_activity_fields).
+# This module only parses and validates; db.py decides what to write.
+
+ENCODING_BLOCK_BYTES = 1024 * 1024 # Block size of the encoding scan
+FALLBACK_ENCODING = "cp1252" # Excel/Windows CSV exports
+
+# Target column -> accepted headers (compared stripped and case-insensitive).
+# Layouts: matriz_actividades_integradas.csv (Spanish headers) and
+# Cronograma_Maestro_Import.csv (schema-like headers).
+HEADER_ALIASES = {
+    "activity_code": ["ID", "activity_code", "Código"],
+    "product_code": ["Producto", "product_code"],
+    "task_name": ["Actividad", "task_name"],
+    "week_start": ["Sem. inicio", "week_start"],
+    "week_end": ["Sem. fin", "week_end"],
+    "type_tag": ["Tipo", "type_tag"], # Kept as written; derived only when empty
+    "dependency_code": ["Depende de", "dependency_code", "dependencies_text"],
+    "evidence_requirement": ["Evidencia", "evidence_requirement", "evidence_expected"],
+    "primary_role": ["Resp. primario", "primary_role", "responsible_role"],
+    "co_responsibles": ["Co-responsables", "co_responsibles"],
+    "is_gate_blocker": ["is_gate_blocker", "Bloqueante"],
+    "phase_id": ["phase_id", "Fase"], # Recognized; phases are derived from the weeks
+}
+REQUIRED_COLUMNS = ["activity_code", "task_name"]
+STORED_COLUMNS = ["activity_code", "product_code", "task_name", "week_start", "week_end", "type_tag",
+                  "dependency_code", "evidence_requirement", "primary_role", "co_responsibles", "is_gate_blocker"]
+
+TRUE_TOKENS = {"true", "1", "si", "sí", "yes", "x"}
+FALSE_TOKENS = {"false", "0", "no", ""}
+
+def detect_encoding(path):
+    """
+    UTF-8 (with or without BOM) when the whole file decodes as UTF-8,
+    else FALLBACK_ENCODING. Scans in blocks, so memory stays bounded.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    with open(path, "rb") as f:
+        head = f.read(3)
+        bom = head == codecs.BOM_UTF8
+        block = head if not bom else b""
+        try:
+            while True:
+                decoder.decode(block, final=False)
+                block = f.read(ENCODING_BLOCK_BYTES)
+                if not block:
+                    decoder.decode(b"", final=True)
+                    break
+        except UnicodeDecodeError:
+            return FALLBACK_ENCODING
+    return "utf-8-sig" if bom else "utf-8"
+
+def map_headers(headers):
+    """
+    {file header: target column} for the recognized headers.
+    Raises ValueError when a required column is missing.
+    """
+    lookup = {alias.strip().lower(): target for target, aliases in HEADER_ALIASES.items() for alias in aliases}
+    mapping = {}
+    for h in headers:
+        target = lookup.get(str(h).strip().lower())
+        if target and target not in mapping.values():
+            mapping[h] = target
+    missing = [c for c in REQUIRED_COLUMNS if c not in mapping.values()]
+    if missing:
+        raise ValueError(f"Columnas obligatorias no encontradas: {', '.join(missing)} (encabezados: {', '.join(map(str, headers))})")
+    return mapping
+
+def _excel_chunks(path, chunk_rows):
+    """Rows of the first sheet in chunks (openpyxl read-only mode streams the sheet)."""
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError("Para importar Excel instala 'openpyxl' (o exporta la hoja a CSV).")
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        headers = [str(h) if h is not None else "" for h in next(rows, [])]
+        buf = []
+        for r in rows:
+            buf.append(["" if v is None else str(v) for v in r[:len(headers)]])
+            if len(buf) >= chunk_rows:
+                yield pd.DataFrame(buf, columns=headers)
+                buf = []
+        if buf:
+            yield pd.DataFrame(buf, columns=headers)
+    finally:
+        wb.close()
+
+def iter_raw_chunks(path, chunk_rows, encoding=None):
+    """
+    Raw text chunks of the file (every value a string) with a '_line'
+    column holding the file line/row number (header = 1).
+    """
+    if os.path.splitext(path)[1].lower() in (".xlsx", ".xlsm"):
+        chunks = _excel_chunks(path, chunk_rows)
+    else:
+        chunks = pd.read_csv(path, encoding=encoding or detect_encoding(path), dtype=str,
+                             keep_default_na=False, chunksize=chunk_rows, skipinitialspace=True)
+    line = 2
+    for chunk in chunks:
+        chunk.insert(0, "_line", range(line, line + len(chunk)))
+        line += len(chunk)
+        yield chunk
+
+def _errors(df, mask, column, message):
+    """Report entries for the masked rows; message is a text or a Series aligned with df."""
+    messages = message[mask] if isinstance(message, pd.Series) else [message] * int(mask.sum())
+    return [{"fila": int(l), "activity_code": c, "columna": column, "error": m}
+            for l, c, m in zip(df.loc[mask, "_line"], df.loc[mask, "activity_code"], messages)]
+
+def validate_chunk(raw, mapping, name_to_role=None):
+    """
+    Maps, cleans and validates one raw chunk with column operations.
+    name_to_role: {full_name: role} of the users table (logic.users_role_mapping).
+    Returns (valid activities frame with derived fields, [row errors]).
+    Invalid rows are left out; weeks default to 1 when empty.
+    """
+    df = raw[["_line"] + list(mapping)].rename(columns=mapping)
+    text_cols = [c for c in df.columns if c not in ("_line", "week_start", "week_end")]
+    df[text_cols] = df[text_cols].apply(lambda s: s.astype(str).str.strip())
+    errors = []
+    bad = pd.Series(False, index=df.index)
+
+    # 1. Required text
+    for col in REQUIRED_COLUMNS:
+        mask = df[col] == ""
+        errors += _errors(df, mask & ~bad, col, "Valor obligatorio vacío")
+        bad |= mask
+
+    # 2. Weeks: integers >= 0, end not before start
+    for col in ("week_start", "week_end"):
+        if col not in df.columns:
+            df[col] = "1"
+        text = df[col].astype(str).str.strip()
+        num = pd.to_numeric(text.where(text != "", "1"), errors="coerce")
+        mask = num.isna() | (num < 0) | (num % 1 != 0)
+        errors += _errors(df, mask & ~bad, col, "Semana inválida: '" + text + "'")
+        bad |= mask
+        df[col] = num.fillna(1).astype(int)
+    mask = df["week_end"] < df["week_start"]
+    errors += _errors(df, mask & ~bad, "week_end", "La semana de fin es anterior a la de inicio")
+    bad |= mask
+
+    # 3. Optional typed columns (primary_role is NOT NULL: empty -> default role)
+    if "primary_role" not in df.columns:
+        df["primary_role"] = ""
+    if "is_gate_blocker" in df.columns:
+        flag = df["is_gate_blocker"].str.lower()
+        mask = ~flag.isin(TRUE_TOKENS | FALSE_TOKENS)
+        errors += _errors(df, mask & ~bad, "is_gate_blocker", "Valor no booleano (use TRUE/FALSE)")
+        bad |= mask
+        df["is_gate_blocker"] = flag.isin(TRUE_TOKENS)
+    if "evidence_requirement" in df.columns:
+        ev = df["evidence_requirement"]
+        df["evidence_requirement"] = ev.astype(object).where(~ev.str.lower().isin(NULL_TEXT_TOKENS), None)
+
+    # 4. Responsible: a known user name or role code (never guessed)
+    mask = unknown_responsibles(df["primary_role"], name_to_role)
+    errors += _errors(df, mask & ~bad, "primary_role", "Responsable desconocido: '" + df["primary_role"] + "'")
+    bad |= mask
+
+    valid = derive_activity_fields(df[~bad], name_to_role, keep_type_tag=True)
+    cols = ["_line"] + [c for c in STORED_COLUMNS if c in valid.columns]
+    return valid[cols], errors
+
+def iter_activity_chunks(path, chunk_rows, name_to_role=None):
+    """
+    Streams the file as (valid activities frame, [row errors]) per chunk.
+    Raises ValueError when the headers cannot be mapped.
+    """
+    mapping = None
+    for raw in iter_raw_chunks(path, chunk_rows):
+        if mapping is None:
+            mapping = {h: t for h, t in map_headers([c for c in raw.columns if c != "_line"]).items() if t != "phase_id"}
+        yield validate_chunk(raw, mapping, name_to_role)
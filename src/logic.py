@@ -1,37 +1,282 @@
 
 
+import re
+import numpy as np
 import pandas as pd
 import graphviz
+from project_calendar import add_schedule_dates
 
 
-def check_is_blocked(activity_row, all_activities_df):
+# Raw spellings of an empty value seen in CSVs/editor input (only interpreted at ingestion)
+NULL_TEXT_TOKENS = {'', '-', '–', '—', '?', 'nan', 'none', 'null'}
+NULL_DEPENDENCY_TOKENS = NULL_TEXT_TOKENS | {'0'}
+DEPENDENCY_SEPARATORS = r'[,;]'
+
+# --- DEPENDENCY DAG ---
+
+def parse_dependency_codes(value):
     """
-    Hard Lock Rule: Returns True if the parent dependency is NOT DONE.
+    Ingestion-time normalization of a raw 'depends on' value into a list of codes.
+    Splits on ',' / ';', strips, drops null spellings and duplicates (order kept).
     """
-    dep_code = activity_row.get('dependency_code')
-    
-    # 1. No dependency -> Not blocked
-    if pd.isna(dep_code) or not dep_code or dep_code == '-':
-        return False
-        
-    # 2. Find parent
-    # usage of 'activity_code' as the key
-    parent_rows = all_activities_df[all_activities_df['activity_code'] == dep_code]
-    
-    if parent_rows.empty:
-        # Parent not found in DB? 
-        # Safe strategy: If external dependency is missing, warn but maybe don't block forever.
-        # Strict strategy: Block.
-        # Returning False here assuming it might be an external reference not in system.
-        return False
-        
-    parent_status = parent_rows.iloc[0]['status']
-    
-    # 3. Check status
-    if parent_status != 'DONE':
-        return True
-        
-    return False
+    if value is None or (not isinstance(value, (list, tuple)) and pd.isna(value)):
+        return []
+    parts = value if isinstance(value, (list, tuple)) else re.split(DEPENDENCY_SEPARATORS, str(value))
+    codes = []
+    for p in parts:
+        p = str(p).strip()
+        if p.lower() not in NULL_DEPENDENCY_TOKENS and p not in codes:
+            codes.append(p)
+    return codes
+
+def format_dependency_codes(codes):
+    """Canonical dependency_code text: 'A, B' or None (never '-', '?', '')."""
+    return ", ".join(codes) if codes else None
+
+def edges_from_dependency_column(df):
+    """
+    Dependency edges (activity_code, depends_on_code) from the canonical
+    dependency_code column, in one vectorized split.
+    """
+    if df.empty or 'dependency_code' not in df.columns:
+        return pd.DataFrame(columns=['activity_code', 'depends_on_code'])
+    deps = df[['activity_code', 'dependency_code']].dropna()
+    deps = deps.assign(depends_on_code=deps['dependency_code'].astype(str).str.split(',')).explode('depends_on_code')
+    deps['depends_on_code'] = deps['depends_on_code'].str.strip()
+    deps = deps[deps['depends_on_code'] != '']
+    return deps[['activity_code', 'depends_on_code']].drop_duplicates().reset_index(drop=True)
+
+def validate_dependency_graph(codes, edges):
+    """
+    Linear-time (Kahn, O(V+E)) integrity check of the dependency DAG.
+    codes: iterable of existing activity codes. edges: iterable of (child, parent).
+    Returns a report dict:
+    - self_references: codes that depend on themselves (error)
+    - cycles: codes that sit on or behind a dependency cycle (error)
+    - dangling: (child, parent) pairs whose parent does not exist (warning, not stored as edge)
+    - valid_edges: the remaining (child, parent) pairs
+    """
+    nodes = set(codes)
+    report = {"self_references": [], "cycles": [], "dangling": [], "valid_edges": []}
+    children = {}
+    indegree = dict.fromkeys(nodes, 0)
+
+    for child, parent in dict.fromkeys(edges): # de-dup, keep order
+        if child == parent:
+            report["self_references"].append(child)
+        elif parent not in nodes or child not in nodes:
+            report["dangling"].append((child, parent))
+        else:
+            report["valid_edges"].append((child, parent))
+            children.setdefault(parent, []).append(child)
+            indegree[child] += 1
+
+    queue = [c for c, d in indegree.items() if d == 0]
+    visited = 0
+    while queue:
+        node = queue.pop()
+        visited += 1
+        for kid in children.get(node, []):
+            indegree[kid] -= 1
+            if indegree[kid] == 0:
+                queue.append(kid)
+
+    if visited < len(nodes):
+        report["cycles"] = sorted(c for c, d in indegree.items() if d > 0)
+    return report
+
+def is_valid_dependency_report(report):
+    """True when the graph can be saved (dangling references are only warnings)."""
+    return not report["self_references"] and not report["cycles"]
+
+def format_dependency_report(report, limit=10):
+    """Human readable (errors, warnings) message lists for the UI."""
+    def short(items):
+        items = list(items)
+        return ", ".join(items[:limit]) + ("..." if len(items) > limit else "")
+    errors, warnings = [], []
+    if report["self_references"]:
+        errors.append(f"Dependen de sí mismas: {short(report['self_references'])}")
+    if report["cycles"]:
+        errors.append(f"Dependencias circulares entre: {short(report['cycles'])}")
+    if report["dangling"]:
+        warnings.append(f"Dependencias externas/no encontradas (no bloquean): {short(f'{c} → {p}' for c, p in report['dangling'])}")
+    return errors, warnings
+
+# --- DERIVED FIELDS ---
+# One derivation for the CMS save, the CSV import and the seeding script:
+# whole frames in, whole columns out (no per-row Python).
+
+# Responsible name (as written in CSVs) -> role code; merged with users.full_name -> role
+DEFAULT_ROLE_MAPPING = {
+    "Astrid": "COORD",
+    "Patricio": "FINANZAS",
+    "Constanza": "LEGAL",
+    "GOV": "GOBIERNO",
+    "Todos": "COORD",
+}
+DEFAULT_ROLE = "COORD" # Empty or unknown responsible (importers report unknown ones)
+
+def _none_if_missing(series):
+    """Object column with None for missing values (JSON-ready)."""
+    return series.astype(object).where(series.notna(), None)
+
+def _text(series):
+    """Stripped string column; null spellings become <NA>."""
+    s = series.astype("string").str.strip()
+    return s.mask(s.str.lower().isin(NULL_TEXT_TOKENS))
+
+def unpack_product_codes(products):
+    """'1.1 | Coordinación' (editor label) -> '1.1'."""
+    return _text(products).str.split(" | ", n=1, regex=False).str[0].str.strip()
+
+def users_role_mapping(users_df):
+    """{full_name: role} from the users table, the name_to_role of every entry path."""
+    if users_df is None or users_df.empty or not {'full_name', 'role'} <= set(users_df.columns):
+        return {}
+    known = users_df.dropna(subset=['full_name', 'role'])
+    return dict(zip(known['full_name'].astype(str).str.strip(), known['role']))
+
+def unknown_responsibles(names, name_to_role=None):
+    """
+    Boolean mask of responsibles that are neither a known name nor a role
+    code (empty ones are not unknown). Importers report these as row errors.
+    """
+    mapping = {**DEFAULT_ROLE_MAPPING, **(name_to_role or {})}
+    clean = _text(names)
+    return (clean.notna() & ~clean.isin(set(mapping)) & ~clean.isin(set(mapping.values()))).astype(bool)
+
+def map_roles(names, name_to_role=None):
+    """
+    Responsible names -> role codes. Known names are mapped and role codes
+    kept; empty or unknown names get DEFAULT_ROLE (primary_role only ever
+    holds role codes, see unknown_responsibles to report them first).
+    name_to_role: extra {full_name: role} (e.g. from the users table).
+    """
+    mapping = {**DEFAULT_ROLE_MAPPING, **(name_to_role or {})}
+    clean = _text(names)
+    roles = clean.map(mapping).fillna(clean.where(clean.isin(set(mapping.values()))))
+    return roles.fillna(DEFAULT_ROLE).astype(object)
+
+def canonical_dependency_codes(values):
+    """Vectorized parse_dependency_codes + format_dependency_codes for a whole column."""
+    parts = values.reset_index(drop=True).astype("string").str.split(DEPENDENCY_SEPARATORS, regex=True).explode().str.strip()
+    parts = parts[parts.notna() & ~parts.str.lower().isin(NULL_DEPENDENCY_TOKENS)]
+    parts = parts.reset_index().drop_duplicates() # Per row, first occurrence wins
+    joined = parts.groupby('index')[parts.columns[1]].agg(", ".join)
+    out = joined.reindex(range(len(values)))
+    out.index = values.index
+    return _none_if_missing(out)
+
+def compute_type_tags(dependency_codes, co_responsibles):
+    """
+    INT with co-responsibles, else IND; '+DEP' with a dependency, and a pure
+    individual task without one is IND-P. Expects canonical dependency codes.
+    """
+    has_dep = dependency_codes.notna()
+    has_co = _text(co_responsibles).notna().to_numpy(dtype=bool)
+    base = pd.Series(np.where(has_co, "INT", "IND"), index=dependency_codes.index, dtype=object)
+    return base.where(~has_dep, base + "+DEP").mask(~has_dep & (base == "IND"), "IND-P")
+
+def derive_activity_fields(df, name_to_role=None, responsible_col='primary_responsible', keep_type_tag=False):
+    """
+    Computes the derived activity columns for a whole frame:
+    product_code (unpacked), dependency_code (canonical), primary_role (from
+    responsible_col, or the raw primary_role when absent) and type_tag.
+    keep_type_tag: keep the type_tag values already present (imported files)
+    and only fill the empty ones.
+    Returns a new frame.
+    """
+    out = df.copy()
+    if out.empty:
+        return out
+    if 'product_code' in out.columns:
+        out['product_code'] = _none_if_missing(unpack_product_codes(out['product_code']))
+    deps = out['dependency_code'] if 'dependency_code' in out.columns else pd.Series(None, index=out.index, dtype=object)
+    out['dependency_code'] = canonical_dependency_codes(deps)
+    source = responsible_col if responsible_col in out.columns else 'primary_role'
+    if source in out.columns:
+        out['primary_role'] = map_roles(out[source], name_to_role)
+    co = out['co_responsibles'] if 'co_responsibles' in out.columns else pd.Series(None, index=out.index, dtype=object)
+    tags = compute_type_tags(out['dependency_code'], co)
+    if keep_type_tag and 'type_tag' in out.columns:
+        tags = _text(out['type_tag']).astype(object).fillna(tags)
+    out['type_tag'] = tags
+    return out
+
+def build_dependency_index(all_activities_df, edges=None):
+    """
+    Precomputes the DAG lookups used by the blocking rules:
+    - status:   activity_code -> status (first row wins on duplicate codes)
+    - parents:  activity_code -> list of codes it depends on
+    - children: activity_code -> list of codes that depend on it
+    - blocked:  set of codes with at least one existing parent NOT DONE
+    edges: DataFrame (activity_code, depends_on_code); defaults to the
+    dependency_code column of the frame. Build once per rerun and reuse.
+    """
+    index = {"status": {}, "parents": {}, "children": {}, "blocked": set()}
+    if all_activities_df.empty or 'activity_code' not in all_activities_df.columns:
+        return index
+
+    firsts = all_activities_df.drop_duplicates(subset=['activity_code'], keep='first')
+    index["status"] = dict(zip(firsts['activity_code'], firsts['status']))
+
+    if edges is None:
+        edges = edges_from_dependency_column(all_activities_df)
+    if edges.empty:
+        return index
+
+    index["parents"] = edges.groupby('activity_code')['depends_on_code'].apply(list).to_dict()
+    index["children"] = edges.groupby('depends_on_code')['activity_code'].apply(list).to_dict()
+
+    parent_status = edges['depends_on_code'].map(index["status"])
+    blocking = edges[parent_status.notna() & (parent_status != 'DONE')]
+    index["blocked"] = set(blocking['activity_code'])
+    return index
+
+def get_parents(index, code):
+    """Codes this activity depends on."""
+    return index["parents"].get(code, [])
+
+def get_children(index, code):
+    """Codes that depend on this activity."""
+    return index["children"].get(code, [])
+
+def get_blocking_parents(index, code):
+    """Existing parents that are NOT DONE (the reason an activity is blocked)."""
+    return [p for p in get_parents(index, code) if index["status"].get(p, 'DONE') != 'DONE']
+
+def has_stored_blocked(df):
+    """True when the frame carries the stored is_blocked column (schema v12)."""
+    return 'is_blocked' in df.columns and df['is_blocked'].notna().all()
+
+def compute_blocked_mask(df, index=None):
+    """
+    Vectorized Hard Lock Rule for a whole frame.
+    Returns a boolean Series aligned with df.index: True where any existing
+    parent is NOT DONE. Parents not found are not blocking.
+    Uses the stored is_blocked column when present; otherwise 'index', the
+    dependency index of the full plan (defaults to df itself).
+    """
+    if df.empty or 'activity_code' not in df.columns:
+        return pd.Series(False, index=df.index, dtype=bool)
+    if has_stored_blocked(df):
+        return df['is_blocked'].astype(bool)
+    if index is None:
+        index = build_dependency_index(df)
+    return df['activity_code'].isin(index["blocked"]).astype(bool)
+
+def check_is_blocked(activity_row, all_activities_df, index=None):
+    """
+    Hard Lock Rule: Returns True if a parent dependency is NOT DONE.
+    Single-row variant; prefer compute_blocked_mask for many rows.
+    """
+    stored = activity_row.get('is_blocked')
+    if stored is not None and not pd.isna(stored):
+        return bool(stored)
+    if index is None:
+        index = build_dependency_index(all_activities_df)
+    return activity_row.get('activity_code') in index["blocked"]
 
 def check_can_complete(activity_row, has_file_uploaded_override=None):
     """
@@ -52,6 +297,49 @@ def check_can_complete(activity_row, has_file_uploaded_override=None):
         
     return True, "OK"
 
+# Board order of the editable statuses (BLOCKED is derived from dependencies)
+STATUS_FLOW = ['PENDING', 'IN_PROGRESS', 'DONE']
+
+def validate_status_transitions(moves, all_activities_df, index=None):
+    """
+    Server-side check of a batch of board moves [{'id': ..., 'to': ...}].
+    Same rules as the card buttons: a blocked activity cannot start or finish
+    (check_is_blocked) and DONE requires evidence (check_can_complete).
+    Moving back is always allowed. The last move per id wins.
+    Returns (accepted {id: new_status}, rejected [(activity_code, reason)]).
+    """
+    if index is None:
+        index = build_dependency_index(all_activities_df)
+    rows = all_activities_df.set_index('id', drop=False)
+
+    targets = {}
+    for m in moves:
+        targets[m.get('id')] = m.get('to')
+
+    accepted, rejected = {}, []
+    for act_id, to in targets.items():
+        if act_id not in rows.index:
+            rejected.append((str(act_id), "Actividad no encontrada"))
+            continue
+        row = rows.loc[act_id]
+        current = row.get('status')
+        if to not in STATUS_FLOW:
+            rejected.append((row['activity_code'], "Estado no permitido"))
+            continue
+        if to == current:
+            continue
+        forward = STATUS_FLOW.index(to) > (STATUS_FLOW.index(current) if current in STATUS_FLOW else 0)
+        if forward and check_is_blocked(row, all_activities_df, index):
+            rejected.append((row['activity_code'], "Bloqueado por " + ", ".join(get_blocking_parents(index, row['activity_code']))))
+            continue
+        if to == 'DONE':
+            can_comp, msg = check_can_complete(row)
+            if not can_comp:
+                rejected.append((row['activity_code'], msg))
+                continue
+        accepted[act_id] = to
+    return accepted, rejected
+
 def get_grouped_columns(df):
     """
     Helper to group activities for Kanban.
@@ -69,11 +357,12 @@ PHASES_CONFIG = {
     4: {"name": "FASE 4: CIERRE",       "start": 21, "end": 999}
 }
 
-def generate_graphviz_dot(df, group_by_phases=True, rankdir='TB'):
+def generate_graphviz_dot(df, group_by_phases=True, rankdir='TB', edges=None):
     """
     Generates Graphviz Graph object for the Live Process Map.
     group_by_phases: If True, uses clusters + spine. If False, flat structure (better for critical path).
     rankdir: 'TB' (Top-Bottom) or 'LR' (Left-Right).
+    edges: dependency edges (activity_code, depends_on_code); defaults to the dependency_code column.
     """
     if df.empty: return None
     
@@ -89,10 +378,14 @@ def generate_graphviz_dot(df, group_by_phases=True, rankdir='TB'):
     # Use global
     phases = PHASES_CONFIG
     
+    # Blocking flags for every node in one pass (only nodes in this view count as parents)
+    dep_index = build_dependency_index(df, edges)
+    blocked_mask = compute_blocked_mask(df, dep_index)
+    
     # --- HELPER FOR NODE STYLING ---
     def add_node_to_graph(graph_obj, row):
         status = row['status']
-        is_blocked = check_is_blocked(row, df)
+        is_blocked = blocked_mask.loc[row.name]
         
         # Colors
         fill = '#ffffff' # Default PENDING
@@ -182,16 +475,17 @@ def generate_graphviz_dot(df, group_by_phases=True, rankdir='TB'):
 
     # 5. Draw Edges (Dependencies)
     # Outside clusters
-    for _, row in df.iterrows():
-        dep = row.get('dependency_code')
-        if dep and str(dep) != 'nan' and dep != '-' and dep in df['activity_code'].values:
-            # Use constraint=true (default) but weight=1 so it yields to the spine
-            dot.edge(dep, row['activity_code'], color='#666666', weight='1')
+    node_codes = set(df['activity_code'].values)
+    for code in df['activity_code']:
+        for dep in get_parents(dep_index, code):
+            if dep in node_codes:
+                # Use constraint=true (default) but weight=1 so it yields to the spine
+                dot.edge(dep, code, color='#666666', weight='1')
             
     return dot
 
 
-from db import init_connection
+from db import init_connection, invalidate_table_cache, record_write, refresh_blocked_dependents, with_retry, is_missing_rpc
 
 def check_dependencies_blocking(activity_id):
     """
@@ -206,22 +500,16 @@ def check_dependencies_blocking(activity_id):
         if not res.data:
             return False
             
-        dep_code = res.data[0].get('dependency_code')
-        
-        # If no dependency or dependency is '-' or empty
-        if not dep_code or dep_code == '-' or dep_code == '?':
+        # Canonical 'A, B' list (NULL when there is no dependency)
+        parents = parse_dependency_codes(res.data[0].get('dependency_code'))
+        if not parents:
             return False
         
-        # Find the status of the parent activity
-        parent_res = client.table("activities").select("status").eq("activity_code", dep_code).execute()
-        if not parent_res.data:
-            # Parent not found
-            return False
-            
-        parent_status = parent_res.data[0].get('status')
+        # Find the status of the parent activities (missing parents do not block)
+        parent_res = client.table("activities").select("status").in_("activity_code", parents).execute()
         
-        # Blocked if parent is NOT DONE
-        return parent_status != 'DONE'
+        # Blocked if any parent is NOT DONE
+        return any(p.get('status') != 'DONE' for p in parent_res.data)
         
     except Exception as e:
         print(f"Error checking blocking: {e}")
@@ -230,10 +518,29 @@ def check_dependencies_blocking(activity_id):
 def update_activity_status(activity_id, new_status, user_role, has_file):
     """
     Updates the status of an activity enforcing rules.
+    One round trip: the transition_activity_status RPC (schema v11) checks
+    dependencies and evidence and writes under a row lock. Without the RPC,
+    falls back to the client-side checks.
     Returns (success, message).
     """
     client = init_connection()
-    
+    if not client: return False, "No Connection"
+
+    try:
+        res = with_retry(client.rpc("transition_activity_status", {"p_activity_id": int(activity_id), "p_new_status": new_status}).execute)
+    except Exception as e:
+        if not is_missing_rpc(e):
+            return False, f"Error DB: {str(e)}"
+        return _update_activity_status_checked(client, activity_id, new_status, has_file)
+
+    result = res.data or {}
+    if result.get('row'):
+        record_write("activities", [result['row']])
+        refresh_blocked_dependents([result['row']])
+    return bool(result.get('ok')), result.get('message', "Respuesta inválida del servidor")
+
+def _update_activity_status_checked(client, activity_id, new_status, has_file):
+    """Pre-v11 path: checks in separate reads, then writes (not atomic)."""
     try:
         # Get metadata
         res = client.table("activities").select("evidence_requirement, is_gate_blocker, dependency_code").eq("id", activity_id).execute()
@@ -254,7 +561,9 @@ def update_activity_status(activity_id, new_status, user_role, has_file):
                 return False, f"Requisito: Debes subir evidencia '{evidence_req}' antes de completar."
                 
         # 3. Save
-        client.table("activities").update({"status": new_status}).eq("id", activity_id).execute()
+        res = with_retry(client.table("activities").update({"status": new_status}).eq("id", activity_id).execute)
+        record_write("activities", res.data)
+        refresh_blocked_dependents(res.data)
         return True, "Estado actualizado."
         
     except Exception as e:
@@ -263,12 +572,9 @@ def update_activity_status(activity_id, new_status, user_role, has_file):
 def get_dashboard_metrics():
     client = init_connection()
     try:
-        # Supabase API for count is client.table(..).select(count='exact', head=True)
-        # But simple select is fine for small datasets
-        res = client.table("activities").select("status").execute()
-        data = res.data
-        total = len(data)
-        done = sum(1 for x in data if x['status'] == 'DONE')
+        # Exact counts computed by the DB (HEAD requests, no rows transferred)
+        total = client.table("activities").select("id", count="exact", head=True).execute().count or 0
+        done = client.table("activities").select("id", count="exact", head=True).eq("status", "DONE").execute().count or 0
         
         progress = (done / total * 100) if total > 0 else 0
         
@@ -280,6 +586,63 @@ def get_dashboard_metrics():
     except:
         return {"total_activities": 0, "completed": 0, "progress_percent": 0}
 
+def compute_dashboard_summary(acts_df, evidence_df, edges, project_start, today):
+    """
+    Client-side equivalent of the dashboard_summary RPC (Datos/update_schema_v9.sql).
+    Used as fallback when the RPC is not installed; returns the same JSON shape.
+    """
+    summary = {
+        "totals": {"total": 0, "done": 0, "in_progress": 0, "blocked": 0, "pending": 0, "delayed": 0},
+        "status_by_role": [], "product_progress": [],
+        "evidence": {"required": 0, "covered": 0, "last_upload": None},
+        "bottlenecks": [], "upcoming": [],
+    }
+    if acts_df.empty:
+        return summary
+
+    df = add_schedule_dates(acts_df.copy(), project_start, 'start_date', 'end_date')
+    status = df['status']
+    blocked = compute_blocked_mask(df, build_dependency_index(df, edges))
+    not_done = status != 'DONE'
+    today_ts = pd.Timestamp(today)
+    summary["totals"] = {
+        "total": len(df),
+        "done": int((status == 'DONE').sum()),
+        "in_progress": int((status == 'IN_PROGRESS').sum()),
+        "blocked": int(((status == 'BLOCKED') | ((status == 'PENDING') & blocked)).sum()),
+        "pending": int(((status == 'PENDING') & ~blocked).sum()),
+        "delayed": int((not_done & (df['end_date'] < today_ts)).sum()),
+    }
+
+    by_role = df.groupby(['status', 'primary_role'], dropna=False).size().reset_index(name='n')
+    summary["status_by_role"] = by_role.to_dict('records')
+
+    prod = df['product_code'].where(df['product_code'].apply(lambda v: isinstance(v, str))).str.split(' | ', regex=False).str[0]
+    progress = df.assign(product_code=prod, is_done=status == 'DONE').groupby('product_code', dropna=False).agg(total=('status', 'size'), done=('is_done', 'sum')).reset_index()
+    summary["product_progress"] = progress.to_dict('records')
+
+    ev_codes = set(evidence_df['activity_code']) if not evidence_df.empty else set()
+    if 'evidence_requirement' in df.columns:
+        required = df[df['evidence_requirement'].astype(str).str.upper() == 'SI']
+        summary["evidence"]["required"] = len(required)
+        summary["evidence"]["covered"] = int(required['activity_code'].isin(ev_codes).sum())
+    if not evidence_df.empty:
+        summary["evidence"]["last_upload"] = evidence_df['uploaded_at'].max()
+
+    card_cols = ['activity_code', 'task_name', 'status', 'primary_role', 'co_responsibles', 'week_start', 'week_end']
+    card_cols = [c for c in card_cols if c in df.columns]
+    open_codes = df.loc[not_done, 'activity_code']
+    if not edges.empty:
+        open_edges = edges[edges['activity_code'].isin(open_codes) & edges['depends_on_code'].isin(open_codes)]
+        counts = open_edges['depends_on_code'].value_counts().rename('deps').reset_index().rename(columns={'index': 'depends_on_code'})
+        counts = counts.sort_values(['deps', 'depends_on_code'], ascending=[False, True]).head(5)
+        parents = df.drop_duplicates('activity_code').set_index('activity_code')
+        summary["bottlenecks"] = [dict(parents.loc[c, card_cols[1:]].to_dict(), activity_code=c, deps=int(n)) for c, n in zip(counts['depends_on_code'], counts['deps'])]
+
+    due = df[not_done & (df['end_date'] >= today_ts) & (df['end_date'] <= today_ts + pd.Timedelta(days=7))]
+    summary["upcoming"] = due.sort_values(['end_date', 'activity_code']).head(5)[card_cols].to_dict('records')
+    return summary
+
 def move_mechanism_stage(mech_id, current_stage, user_role):
     """
     Pipeline Logic: DRAFT -> LEGAL -> GENDER -> APPROVED
@@ -310,6 +673,7 @@ def move_mechanism_stage(mech_id, current_stage, user_role):
     client = init_connection()
     try:
         client.table("mechanisms").update({"status_pipeline": target_stage}).eq("id", mech_id).execute()
+        invalidate_table_cache("mechanisms")
         return True, f"Avanzado a {target_stage}"
     except Exception as e:
         return False, str(e)
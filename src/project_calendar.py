@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+
+
+def add_schedule_dates(df, project_start, start_col='real_start_date', end_col='real_end_date'):
+    """
+    Vectorized week -> date derivation for a whole activities frame.
+    Week 1 starts on project_start:
+    - start = project_start + (week_start - 1) weeks
+    - end   = project_start + week_end weeks - 1 day (full week)
+    Missing, zero or non-numeric weeks count as week 1.
+    Adds datetime64 columns start_col / end_col (in place) and returns df.
+    """
+    if df.empty:
+        return df
+
+    def week_series(col):
+        if col not in df.columns:
+            return pd.Series(1, index=df.index)
+        weeks = pd.to_numeric(df[col], errors='coerce').fillna(1).astype(int)
+        return weeks.where(weeks != 0, 1)
+
+    base = pd.Timestamp(project_start)
+    ws = week_series('week_start')
+    we = week_series('week_end')
+    df[start_col] = base + pd.to_timedelta((ws - 1) * 7, unit='D')
+    df[end_col] = base + pd.to_timedelta(we * 7 - 1, unit='D')
+    return df
+
+def build_schedule_index(df, start_col='real_start_date', end_col='real_end_date'):
+    """
+    Sorted interval index over the schedule dates of df (sorted by end date).
+    Date-window questions become binary searches instead of full-frame scans.
+    """
+    if df.empty:
+        empty = np.array([], dtype='datetime64[ns]')
+        return {"labels": df.index.values, "starts": empty, "ends": empty}
+
+    ends = df[end_col].values
+    order = np.argsort(ends, kind='stable')
+    return {
+        "labels": df.index.values[order],
+        "starts": df[start_col].values[order],
+        "ends": ends[order],
+    }
+
+def _as_key(index, value):
+    """Converts a date/datetime into a scalar comparable with the index arrays."""
+    return np.array(pd.Timestamp(value), dtype=index["ends"].dtype)
+
+def select_ending_before(df, index, day):
+    """Rows whose end date is strictly before 'day' (e.g. delayed candidates)."""
+    hi = np.searchsorted(index["ends"], _as_key(index, day), side='left')
+    return df.loc[index["labels"][:hi]]
+
+def select_ending_between(df, index, start, end):
+    """Rows whose end date falls in [start, end], ordered by end date."""
+    lo = np.searchsorted(index["ends"], _as_key(index, start), side='left')
+    hi = np.searchsorted(index["ends"], _as_key(index, end), side='right')
+    return df.loc[index["labels"][lo:hi]]
+
+def select_active_between(df, index, start, end):
+    """Rows whose [start, end] interval overlaps the window [start, end]."""
+    lo = np.searchsorted(index["ends"], _as_key(index, start), side='left')
+    overlaps = index["starts"][lo:] <= _as_key(index, end)
+    return df.loc[index["labels"][lo:][overlaps]]
@@ -0,0 +1,142 @@
+import json
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+# Local SQLite mirror of the Supabase tables (read replica).
+# This module only stores and queries; db.py decides what to fetch and when.
+
+# Mirrored tables -> unique key used to merge written rows
+REPLICA_KEYS = {
+    "activities": "id",
+    "users": "id",
+    "contract_products": "code",
+    "evidence_files": "id",
+    "project_meta": "key",
+}
+
+SQL_OPERATORS = {"eq": "=", "neq": "!=", "gt": ">", "gte": ">=", "lt": "<", "lte": "<=", "like": "LIKE", "ilike": "LIKE"}
+
+_lock = threading.RLock()
+_conn = None
+_bool_columns = {} # table -> columns stored as 0/1 that must come back as bool
+_loaded = set() # tables with a full copy in the replica
+
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+def _scalar(value):
+    """SQLite friendly value (nested JSON is stored as text)."""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+def open_replica(path=":memory:"):
+    """Opens (once) the shared replica connection."""
+    global _conn
+    with _lock:
+        if _conn is None:
+            _conn = sqlite3.connect(path, check_same_thread=False)
+            _conn.execute("PRAGMA journal_mode=WAL")
+            _conn.execute("PRAGMA synchronous=OFF") # A mirror, Supabase stays the source of truth
+        return _conn
+
+def is_loaded(table_name):
+    return table_name in _loaded
+
+def _table_columns(table_name):
+    return [r[1] for r in _conn.execute(f"PRAGMA table_info({_quote(table_name)})")]
+
+def replace_table(table_name, rows):
+    """Replaces the whole local copy of a table with the given records."""
+    df = pd.DataFrame([{k: _scalar(v) for k, v in r.items()} for r in rows])
+    with _lock:
+        conn = open_replica()
+        if df.empty:
+            if _table_columns(table_name):
+                conn.execute(f"DELETE FROM {_quote(table_name)}")
+        else:
+            _bool_columns[table_name] = [c for c in df.columns if df[c].dropna().map(type).eq(bool).all() and df[c].notna().any()]
+            df.to_sql(table_name, conn, if_exists="replace", index=False)
+            key = REPLICA_KEYS.get(table_name)
+            if key in df.columns:
+                conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {_quote('ux_' + table_name)} ON {_quote(table_name)} ({_quote(key)})")
+        conn.commit()
+        _loaded.add(table_name)
+
+def upsert_rows(table_name, rows):
+    """
+    Merges full rows (as returned by Supabase) into the local copy by key.
+    Returns False when they cannot be applied (table not loaded, or a row that
+    does not carry exactly the table columns: INSERT OR REPLACE would null the
+    missing ones).
+    """
+    if not rows:
+        return True
+    with _lock:
+        if table_name not in _loaded:
+            return False
+        names = _table_columns(table_name)
+        if REPLICA_KEYS[table_name] not in names or any(set(r) != set(names) for r in rows):
+            return False
+        sql = (f"INSERT OR REPLACE INTO {_quote(table_name)} ({', '.join(_quote(c) for c in names)}) "
+               f"VALUES ({', '.join('?' for _ in names)})")
+        _conn.executemany(sql, [[_scalar(r.get(c)) for c in names] for r in rows])
+        _conn.commit()
+        return True
+
+def row_count(table_name):
+    with _lock:
+        return _conn.execute(f"SELECT COUNT(*) FROM {_quote(table_name)}").fetchone()[0]
+
+def read_table(table_name, projection="*", filters=(), order=()):
+    """
+    Reads from the local copy. filters/order use the same format as db.get_table_df.
+    Raises on anything it cannot express (caller falls back to Supabase).
+    """
+    select = "*" if projection == "*" else ", ".join(_quote(c) for c in projection.split(","))
+    where, params = [], []
+    for col, op, val in filters:
+        if op == "in":
+            if not val:
+                where.append("0")
+                continue
+            where.append(f"{_quote(col)} IN ({', '.join('?' for _ in val)})")
+            params.extend(val)
+        elif op == "is_":
+            where.append(f"{_quote(col)} IS NULL" if val in (None, "null") else f"{_quote(col)} IS NOT NULL")
+        else:
+            where.append(f"{_quote(col)} {SQL_OPERATORS[op]} ?")
+            params.append(_scalar(val))
+    sql = f"SELECT {select} FROM {_quote(table_name)}"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    if order:
+        sql += " ORDER BY " + ", ".join(f"{_quote(c.lstrip('-'))} {'DESC' if c.startswith('-') else 'ASC'}" for c in order)
+
+    with _lock:
+        df = pd.read_sql_query(sql, _conn, params=params)
+    for c in _bool_columns.get(table_name, []):
+        if c in df.columns:
+            df[c] = df[c].map({1: True, 0: False})
+    return df
+
+def start_refresher(refresh_fn, interval):
+    """
+    Background daemon that calls refresh_fn() every 'interval' seconds.
+    Returns the thread (started once per process).
+    """
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                refresh_fn()
+            except Exception as e:
+                print(f"Replica refresh error: {e}")
+
+    t = threading.Thread(target=loop, name="gwp-replica-refresh", daemon=True)
+    t.start()
+    return t
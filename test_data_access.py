@@ -0,0 +1,398 @@
+import os
+import sys
+
+# The app modules live in src/ (the root db.py/logic.py are the legacy SQLite version)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+import pandas as pd
+
+import db
+
+
+# --- FAKE SUPABASE CLIENT ---
+# In-memory tables behind the subset of the query builder db.py uses.
+# Every executed request is logged in client.calls as (table, operation).
+
+class FakeError(Exception):
+    def __init__(self, code, message=""):
+        super().__init__(message or code)
+        self.code = code
+
+class FakeResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+class FakeQuery:
+    def __init__(self, client, table, op, payload=None, **options):
+        self.client, self.table, self.op, self.payload, self.options = client, table, op, payload, options
+        self.filters, self.orders, self.window = [], [], None
+
+    def _where(self, test):
+        self.filters.append(test)
+        return self
+
+    def eq(self, col, val): return self._where(lambda r: r.get(col) == val)
+    def neq(self, col, val): return self._where(lambda r: r.get(col) != val)
+    def gte(self, col, val): return self._where(lambda r: r.get(col) is not None and r.get(col) >= val)
+    def lte(self, col, val): return self._where(lambda r: r.get(col) is not None and r.get(col) <= val)
+    def in_(self, col, vals): return self._where(lambda r, vals=list(vals): r.get(col) in vals)
+
+    def order(self, col, desc=False, nullsfirst=None):
+        self.orders.append((col, desc))
+        return self
+
+    def range(self, start, end):
+        self.window = (start, end + 1)
+        return self
+
+    def limit(self, n):
+        self.window = (0, n)
+        return self
+
+    def _matching(self):
+        return [r for r in self.client.tables.setdefault(self.table, []) if all(f(r) for f in self.filters)]
+
+    def execute(self):
+        self.client.calls.append((self.table, self.op))
+        hook = self.client.before_execute.pop(0) if self.client.before_execute else None
+        if hook:
+            hook(self)
+        rows = self.client.tables.setdefault(self.table, [])
+        if self.op == "select":
+            found = self._matching()
+            for col, desc in reversed(self.orders):
+                found.sort(key=lambda r: (r.get(col) is None, r.get(col)), reverse=desc)
+            count = len(found) if self.options.get("count") else None
+            if self.window:
+                found = found[self.window[0]:self.window[1]]
+            cols = self.options.get("columns", "*")
+            if cols != "*":
+                found = [{c.strip(): r.get(c.strip()) for c in cols.split(",")} for r in found]
+            return FakeResponse([dict(r) for r in found], count)
+        if self.op == "update":
+            found = self._matching()
+            for r in found:
+                r.update(self.payload)
+                if "row_version" in r:
+                    r["row_version"] += 1
+            return FakeResponse([dict(r) for r in found])
+        if self.op == "delete":
+            found = self._matching()
+            self.client.tables[self.table] = [r for r in rows if r not in found]
+            return FakeResponse([dict(r) for r in found])
+        # insert / upsert
+        key = self.options.get("on_conflict") or "id"
+        out = []
+        for rec in (self.payload if isinstance(self.payload, list) else [self.payload]):
+            current = next((r for r in rows if key in rec and r.get(key) == rec[key]), None)
+            if current is not None:
+                if self.op == "insert":
+                    raise FakeError("23505", "duplicate key")
+                if self.options.get("ignore_duplicates"):
+                    continue
+                current.update(rec)
+                out.append(dict(current))
+            else:
+                new = {"id": self.client.next_id(), "row_version": 1, **rec} if self.table == "activities" else {"id": self.client.next_id(), **rec}
+                rows.append(new)
+                out.append(dict(new))
+        return FakeResponse(out)
+
+class FakeTable:
+    def __init__(self, client, name):
+        self.client, self.name = client, name
+
+    def select(self, columns="*", count=None): return FakeQuery(self.client, self.name, "select", columns=columns, count=count)
+    def update(self, payload): return FakeQuery(self.client, self.name, "update", dict(payload))
+    def delete(self): return FakeQuery(self.client, self.name, "delete")
+    def insert(self, payload): return FakeQuery(self.client, self.name, "insert", payload)
+    def upsert(self, payload, on_conflict=None, ignore_duplicates=False):
+        return FakeQuery(self.client, self.name, "upsert", payload, on_conflict=on_conflict, ignore_duplicates=ignore_duplicates)
+
+class FakeRpc:
+    def __init__(self, client, name, params):
+        self.client, self.name, self.params = client, name, params
+
+    def execute(self):
+        self.client.calls.append((self.name, "rpc"))
+        handler = self.client.rpcs.get(self.name)
+        if handler is None:
+            raise FakeError("PGRST202", f"function {self.name} not found")
+        return FakeResponse(handler(self.client, self.params))
+
+class FakeBucket:
+    def __init__(self, client, name):
+        self.client, self.name = client, name
+
+    def upload(self, path, file, file_options=None):
+        self.client.files[path] = file
+        return {"Key": path}
+
+    def remove(self, paths):
+        for p in paths:
+            self.client.files.pop(p, None)
+        return [{"name": p} for p in paths]
+
+class FakeStorage:
+    def __init__(self, client):
+        self.client = client
+
+    def from_(self, bucket): return FakeBucket(self.client, bucket)
+
+class FakeClient:
+    def __init__(self, tables=None, rpcs=None):
+        self.tables = {t: [dict(r) for r in rows] for t, rows in (tables or {}).items()}
+        self.rpcs = rpcs or {}
+        self.files = {} # Storage objects by path
+        self.storage = FakeStorage(self)
+        self.calls = []
+        self.before_execute = [] # One-shot hooks run before the next requests (simulate other users)
+        self._id = 1000
+
+    def next_id(self):
+        self._id += 1
+        return self._id
+
+    def table(self, name): return FakeTable(self, name)
+    def rpc(self, name, params): return FakeRpc(self, name, params)
+
+    def count(self, table, op):
+        return sum(1 for c in self.calls if c == (table, op))
+
+def use_client(client):
+    """Points db at the fake client and starts from an empty cache."""
+    db.init_connection = lambda: client
+    db.invalidate_table_cache()
+    db._stale_bases.clear()
+    db._delta_unsupported.clear()
+    return client
+
+class FakeClock:
+    """Stands in for db.time, so cache expiry is driven by the test."""
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self): return self.now
+    def time(self): return self.now
+    def sleep(self, seconds): self.now += seconds
+    def advance(self, seconds): self.now += seconds
+
+def activity(id_, code, status="PENDING", **extra):
+    return {"id": id_, "activity_code": code, "status": status, "row_version": 1, **extra}
+
+
+def run_tests():
+    print("Running Data Access Tests...")
+
+    # 1. Batch status changes (user-019): nothing is written blindly
+    print("Testing batch status changes...")
+    def batch_rpc(client, params):
+        out = []
+        for act_id, status in zip(params["p_ids"], params["p_statuses"]):
+            row = next(r for r in client.tables["activities"] if r["id"] == act_id)
+            if row["activity_code"] == "B":
+                out.append({"ok": False, "code": "blocked", "message": "Bloqueado por A", "id": act_id, "activity_code": "B"})
+                continue
+            row.update(status=status, row_version=row["row_version"] + 1)
+            out.append({"ok": True, "code": "ok", "row": dict(row), "id": act_id, "activity_code": row["activity_code"]})
+        return out
+    client = use_client(FakeClient({"activities": [activity(1, "A"), activity(2, "B")]}, {"transition_activity_status_batch": batch_rpc}))
+    ok, msg = db.update_activities_status_batch({1: "IN_PROGRESS", 2: "IN_PROGRESS"}, {1: "PENDING", 2: "PENDING"})
+    print(f"  - RPC rejects B -> {ok}, {msg} (Expected: False, B reported)")
+    assert not ok and "1 actividades actualizadas" in msg and "B (Bloqueado por A)" in msg
+    assert client.count("activities", "update") == 0 # The batch went through the RPC only
+
+    # Pre-v14 fallback: conditional on the status the snapshot saw
+    client = use_client(FakeClient({"activities": [activity(1, "A"), activity(2, "B", "DONE")]}))
+    ok, msg = db.update_activities_status_batch({1: "IN_PROGRESS", 2: "IN_PROGRESS"}, {1: "PENDING", 2: "PENDING"})
+    statuses = [r["status"] for r in client.tables["activities"]]
+    print(f"  - B changed since the snapshot -> {ok}, statuses {statuses} (Expected: False, ['IN_PROGRESS', 'DONE'])")
+    assert not ok and "B (cambiada por otro usuario)" in msg
+    assert statuses == ["IN_PROGRESS", "DONE"]
+
+    ok, msg = db.update_activities_status_batch({1: "DONE"}, {1: "IN_PROGRESS"})
+    print(f"  - Snapshot up to date -> {ok}, {msg} (Expected: True, 1 actividades actualizadas)")
+    assert ok and msg == "1 actividades actualizadas"
+
+    # 2. Stored blocked state (user-021): dependents re-read after a status write
+    print("Testing blocked dependents refresh...")
+    client = use_client(FakeClient({
+        "activities": [activity(1, "A", is_blocked=False), activity(2, "B", is_blocked=True), activity(3, "C", is_blocked=False)],
+        "activity_dependencies": [{"activity_code": "B", "depends_on_code": "A"}],
+    }))
+    before = db.get_table_df("activities")
+    assert before.set_index("activity_code").loc["B", "is_blocked"]
+    # The server finishes A; its trigger recomputes B in the same transaction
+    for r in client.tables["activities"]:
+        r.update({"A": {"status": "DONE"}, "B": {"is_blocked": False}}.get(r["activity_code"], {}))
+    written = [dict(client.tables["activities"][0])]
+    db.record_write("activities", written)
+    reads = client.count("activities", "select")
+    db.refresh_blocked_dependents(written)
+    after = db.get_table_df("activities").set_index("activity_code")
+    print(f"  - B after A is DONE -> blocked {after.loc['B', 'is_blocked']} (Expected: False)")
+    assert not after.loc["B", "is_blocked"] and after.loc["A", "status"] == "DONE"
+    print(f"  - Reads -> {client.count('activities', 'select') - reads} (Expected: 1, only the dependents)")
+    assert client.count("activities", "select") - reads == 1
+
+    reads = len(client.calls)
+    db.refresh_blocked_dependents([{"id": 3, "activity_code": "C", "status": "DONE"}]) # Pre-v12 row: nothing stored
+    db.refresh_blocked_dependents([dict(client.tables["activities"][2])]) # No dependents
+    print(f"  - Pre-v12 rows / no dependents -> requests {len(client.calls) - reads} (Expected: 0, edges served from the cache)")
+    assert len(client.calls) - reads == 0
+
+    # 3. Optimistic concurrency in the CMS save (user-022)
+    print("Testing stale row_version...")
+    client = use_client(FakeClient({"activities": [activity(1, "A", task_name="Uno", row_version=2), activity(2, "B")]}))
+    ok, msg = db.save_activity_changes(updates=[{"id": 1, "row_version": 1, "activity_code": "A", "task_name": "Mío"}])
+    stored = client.tables["activities"][0]
+    print(f"  - Saved over version 1, stored is 2 -> {ok}, {msg} (Expected: False, A reported)")
+    assert not ok and msg.startswith("Modificadas por otro usuario") and "A" in msg
+    assert (stored["task_name"], stored["row_version"]) == ("Uno", 2) # The other user's edit survives
+
+    ok, msg = db.save_activity_changes(deletes=[(2, 0)])
+    print(f"  - Stale delete -> {ok}, rows {len(client.tables['activities'])} (Expected: False, 2)")
+    assert not ok and "2" in msg and len(client.tables["activities"]) == 2
+
+    # A retried request whose first attempt already landed is not a conflict
+    client.tables["activities"][0].update(task_name="Mío", row_version=3)
+    ok, msg = db.save_activity_changes(updates=[{"id": 1, "row_version": 2, "activity_code": "A", "task_name": "Mío"}])
+    print(f"  - Own write already applied -> {ok}, {msg} (Expected: True, 1 actividades guardadas)")
+    assert ok and msg == "1 actividades guardadas"
+
+    ok, msg = db.save_activity_changes(updates=[{"id": 1, "row_version": 3, "activity_code": "A", "task_name": "Final"}])
+    print(f"  - Current version -> {ok}, version {client.tables['activities'][0]['row_version']} (Expected: True, 4)")
+    assert ok and client.tables["activities"][0]["row_version"] == 4
+
+    # 4. Delta sync (user-011): probe, merge by id, full refetch on deletes
+    print("Testing delta sync...")
+    clock, real_time = FakeClock(), db.time
+    db.time = clock
+    try:
+        stamp = lambda minute: f"2025-01-01T10:{minute:02d}:00+00:00"
+        client = use_client(FakeClient({"activities": [activity(i, c, updated_at=stamp(i)) for i, c in [(1, "A"), (2, "B"), (3, "C")]]}))
+        first = db.get_table_df("activities")
+        watermark = lambda: next(e["watermark"] for k, e in db._table_cache.items() if k[0] == "activities")
+        assert len(first) == 3 and watermark() == stamp(3)
+
+        clock.advance(db.DELTA_PROBE_SECONDS + 1)
+        reads = client.count("activities", "select")
+        same = db.get_table_df("activities")
+        print(f"  - Nothing changed -> requests {client.count('activities', 'select') - reads} (Expected: 1, the probe)")
+        assert client.count("activities", "select") - reads == 1 and same.equals(first)
+
+        client.tables["activities"][1].update(status="DONE", updated_at=stamp(20)) # B edited elsewhere
+        client.tables["activities"].append(activity(4, "D", updated_at=stamp(21)))
+        clock.advance(db.DELTA_PROBE_SECONDS + 1)
+        reads = client.count("activities", "select")
+        merged = db.get_table_df("activities")
+        print(f"  - B edited, D added -> codes {merged['activity_code'].tolist()}, watermark {watermark()} (Expected: A-D, {stamp(21)})")
+        assert merged["activity_code"].tolist() == ["A", "B", "C", "D"] and merged["status"].tolist()[1] == "DONE"
+        assert watermark() == stamp(21)
+        assert client.count("activities", "select") - reads == 2 # Probe + rows since the watermark
+
+        client.tables["activities"].pop(0) # Deletes leave no watermark behind: the count gives them away
+        clock.advance(db.DELTA_PROBE_SECONDS + 1)
+        reads = client.count("activities", "select")
+        rebuilt = db.get_table_df("activities")
+        print(f"  - A deleted -> codes {rebuilt['activity_code'].tolist()} (Expected: ['B', 'C', 'D'], full refetch)")
+        assert rebuilt["activity_code"].tolist() == ["B", "C", "D"]
+        assert client.count("activities", "select") - reads == 3 # Probe + delta + full read
+    finally:
+        db.time = real_time
+
+    base = pd.DataFrame({"id": [1, 2, 3], "week_start": [1, 2, 3]})
+    out = db._merge_rows("activities", base, pd.DataFrame({"id": [4, 2], "week_start": [9, 5]}), ("-week_start",))
+    print(f"  - _merge_rows -> ids {out['id'].tolist()} (Expected: [4, 2, 3, 1], by -week_start)")
+    assert out["id"].tolist() == [4, 2, 3, 1] and out["week_start"].tolist() == [9, 5, 3, 1]
+
+    # 5. Read cache (user-001): TTL, LRU bound and write-through invalidation
+    print("Testing read cache...")
+    clock, real_max = FakeClock(), db.CACHE_MAX_ENTRIES
+    db.time = clock
+    try:
+        client = use_client(FakeClient({
+            "users": [{"id": 1, "full_name": "Juana Pérez", "role": "LEGAL"}],
+            "activities": [activity(1, "A", has_file_uploaded=True)],
+            "evidence_files": [{"id": 1, "activity_code": "A", "filename": "acta.pdf", "storage_path": "A/acta.pdf", "uploaded_at": "2025-01-10"}],
+        }))
+        db.get_table_df("users")
+        db.get_table_df("users")
+        print(f"  - Second read -> requests {client.count('users', 'select')} (Expected: 1, served from the cache)")
+        assert client.count("users", "select") == 1
+
+        clock.advance(db.CACHE_TTL_SECONDS + 1)
+        db.get_table_df("users")
+        print(f"  - After the TTL -> requests {client.count('users', 'select')} (Expected: 2)")
+        assert client.count("users", "select") == 2
+
+        db.CACHE_MAX_ENTRIES = 2
+        db.get_table_df("users", ["id"])
+        db.get_table_df("users", ["role"])
+        db.get_table_df("users", ["id"]) # Touch: "users *" is now the least recently used
+        db.get_table_df("users", ["full_name"])
+        print(f"  - Entries with a bound of 2 -> {len(db._table_cache)} (Expected: 2)")
+        assert len(db._table_cache) == 2
+        reads = client.count("users", "select")
+        db.get_table_df("users", ["id"])
+        db.get_table_df("users")
+        assert client.count("users", "select") - reads == 1 # "users *" was evicted, "id" was kept
+        db.CACHE_MAX_ENTRIES = real_max
+
+        # Writes through db.py: the next read sees them
+        ok, _ = db.upsert_data("users", [{"id": 1, "full_name": "Juana Pérez", "role": "COORD"}])
+        roles = db.get_table_df("users")["role"].tolist()
+        print(f"  - After upsert_data -> roles {roles} (Expected: ['COORD'])")
+        assert ok and roles == ["COORD"]
+
+        db.get_table_df("evidence_files")
+        db.get_table_df("activities")
+        ok, _ = db.delete_evidence("A/acta.pdf")
+        files, flags = len(db.get_table_df("evidence_files")), db.get_table_df("activities")["has_file_uploaded"].tolist()
+        print(f"  - After delete_evidence -> files {files}, flags {flags} (Expected: 0, [False])")
+        assert ok and files == 0
+
+        upload = type("Upload", (), {"name": "informe.pdf", "type": "application/pdf", "getvalue": lambda self: b"%PDF"})()
+        ok, _ = db.upload_evidence(upload, "A", "COORD")
+        files = db.get_table_df("evidence_files")["storage_path"].tolist()
+        flags = db.get_table_df("activities")["has_file_uploaded"].tolist()
+        print(f"  - After upload_evidence -> files {files}, flags {flags} (Expected: ['A/informe.pdf'], [True])")
+        assert ok and files == ["A/informe.pdf"] and flags == [True] and "A/informe.pdf" in client.files
+
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "_test_import.csv")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("ID,Actividad,Sem. inicio,Sem. fin\nA,Uno,1,1\nB,Dos,2,2\n")
+        try:
+            ok, msg = db.seed_activities_from_csv(path)
+        finally:
+            os.remove(path)
+        codes = db.get_table_df("activities")["activity_code"].tolist()
+        print(f"  - After the importer -> codes {codes} (Expected: ['A', 'B'])")
+        assert ok and codes == ["A", "B"], msg
+    finally:
+        db.time = real_time
+        db.CACHE_MAX_ENTRIES = real_max
+
+    # 6. Master data restore (user-013): only "already exists" is ignored
+    print("Testing master data restore...")
+    def fail_with(code):
+        def hook(query):
+            raise FakeError(code, f"error {code}")
+        return hook
+    client = use_client(FakeClient())
+    client.before_execute = [fail_with("23505")] # First user already exists
+    ok, msg = db.seed_master_defaults()
+    print(f"  - Existing user -> {ok}, users {len(client.tables['users'])} (Expected: True, 3)")
+    assert ok and len(client.tables["users"]) == 3 and len(client.tables["contract_products"]) == 6
+
+    client = use_client(FakeClient())
+    client.before_execute = [fail_with("42501")] # Permission denied (RLS)
+    ok, msg = db.seed_master_defaults()
+    print(f"  - Insert denied -> {ok}, {msg} (Expected: False, error reported)")
+    assert not ok and "42501" in msg and not client.tables.get("contract_products")
+
+    print("All data access tests passed.")
+
+if __name__ == "__main__":
+    run_tests()
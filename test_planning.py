@@ -0,0 +1,218 @@
+import os
+import sys
+from datetime import date
+
+# The app modules live in src/ (the root db.py/logic.py are the legacy SQLite version)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+import pandas as pd
+
+from logic import validate_dependency_graph, is_valid_dependency_report, build_dependency_index, compute_blocked_mask, validate_status_transitions, compute_dashboard_summary, derive_activity_fields, unknown_responsibles, users_role_mapping
+from project_calendar import add_schedule_dates
+from ingest import map_headers, validate_chunk
+
+
+def run_tests():
+    print("Running Planning Tests...")
+
+    # 1. Dependency graph validation
+    print("Testing dependency graph...")
+    codes = ["A", "B", "C", "D"]
+
+    report = validate_dependency_graph(codes, [("B", "A"), ("C", "B"), ("D", "A")])
+    print(f"  - Chain without cycles -> valid? {is_valid_dependency_report(report)} (Expected: True)")
+    assert is_valid_dependency_report(report)
+    assert report["valid_edges"] == [("B", "A"), ("C", "B"), ("D", "A")]
+
+    report = validate_dependency_graph(codes, [("B", "A"), ("C", "B"), ("B", "C"), ("D", "C")])
+    print(f"  - B <-> C cycle -> cycles {report['cycles']} (Expected: ['B', 'C', 'D'])")
+    assert report["cycles"] == ["B", "C", "D"] # D sits behind the cycle
+    assert not is_valid_dependency_report(report)
+
+    report = validate_dependency_graph(codes, [("A", "A"), ("B", "A")])
+    print(f"  - A depends on A -> self references {report['self_references']} (Expected: ['A'])")
+    assert report["self_references"] == ["A"]
+    assert report["valid_edges"] == [("B", "A")]
+    assert not is_valid_dependency_report(report)
+
+    report = validate_dependency_graph(codes, [("B", "X"), ("B", "A"), ("B", "A")])
+    print(f"  - Parent X missing -> dangling {report['dangling']} (Expected: [('B', 'X')])")
+    assert report["dangling"] == [("B", "X")]
+    assert report["valid_edges"] == [("B", "A")] # Duplicates collapse
+    assert is_valid_dependency_report(report) # Dangling references are only warnings
+
+    # 2. Schedule dates (week 1 starts on the project start)
+    print("Testing schedule dates...")
+    df = pd.DataFrame({"week_start": [1, 3, None, 0, "x"], "week_end": [1, 4, 2, 0, "2"]})
+    add_schedule_dates(df, date(2025, 1, 6))
+    starts = df["real_start_date"].dt.strftime("%Y-%m-%d").tolist()
+    ends = df["real_end_date"].dt.strftime("%Y-%m-%d").tolist()
+    print(f"  - Weeks 1-1 -> {starts[0]} .. {ends[0]} (Expected: 2025-01-06 .. 2025-01-12)")
+    print(f"  - Weeks 3-4 -> {starts[1]} .. {ends[1]} (Expected: 2025-01-20 .. 2025-02-02)")
+    assert (starts[0], ends[0]) == ("2025-01-06", "2025-01-12")
+    assert (starts[1], ends[1]) == ("2025-01-20", "2025-02-02")
+    print(f"  - Empty, zero or invalid weeks -> starts {starts[2:]} (Expected: all 2025-01-06)")
+    assert starts[2:] == ["2025-01-06"] * 3
+    assert ends[2:] == ["2025-01-19", "2025-01-12", "2025-01-19"]
+
+    empty = add_schedule_dates(pd.DataFrame(), date(2025, 1, 6))
+    print(f"  - Empty frame -> columns {list(empty.columns)} (Expected: [])")
+    assert empty.empty
+
+    # 3. Blocked state: stored column (schema v12) first, dependency index as fallback
+    print("Testing blocked state...")
+    acts = pd.DataFrame({"id": [1, 2, 3], "activity_code": ["A", "B", "C"], "status": ["PENDING", "PENDING", "DONE"],
+                         "dependency_code": [None, "A", "C"]})
+    mask = compute_blocked_mask(acts)
+    print(f"  - From the dependency column -> {mask.tolist()} (Expected: [False, True, False])")
+    assert mask.tolist() == [False, True, False]
+
+    stored = acts.assign(is_blocked=[False, False, True]) # The database disagrees: it wins
+    mask = compute_blocked_mask(stored, build_dependency_index(acts))
+    print(f"  - Stored is_blocked -> {mask.tolist()} (Expected: [False, False, True])")
+    assert mask.tolist() == [False, False, True]
+
+    partial = acts.assign(is_blocked=[False, None, None]) # Rows without the column (e.g. pre-v12 cache) -> derive
+    mask = compute_blocked_mask(partial)
+    print(f"  - Incomplete stored column -> {mask.tolist()} (Expected: [False, True, False])")
+    assert mask.tolist() == [False, True, False]
+
+    # Filtered view checked against the whole plan (edges from activity_dependencies)
+    edges = pd.DataFrame({"activity_code": ["B", "C", "C"], "depends_on_code": ["A", "B", "X"]})
+    index = build_dependency_index(acts, edges)
+    view = acts[acts["activity_code"] != "A"]
+    mask = compute_blocked_mask(view, index)
+    print(f"  - Filtered view, full plan index -> {mask.tolist()} (Expected: [True, True])")
+    assert mask.tolist() == [True, True] and mask.index.tolist() == view.index.tolist()
+    print(f"  - Same view without the index -> {compute_blocked_mask(view).tolist()} (Expected: [False, False], A and X not in the view)")
+    assert compute_blocked_mask(view).tolist() == [False, False]
+
+    # 4. Status transitions (board moves checked before writing)
+    print("Testing status transitions...")
+    plan = acts.assign(evidence_requirement=["Acta", None, None], has_file_uploaded=[False, False, False],
+                       status=["IN_PROGRESS", "PENDING", "IN_PROGRESS"])
+    index = build_dependency_index(plan, edges)
+    moves = [{"id": 1, "to": "DONE"}, {"id": 2, "to": "IN_PROGRESS"}, {"id": 3, "to": "DONE"},
+             {"id": 3, "to": "PENDING"}, {"id": 9, "to": "DONE"}, {"id": 1, "to": "ARCHIVED"}]
+    accepted, rejected = validate_status_transitions(moves, plan, index)
+    print(f"  - Accepted -> {accepted} (Expected: {{3: 'PENDING'}}, moving back is always allowed)")
+    assert accepted == {3: "PENDING"}
+    print(f"  - Rejected -> {[code for code, _ in rejected]} (Expected: ['A', 'B', '9'])")
+    assert [code for code, _ in rejected] == ["A", "B", "9"]
+    assert rejected[0][1] == "Estado no permitido" and rejected[1][1] == "Bloqueado por A" # The last move per id wins
+
+    accepted, rejected = validate_status_transitions([{"id": 1, "to": "DONE"}, {"id": 2, "to": "PENDING"}], plan, index)
+    print(f"  - DONE without the required evidence -> rejected {[code for code, _ in rejected]} (Expected: ['A'])")
+    assert [code for code, _ in rejected] == ["A"] and accepted == {} # Unchanged status: no write
+
+    accepted, _ = validate_status_transitions([{"id": 1, "to": "DONE"}], plan.assign(has_file_uploaded=True), index)
+    assert accepted == {1: "DONE"}
+
+    # 5. Dashboard summary fallback (same shape as the dashboard_summary RPC)
+    print("Testing dashboard summary...")
+    board = pd.DataFrame({
+        "activity_code": ["A", "B", "C", "D"], "task_name": ["Uno", "Dos", "Tres", "Cuatro"],
+        "status": ["DONE", "PENDING", "IN_PROGRESS", "PENDING"], "primary_role": ["COORD", "LEGAL", "COORD", "COORD"],
+        "product_code": ["1.1 | Coordinación", "1.1", "2.0", None], "evidence_requirement": ["SI", None, "si", None],
+        "week_start": [1, 2, 3, 5], "week_end": [1, 2, 3, 5],
+    })
+    deps = pd.DataFrame({"activity_code": ["B", "B", "D"], "depends_on_code": ["A", "C", "C"]})
+    evidence = pd.DataFrame({"activity_code": ["A"], "uploaded_at": ["2025-01-10T09:00:00+00:00"]})
+    summary = compute_dashboard_summary(board, evidence, deps, date(2025, 1, 6), date(2025, 1, 20))
+    print(f"  - Totals -> {summary['totals']}")
+    print("    (Expected: total 4, done 1, in_progress 1, blocked 2, pending 0, delayed 1)")
+    assert summary["totals"] == {"total": 4, "done": 1, "in_progress": 1, "blocked": 2, "pending": 0, "delayed": 1}
+    progress = {r["product_code"]: (r["total"], int(r["done"])) for r in summary["product_progress"] if isinstance(r["product_code"], str)}
+    assert progress == {"1.1": (2, 1), "2.0": (1, 0)}
+    assert summary["evidence"] == {"required": 2, "covered": 1, "last_upload": "2025-01-10T09:00:00+00:00"}
+    print(f"  - Bottlenecks -> {[(b['activity_code'], b['deps']) for b in summary['bottlenecks']]} (Expected: [('C', 2)])")
+    assert [(b["activity_code"], b["deps"]) for b in summary["bottlenecks"]] == [("C", 2)]
+    assert [u["activity_code"] for u in summary["upcoming"]] == ["C"] # Ends within the next 7 days
+    assert compute_dashboard_summary(board.iloc[0:0], evidence, deps, date(2025, 1, 6), date(2025, 1, 20))["totals"]["total"] == 0
+
+    # 6. Derived activity fields
+    print("Testing derived fields...")
+    df = pd.DataFrame({
+        "activity_code": ["T-1", "T-2", "T-3", "T-4"],
+        "product_code": ["1.1 | Coordinación", "TRANS", None, "—"],
+        "dependency_code": ["-", "T-1; T-1 ,T-3", "0", None],
+        "primary_responsible": ["Astrid", "Juana Pérez", "", "LEGAL"],
+        "co_responsibles": [None, "Patricio", "nan", None],
+        "type_tag": ["INT", None, None, None],
+    })
+    out = derive_activity_fields(df, {"Juana Pérez": "FINANZAS"})
+    print(f"  - Products -> {out['product_code'].tolist()} (Expected: ['1.1', 'TRANS', None, None])")
+    assert out["product_code"].tolist() == ["1.1", "TRANS", None, None]
+    print(f"  - Dependencies -> {out['dependency_code'].tolist()} (Expected: [None, 'T-1, T-3', None, None])")
+    assert out["dependency_code"].tolist() == [None, "T-1, T-3", None, None]
+    print(f"  - Roles -> {out['primary_role'].tolist()} (Expected: ['COORD', 'FINANZAS', 'COORD', 'LEGAL'])")
+    assert out["primary_role"].tolist() == ["COORD", "FINANZAS", "COORD", "LEGAL"]
+    print(f"  - Types -> {out['type_tag'].tolist()} (Expected: ['IND-P', 'INT+DEP', 'IND-P', 'IND-P'])")
+    assert out["type_tag"].tolist() == ["IND-P", "INT+DEP", "IND-P", "IND-P"]
+    assert df["type_tag"].tolist()[0] == "INT" # Input frame untouched
+
+    names = pd.Series(["Desconocido", None, "-", "FINANZAS", "Patricio"])
+    out = derive_activity_fields(df.assign(primary_responsible=names[:4].values))
+    print(f"  - Unknown responsible -> {out['primary_role'].tolist()[0]} (Expected: COORD, never the free text)")
+    assert out["primary_role"].tolist() == ["COORD", "COORD", "COORD", "FINANZAS"]
+    print(f"  - Unknown mask -> {unknown_responsibles(names).tolist()} (Expected: [True, False, False, False, False])")
+    assert unknown_responsibles(names).tolist() == [True, False, False, False, False]
+
+    out = derive_activity_fields(df, keep_type_tag=True)
+    print(f"  - keep_type_tag -> {out['type_tag'].tolist()} (Expected: ['INT', 'INT+DEP', 'IND-P', 'IND-P'])")
+    assert out["type_tag"].tolist() == ["INT", "INT+DEP", "IND-P", "IND-P"]
+
+    # 7. Import validation (one raw chunk, every value a string)
+    print("Testing import validation...")
+    raw = pd.DataFrame({
+        "_line": [2, 3, 4, 5, 6, 7, 8],
+        "ID": ["T-1", "", "T-3", "T-4", "T-5", "T-6", "T-7"],
+        "Actividad ": ["Uno", "Dos", "", "Cuatro", "Cinco", "Seis", "Siete"],
+        "Sem. inicio": ["1", "2", "1", "x", "5", "", "2"],
+        "Sem. fin": ["2", "2", "1", "3", "4", "", "2"],
+        "Tipo": ["INT", "", "", "", "", "", ""],
+        "Bloqueante": ["TRUE", "no", "", "", "", "", "quizás"],
+        "Evidencia ": ["Acta", "—", "", "", "", "-", ""],
+    })
+    mapping = map_headers([c for c in raw.columns if c != "_line"])
+    valid, errors = validate_chunk(raw, mapping)
+    failed = sorted((e["fila"], e["columna"]) for e in errors)
+    print(f"  - Row errors -> {failed}")
+    print("    (Expected: [(3, 'activity_code'), (4, 'task_name'), (5, 'week_start'), (6, 'week_end'), (8, 'is_gate_blocker')])")
+    assert failed == [(3, "activity_code"), (4, "task_name"), (5, "week_start"), (6, "week_end"), (8, "is_gate_blocker")]
+    print(f"  - Valid rows -> {valid['activity_code'].tolist()} (Expected: ['T-1', 'T-6'])")
+    assert valid["activity_code"].tolist() == ["T-1", "T-6"]
+    assert valid["week_start"].tolist() == [1, 1] and valid["week_end"].tolist() == [2, 1] # Empty weeks -> 1
+    assert valid["is_gate_blocker"].tolist() == [True, False]
+    assert valid["evidence_requirement"].tolist() == ["Acta", None]
+    assert valid["type_tag"].tolist() == ["INT", "IND-P"] # File value kept, empty one derived
+
+    raw = pd.DataFrame({"_line": [2, 3], "ID": ["T-1", "T-2"], "Actividad": ["Uno", "Dos"],
+                        "Resp. primario": ["Patricio", "Astrid/Constanza"]})
+    valid, errors = validate_chunk(raw, map_headers(["ID", "Actividad", "Resp. primario"]))
+    print(f"  - Unknown responsible -> errors {[(e['fila'], e['columna']) for e in errors]} (Expected: [(3, 'primary_role')])")
+    assert [(e["fila"], e["columna"]) for e in errors] == [(3, "primary_role")]
+    assert valid["primary_role"].tolist() == ["FINANZAS"]
+
+    # Same users table -> same role on every entry path (import, CMS save, seed)
+    users = pd.DataFrame({"full_name": ["Juana Pérez", None], "role": ["LEGAL", "COORD"]})
+    name_to_role = users_role_mapping(users)
+    raw = raw.assign(**{"Resp. primario": ["Juana Pérez", "Patricio"]})
+    valid, errors = validate_chunk(raw, map_headers(["ID", "Actividad", "Resp. primario"]), name_to_role)
+    cms = derive_activity_fields(pd.DataFrame({"primary_responsible": ["Juana Pérez", "Patricio"]}), name_to_role)
+    print(f"  - Users mapping -> import {valid['primary_role'].tolist()}, CMS {cms['primary_role'].tolist()} (Expected: both ['LEGAL', 'FINANZAS'])")
+    assert name_to_role == {"Juana Pérez": "LEGAL"} and not errors
+    assert valid["primary_role"].tolist() == cms["primary_role"].tolist() == ["LEGAL", "FINANZAS"]
+
+    try:
+        map_headers(["Producto", "Actividad"])
+        missing = None
+    except ValueError as e:
+        missing = str(e)
+    print(f"  - Missing ID header -> error? {missing is not None} (Expected: True)")
+    assert missing and "activity_code" in missing
+
+    print("All planning tests passed.")
+
+if __name__ == "__main__":
+    run_tests()